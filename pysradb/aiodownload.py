@@ -0,0 +1,317 @@
+"""asyncio download engine for many concurrent small transfers"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import sys
+from functools import partial
+
+from tqdm.autonotebook import tqdm
+
+from .download import _file_md5
+from .download import download_file
+from .exceptions import MD5MismatchException
+from .scheduler import DEFAULT_BACKOFF
+from .scheduler import DEFAULT_HOST_CONNECTIONS
+from .scheduler import DEFAULT_RETRIES
+from .scheduler import host_limit
+from .scheduler import url_host
+
+# Transfers in flight at once
+DEFAULT_ASYNC_CONCURRENCY = 256
+# Small chunks keep memory bounded with thousands of transfers in flight
+ASYNC_BLOCK_SIZE = 64 * 1024
+# Chunks are gathered up to this size before they are written to disk
+ASYNC_WRITE_BUFFER_SIZE = 1024 * 1024
+# Threads doing disk I/O for the event loop, apart from FTP transfers
+ASYNC_DISK_THREADS = 4
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError(
+            "The async download engine requires the optional dependency aiohttp.\n"
+            "Install it with `pip install aiohttp` (or `pip install pysradb[async]`)."
+        )
+    return aiohttp
+
+
+def _write_chunks(f, chunks, md5):
+    data = b"".join(chunks)
+    f.write(data)
+    if md5 is not None:
+        md5.update(data)
+
+
+async def _fetch(session, job, rate_limiter, block_size, disk_executor=None):
+    """Download one HTTP(S) job, resuming from its .part file.
+
+    Hashing the .part prefix, opening the file and writing run on
+    `disk_executor`, so disk I/O does not stall the event loop. Chunks
+    are written ASYNC_WRITE_BUFFER_SIZE at a time.
+    """
+    loop = asyncio.get_running_loop()
+    url = job["url"]
+    file_path = job["file_path"]
+    md5_hash = job.get("md5")
+    if os.path.exists(file_path) and os.path.getsize(file_path):
+        return
+    tmp_file_path = file_path + ".part"
+    first_byte = os.path.getsize(tmp_file_path) if os.path.exists(tmp_file_path) else 0
+    md5 = (
+        await loop.run_in_executor(disk_executor, _file_md5, tmp_file_path)
+        if md5_hash
+        else None
+    )
+    headers = {"Range": "bytes={}-".format(first_byte)} if first_byte else {}
+    async with session.get(url, headers=headers) as r:
+        if first_byte and r.status == 416:
+            # the .part file already holds the whole file
+            file_size = first_byte
+        else:
+            r.raise_for_status()
+            file_mode = "ab"
+            if first_byte and r.status != 206:
+                # the server sent the whole file, start over
+                first_byte = 0
+                file_mode = "wb"
+                md5 = hashlib.md5() if md5_hash else None
+            file_size = -1
+            if r.content_length is not None:
+                file_size = first_byte + r.content_length
+            f = await loop.run_in_executor(
+                disk_executor, open, tmp_file_path, file_mode
+            )
+            buffer = []
+            buffered = 0
+            try:
+                async for chunk in r.content.iter_chunked(block_size):
+                    if rate_limiter is not None:
+                        wait = rate_limiter.reserve(len(chunk))
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= ASYNC_WRITE_BUFFER_SIZE:
+                        # one write at a time, so chunks land in order
+                        await loop.run_in_executor(
+                            disk_executor, _write_chunks, f, buffer, md5
+                        )
+                        buffer = []
+                        buffered = 0
+            finally:
+                # what was received is kept, to resume from on a retry
+                try:
+                    if buffer:
+                        await loop.run_in_executor(
+                            disk_executor, _write_chunks, f, buffer, md5
+                        )
+                finally:
+                    await loop.run_in_executor(disk_executor, f.close)
+    actual_size = os.path.getsize(tmp_file_path)
+    if file_size != -1 and actual_size != file_size:
+        if actual_size > file_size:
+            os.remove(tmp_file_path)
+        raise IOError(
+            "File size mismatch for {}. Expected: {}, Got: {}".format(
+                url, file_size, actual_size
+            )
+        )
+    if md5 is not None and md5.hexdigest() != md5_hash:
+        os.remove(tmp_file_path)
+        raise MD5MismatchException(url)
+    shutil.move(tmp_file_path, file_path)
+
+
+async def _download_jobs(
+    jobs,
+    concurrency,
+    host_connections,
+    retries,
+    backoff,
+    timeout,
+    rate_limiter,
+    block_size,
+    callback,
+    show_progress,
+    telemetry,
+):
+    aiohttp = _import_aiohttp()
+    loop = asyncio.get_running_loop()
+    transfers = asyncio.Semaphore(concurrency)
+    hosts = {}
+    for job in jobs:
+        host = job.get("host") or url_host(job["url"])
+        if host not in hosts:
+            hosts[host] = asyncio.Semaphore(host_limit(host_connections, host))
+    errors = {}
+    pbar = tqdm(total=len(jobs), disable=not show_progress)
+
+    async def run(index, job, session):
+        host = hosts[job.get("host") or url_host(job["url"])]
+        error = None
+        for attempt in range(retries + 1):
+            try:
+                async with host, transfers:
+                    if job["url"].startswith("ftp"):
+                        # FTP has no asyncio client, it runs on a thread
+                        await loop.run_in_executor(
+                            None,
+                            partial(
+                                download_file,
+                                job["url"],
+                                job["file_path"],
+                                md5_hash=job.get("md5"),
+                                timeout=timeout,
+                                rate_limiter=rate_limiter,
+                                telemetry=telemetry,
+                            ),
+                        )
+                        if not os.path.exists(job["file_path"]):
+                            raise IOError("Could not download {}".format(job["url"]))
+                    elif telemetry is not None:
+                        meter = telemetry.meter(rate_limiter)
+                        fetch_error = None
+                        try:
+                            await _fetch(session, job, meter, block_size, disk_executor)
+                        except Exception as e:
+                            fetch_error = e
+                            raise
+                        finally:
+                            telemetry.record(
+                                job["url"], job["file_path"], meter, fetch_error
+                            )
+                    else:
+                        await _fetch(
+                            session, job, rate_limiter, block_size, disk_executor
+                        )
+                error = None
+                break
+            except Exception as e:
+                error = e
+                if attempt < retries:
+                    delay = backoff * 2**attempt
+                    sys.stderr.write(
+                        "Retrying in {}s after error: {}\n".format(delay, e)
+                    )
+                    await asyncio.sleep(delay)
+        if error is not None:
+            errors[index] = error
+        if callback is not None:
+            callback(job, error)
+        pbar.update()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=0)
+    client_timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=timeout, sock_read=timeout
+    )
+    # FTP jobs occupy the default executor for whole transfers
+    disk_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ASYNC_DISK_THREADS
+    )
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=client_timeout
+        ) as session:
+            # tasks queue on the semaphores in the order they are created
+            await asyncio.gather(*[run(i, job, session) for i, job in enumerate(jobs)])
+    finally:
+        disk_executor.shutdown()
+    pbar.close()
+    return errors
+
+
+def download_files_async(
+    jobs,
+    concurrency=DEFAULT_ASYNC_CONCURRENCY,
+    host_connections=DEFAULT_HOST_CONNECTIONS,
+    retries=DEFAULT_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    timeout=60,
+    rate_limiter=None,
+    block_size=ASYNC_BLOCK_SIZE,
+    callback=None,
+    show_progress=True,
+    telemetry=None,
+):
+    """Download many files concurrently on a single asyncio event loop.
+
+    Meant for many small files (single-cell or amplicon runs, GEO
+    supplementary files), where a thread per transfer costs more than the
+    transfer itself. Requires the optional dependency aiohttp. HTTP(S)
+    downloads resume from .part files, are checked against their size and
+    MD5 like `download_file`, and FTP downloads are handed to
+    `download_file` on a worker thread.
+
+    Parameters
+    ----------
+    jobs: list
+          Dicts with url, file_path and optionally md5, host and size.
+          Larger jobs are started first.
+    concurrency: int
+                 Maximum number of transfers in flight
+    host_connections: int or dict
+                      Maximum number of transfers per host, or a dict of
+                      per-host limits
+    retries: int
+             Number of times a failed download is retried
+    backoff: float
+             Seconds to wait before the first retry, doubled after
+             every failed attempt
+    timeout: int
+             Connect and read timeout in seconds
+    rate_limiter: RateLimiter
+                  Bandwidth limit, one token per byte (optional)
+    block_size: int
+                Size of the chunks read from the network
+    callback: callable
+              Called as callback(job, error) once a job has finished,
+              error is None on success
+    show_progress: bool
+                   Show a progress bar of completed jobs
+    telemetry: DownloadTelemetry
+               Records the metrics of every attempt (optional)
+
+    Raises
+    ------
+    RuntimeError
+        If some downloads still failed after all retries
+    """
+    _import_aiohttp()
+
+    def size(job):
+        size = job.get("size")
+        return size if size is not None and size == size else 0
+
+    jobs = sorted(jobs, key=lambda job: -size(job))
+    coroutine = _download_jobs(
+        jobs,
+        concurrency,
+        host_connections,
+        retries,
+        backoff,
+        timeout,
+        rate_limiter,
+        block_size,
+        callback,
+        show_progress,
+        telemetry,
+    )
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        errors = asyncio.run(coroutine)
+    else:
+        # called from a running event loop (for example in Jupyter)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            errors = executor.submit(asyncio.run, coroutine).result()
+    if errors:
+        raise RuntimeError(
+            "{} of {} downloads failed: {}".format(
+                len(errors), len(jobs), "; ".join(map(str, errors.values()))
+            )
+        )
@@ -0,0 +1,286 @@
+"""Batched Aspera (ascp) transfers with retries"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from tqdm.autonotebook import tqdm
+
+from .scheduler import DEFAULT_BACKOFF
+from .scheduler import DEFAULT_RETRIES
+
+# Total target rate (Mbit/s) split across concurrent ascp sessions
+DEFAULT_ASCP_RATE = 300
+DEFAULT_ASCP_PORT = 33001
+DEFAULT_ASCP_USER = "era-fasp"
+# Files handed to a single ascp process
+ASCP_BATCH_SIZE = 100
+# ascp progress lines: <file> <percent>% <size> <rate> <eta>
+ASCP_PROGRESS_RE = re.compile(r"^(\S+)\s+(\d+)%\s")
+# ascp keeps partial files under this suffix until they are complete
+ASCP_PARTIAL_SUFFIX = ".aspx"
+
+
+def parse_aspera_url(url):
+    """Split an aspera URL into user, host and path.
+
+    Parameters
+    ----------
+    url: string
+         For example era-fasp@fasp.sra.ebi.ac.uk:vol1/fastq/SRR000/SRR000001.fastq.gz
+         (the user defaults to era-fasp)
+
+    Returns
+    -------
+    user: string
+    host: string
+    path: string
+    """
+    remote, path = url.split(":", 1)
+    if "@" in remote:
+        user, host = remote.split("@", 1)
+    else:
+        user, host = DEFAULT_ASCP_USER, remote
+    return user, host, path
+
+
+class AsperaTransfer(object):
+    def __init__(
+        self,
+        ascp_bin="ascp",
+        keypath=None,
+        sessions=1,
+        rate=DEFAULT_ASCP_RATE,
+        port=DEFAULT_ASCP_PORT,
+        batch_size=ASCP_BATCH_SIZE,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        show_progress=True,
+    ):
+        """Initialize an Aspera transfer.
+
+        Files are grouped per remote host and handed to ascp in batches
+        through --file-pair-list, so one ascp process moves many files.
+        Batches run in `sessions` concurrent ascp processes that share
+        the target rate. Files that are not complete when ascp exits are
+        retried (ascp resumes them, -k1) in new batches with exponential
+        backoff.
+
+        Parameters
+        ----------
+        ascp_bin: string
+                  Path to the ascp binary
+        keypath: string
+                 Path to the aspera private key
+        sessions: int
+                  Number of concurrent ascp processes
+        rate: int
+              Total target rate in Mbit/s, split evenly across sessions
+        port: int
+              UDP port (-O) and TCP port (-P)
+        batch_size: int
+                    Maximum number of files per ascp process
+        retries: int
+                 Number of times a file is retried
+        backoff: float
+                 Seconds to wait before the first retry, doubled after
+                 every failed attempt
+        show_progress: bool
+                       Show a progress bar of completed files
+        """
+        self.ascp_bin = ascp_bin
+        self.keypath = keypath
+        self.sessions = max(1, sessions)
+        self.rate = rate
+        self.port = port
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.show_progress = show_progress
+        self._lock = threading.Lock()
+
+    def command(self, user, host, pair_list, target_dir):
+        """Build the ascp command for one batch.
+
+        Returns
+        -------
+        command: list
+        """
+        command = [
+            self.ascp_bin,
+            "-k1",
+            "-T",
+            "-l",
+            "{}m".format(max(1, int(self.rate / self.sessions))),
+            "-O",
+            str(self.port),
+            "-P{}".format(self.port),
+            "--mode=recv",
+            "--user={}".format(user),
+            "--host={}".format(host),
+            "--file-pair-list={}".format(pair_list),
+        ]
+        if self.keypath is not None:
+            command += ["-i", self.keypath]
+        return command + [target_dir]
+
+    def _run_batch(self, user, host, batch, target_dir, pbar):
+        """Run ascp on a batch of (path, destination) pairs.
+
+        Returns
+        -------
+        returncode: int
+        output: list
+                Last lines printed by ascp, for error reporting
+        """
+        fd, pair_list = tempfile.mkstemp(prefix="pysradb_ascp_", suffix=".txt")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for path, destination in batch:
+                    f.write("{}\n{}\n".format(path, destination))
+            process = subprocess.Popen(
+                self.command(user, host, pair_list, target_dir),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+            output = []
+            for line in process.stdout:
+                # progress is redrawn with carriage returns
+                for line in line.replace("\r", "\n").split("\n"):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    output = (output + [line])[-5:]
+                    match = ASCP_PROGRESS_RE.match(line)
+                    if match and pbar is not None:
+                        pbar.set_postfix_str(line[:60], refresh=False)
+            return process.wait(), output
+        finally:
+            os.remove(pair_list)
+
+    @staticmethod
+    def _is_complete(file_path):
+        return os.path.exists(file_path) and not os.path.exists(
+            file_path + ASCP_PARTIAL_SUFFIX
+        )
+
+    def run(self, urls, destinations, target_dir, callback=None):
+        """Download files with ascp.
+
+        Parameters
+        ----------
+        urls: list
+              Aspera URLs, see `parse_aspera_url`
+        destinations: list
+                      Destination of each file, relative to `target_dir`
+        target_dir: string
+                    Download directory
+        callback: callable
+                  Called as callback(url, error) once a file is complete,
+                  or has failed every attempt. error is None on success.
+
+        Returns
+        -------
+        status: OrderedDict
+                "done" or "failed" for every URL
+
+        Raises
+        ------
+        RuntimeError
+            If some files still failed after all retries
+        """
+        target_dir = os.path.abspath(target_dir)
+        status = OrderedDict((url, "pending") for url in urls)
+        pending = OrderedDict()
+        for url, destination in zip(urls, destinations):
+            if self._is_complete(os.path.join(target_dir, destination)):
+                status[url] = "done"
+                if callback is not None:
+                    callback(url, None)
+                continue
+            user, host, path = parse_aspera_url(url)
+            os.makedirs(
+                os.path.dirname(os.path.join(target_dir, destination)), exist_ok=True
+            )
+            pending[url] = (user, host, path, destination)
+        pbar = tqdm(total=len(pending), disable=not self.show_progress)
+        errors = []
+        for attempt in range(self.retries + 1):
+            if not pending:
+                break
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                sys.stderr.write(
+                    "Retrying {} aspera transfers in {}s\n".format(len(pending), delay)
+                )
+                time.sleep(delay)
+            batches = []
+            by_remote = OrderedDict()
+            for url, (user, host, path, destination) in pending.items():
+                by_remote.setdefault((user, host), []).append((url, path, destination))
+            for (user, host), files in by_remote.items():
+                # spread the files over the sessions
+                n_batches = max(
+                    min(self.sessions, len(files)),
+                    -(-len(files) // self.batch_size),
+                )
+                for i in range(n_batches):
+                    batches.append((user, host, files[i::n_batches]))
+            errors = []
+            threads = []
+            queue = list(batches)
+
+            def worker():
+                while True:
+                    with self._lock:
+                        if not queue:
+                            return
+                        user, host, files = queue.pop(0)
+                    returncode, output = self._run_batch(
+                        user,
+                        host,
+                        [(path, destination) for _, path, destination in files],
+                        target_dir,
+                        pbar,
+                    )
+                    with self._lock:
+                        for url, _, destination in files:
+                            if self._is_complete(os.path.join(target_dir, destination)):
+                                status[url] = "done"
+                                pbar.update()
+                                if callback is not None:
+                                    callback(url, None)
+                        if returncode != 0:
+                            errors.append(
+                                "ascp exited with {}: {}".format(
+                                    returncode, " | ".join(output)
+                                )
+                            )
+
+            for _ in range(min(self.sessions, len(batches))):
+                thread = threading.Thread(target=worker, daemon=True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            pending = OrderedDict(
+                (url, job) for url, job in pending.items() if status[url] != "done"
+            )
+        pbar.close()
+        for url in pending:
+            status[url] = "failed"
+            if callback is not None:
+                callback(url, RuntimeError("; ".join(errors) or "incomplete transfer"))
+        if pending:
+            raise RuntimeError(
+                "{} of {} aspera transfers failed: {}".format(
+                    len(pending), len(urls), "; ".join(errors)
+                )
+            )
+        return status
@@ -1,7 +1,10 @@
+import concurrent.futures
 import os
 import sqlite3
 import sys
+import threading
 import warnings
+import weakref
 
 import pandas as pd
 
@@ -9,9 +12,71 @@ from .utils import _extract_first_field
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
+# Bound parameters per statement (SQLITE_MAX_VARIABLE_NUMBER before 3.32)
+SQLITE_MAX_VARIABLES = 999
+# Prepared statements cached per connection
+CACHED_STATEMENTS = 256
+# Rows fetched from the cursor at a time when building DataFrames
+QUERY_CHUNKSIZE = 10000
+# Page cache per connection in KiB (a negative cache_size is in KiB)
+SQLITE_CACHE_SIZE_KIB = 256 * 1024
+# Bytes of the file to memory-map, capped by SQLite at SQLITE_MAX_MMAP_SIZE
+SQLITE_MMAP_SIZE = 64 * 1024**3
+# Applied to every connection: the metadata files are only read
+READ_PRAGMAS = [
+    "PRAGMA cache_size = -{}".format(SQLITE_CACHE_SIZE_KIB),
+    "PRAGMA mmap_size = {}".format(SQLITE_MMAP_SIZE),
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA query_only = ON",
+]
+
+
+def _padded_size(n, chunk_size):
+    """Round `n` up to a power of two, at most `chunk_size`."""
+    size = 1
+    while size < n:
+        size *= 2
+    return min(size, chunk_size)
+
+
+def chunk_params(values, chunk_size=SQLITE_MAX_VARIABLES):
+    """Split values into chunks of bound parameters.
+
+    Chunks are padded (repeating their last value) to a power of two,
+    so a handful of distinct statements serve any number of values and
+    stay in the prepared statement cache.
+
+    Parameters
+    ----------
+    values: list
+            Values to bind
+    chunk_size: int
+                Maximum number of values per chunk
+
+    Returns
+    -------
+    chunks: list
+            (placeholders, params) tuples, where placeholders is a
+            string like "?,?,?,?" to format into the statement
+    """
+    chunks = []
+    for i in range(0, len(values), chunk_size):
+        chunk = list(values[i : i + chunk_size])
+        size = _padded_size(len(chunk), chunk_size)
+        chunk += chunk[-1:] * (size - len(chunk))
+        chunks.append((",".join(["?"] * size), chunk))
+    return chunks
+
+
+class _ThreadConnection(object):
+    """Holds the connection of one thread, closed when the thread exits."""
+
+    def __init__(self, db):
+        self.db = db
+
 
 class BASEdb(object):
-    def __init__(self, sqlite_file):
+    def __init__(self, sqlite_file, immutable=False, threads=1):
         """Initialize SRAdb.
 
         Parameters
@@ -19,22 +84,110 @@ class BASEdb(object):
 
         sqlite_file: string
                      Path to unzipped SRAmetadb.sqlite file
+        immutable: bool
+                   Open the file as immutable: SQLite skips all locking
+                   and change detection. Only safe if nothing writes to
+                   or replaces the file while it is open.
+        threads: int
+                 Number of pooled connections chunked lookups
+                 (`query_in`) are spread over
 
 
         """
         self.sqlite_file = sqlite_file
+        self.immutable = immutable
+        self.threads = max(1, threads)
+        self._connections = []
+        # finalizers closing the connections of other threads
+        self._thread_connections = set()
+        self._connections_lock = threading.Lock()
+        # idle connections of the pool used by `map_query`
+        self._pool = []
         self.open()
         self.cursor = self.db.cursor()
 
+    def _connect(self, register=True):
+        """Open a read-only connection with the READ_PRAGMAS profile."""
+        uri = "file:{}?mode=ro".format(self.sqlite_file)
+        if self.immutable:
+            uri += "&immutable=1"
+        # connections are used by one thread at a time, but can be
+        # closed from another one
+        db = sqlite3.connect(
+            uri,
+            uri=True,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False,
+        )
+        db.text_factory = str
+        for pragma in READ_PRAGMAS:
+            db.execute(pragma)
+        if register:
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
+    def _check_open(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+
     def open(self):
         """Open sqlite connection."""
         # Originally sqlite3.connect(self.sqlite_file)
-        self.db = sqlite3.connect("file:{}?mode=ro".format(self.sqlite_file), uri=True)
-        self.db.text_factory = str
+        self._closed = False
+        self.db = self._connect()
+        self._local = threading.local()
+        self._local.holder = _ThreadConnection(self.db)
+
+    def connection(self):
+        """Get the sqlite connection of the calling thread.
+
+        sqlite3 connections cannot be shared by threads, so every thread
+        querying this database gets a connection of its own, opened on
+        first use with the same settings and closed when the thread exits.
+
+        Returns
+        -------
+        connection: sqlite3.Connection
+        """
+        self._check_open()
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            db = self._connect(register=False)
+            holder = self._local.holder = _ThreadConnection(db)
+            # the thread-local holder is dropped when the thread exits
+            finalizer = weakref.finalize(holder, db.close)
+            with self._connections_lock:
+                self._thread_connections = set(
+                    f for f in self._thread_connections if f.alive
+                )
+                self._thread_connections.add(finalizer)
+        return holder.db
+
+    def _acquire(self):
+        """Take a connection from the pool, opening one if none is idle."""
+        self._check_open()
+        with self._connections_lock:
+            if self._pool:
+                return self._pool.pop()
+        return self._connect()
+
+    def _release(self, db):
+        """Return a connection to the pool."""
+        with self._connections_lock:
+            self._pool.append(db)
 
     def close(self):
         """Close sqlite connection."""
-        self.db.close()
+        with self._connections_lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+            finalizers, self._thread_connections = self._thread_connections, set()
+            self._pool = []
+        for db in connections:
+            db.close()
+        for finalizer in finalizers:
+            finalizer()
 
     def list_tables(self):
         """List all tables in the sqlite file.
@@ -44,9 +197,11 @@ class BASEdb(object):
         table_list: list
                     List of all table names
         """
-        results = self.cursor.execute(
-            'SELECT name FROM sqlite_master WHERE type="table";'
-        ).fetchall()
+        results = (
+            self.connection()
+            .execute('SELECT name FROM sqlite_master WHERE type="table";')
+            .fetchall()
+        )
         return _extract_first_field(results)
 
     def list_fields(self, table):
@@ -63,7 +218,7 @@ class BASEdb(object):
         field_list: list
                     A list of field names for the table
         """
-        results = self.cursor.execute("SELECT * FROM {}".format(table))
+        results = self.connection().execute("SELECT * FROM {}".format(table))
         return _extract_first_field(results.description)
 
     def desc_table(self, table):
@@ -81,9 +236,11 @@ class BASEdb(object):
                     A DataFrame with field name and its
                     schema description
         """
-        results = self.cursor.execute(
-            'PRAGMA table_info("{}")'.format(table)
-        ).fetchall()
+        results = (
+            self.connection()
+            .execute('PRAGMA table_info("{}")'.format(table))
+            .fetchall()
+        )
         columns = ["cid", "name", "dtype", "notnull", "dflt_value", "pk"]
         data = []
         for result in results:
@@ -91,13 +248,73 @@ class BASEdb(object):
         table_desc = pd.DataFrame(data, columns=columns)
         return table_desc
 
-    def query(self, sql_query):
+    def _iter_query(
+        self,
+        sql_query,
+        params=(),
+        chunksize=QUERY_CHUNKSIZE,
+        dtype=None,
+        connection=None,
+    ):
+        """Yield the results of a query as DataFrames of `chunksize` rows.
+
+        Each chunk is built column by column straight from fetchmany,
+        so only one chunk of rows is held as Python objects at a time.
+        """
+        # a cursor of its own, so several iterators can run side by side
+        cursor = (connection or self.connection()).cursor()
+        try:
+            cursor.execute(sql_query, params)
+            column_names = [x[0] for x in cursor.description]
+            # a column selected twice is kept once, at its first position
+            # and with its last value, like dict(zip(column_names, row))
+            positions = {}
+            for i, column in enumerate(column_names):
+                positions[column] = i
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                df = pd.DataFrame(
+                    {column: list(columns[i]) for column, i in positions.items()}
+                )
+                if dtype:
+                    df = df.astype({k: v for k, v in dtype.items() if k in df.columns})
+                yield df
+        finally:
+            cursor.close()
+
+    def _query(
+        self,
+        sql_query,
+        params=(),
+        chunksize=QUERY_CHUNKSIZE,
+        dtype=None,
+        connection=None,
+    ):
+        dfs = list(self._iter_query(sql_query, params, chunksize, dtype, connection))
+        if not dfs:
+            return pd.DataFrame()
+        if len(dfs) == 1:
+            return dfs[0]
+        df = pd.concat(dfs, ignore_index=True)
+        # chunks of only NULLs leave object columns behind
+        return df.infer_objects()
+
+    def query(self, sql_query, params=None, dtype=None):
         """Run SQL query.
 
         Parameters
         ----------
         sql_query: string
                    SQL query string
+        params: list or dict
+                Values bound to the ? (or :name) placeholders of the query
+        dtype: dict
+               dtypes of (some of) the columns, for example
+               {"spots": "int64", "taxon_id": "int32"}. Applied
+               to every chunk of rows as it is fetched.
 
         Returns
         -------
@@ -105,15 +322,111 @@ class BASEdb(object):
                  Query results formatted as dataframe
 
         """
-        results = self.cursor.execute(sql_query).fetchall()
-        column_names = list([x[0] for x in self.cursor.description])
-        results = [dict(list(zip(column_names, result))) for result in results]
-        df = pd.DataFrame(results)
-        if not results:
+        df = self._query(sql_query, params or (), dtype=dtype)
+        if not len(df.index):
             # sys.stderr.write("Found no matching results for query: {}".format(sql_query))
             sys.stderr.write("Found no matching results for query.\n")
         return df
 
+    def query_iter(self, sql_query, params=None, chunksize=QUERY_CHUNKSIZE, dtype=None):
+        """Run SQL query, yielding the results in chunks.
+
+        Parameters
+        ----------
+        sql_query: string
+                   SQL query string
+        params: list or dict
+                Values bound to the placeholders of the query
+        chunksize: int
+                   Number of rows per DataFrame
+        dtype: dict
+               dtypes of (some of) the columns, see `query`
+
+        Yields
+        ------
+        results: DataFrame
+                 Up to `chunksize` rows of the results
+        """
+        for df in self._iter_query(sql_query, params or (), chunksize, dtype):
+            yield df
+
+    def query_in(self, sql_query, values, chunk_size=SQLITE_MAX_VARIABLES):
+        """Run a query for a long list of values, in chunks.
+
+        Parameters
+        ----------
+        sql_query: string
+                   SQL query string with a single {} where the list of
+                   placeholders goes, for example
+                   "SELECT * FROM run WHERE run_accession IN ({})"
+        values: list
+                Values bound to the placeholders. Duplicates are dropped.
+        chunk_size: int
+                    Maximum number of values bound per statement
+
+        The chunks are run in parallel over `threads` pooled connections.
+
+        Returns
+        -------
+        results: DataFrame
+                 Query results of all chunks formatted as dataframe
+        """
+        values = list(dict.fromkeys(values))
+        queries = [
+            (sql_query.format(placeholders), params)
+            for placeholders, params in chunk_params(values, chunk_size)
+        ]
+        if self.threads > 1 and len(queries) > 1:
+            dfs = self.map_query(queries, threads=self.threads)
+        else:
+            dfs = [self._query(sql, params) for sql, params in queries]
+        dfs = [df for df in dfs if len(df.index)]
+        if not dfs:
+            sys.stderr.write("Found no matching results for query.\n")
+            return pd.DataFrame()
+        return pd.concat(dfs, ignore_index=True)
+
+    def map_query(self, queries, threads=None, dtype=None):
+        """Run many queries in parallel over pooled read-only connections.
+
+        Each query runs on a connection taken from a pool of at most
+        `threads` connections, which are kept open for later calls.
+        SQLite releases the GIL while it searches the file, so lookups
+        spread over several connections use several cores.
+
+        Parameters
+        ----------
+        queries: list
+                 SQL query strings, or (query, params) tuples
+        threads: int
+                 Number of queries run at once (default: number of CPUs)
+        dtype: dict
+               dtypes of (some of) the columns, see `query`
+
+        Returns
+        -------
+        results: list
+                 One DataFrame per query, in the order of `queries`
+        """
+        queries = [
+            (query, ()) if isinstance(query, str) else query for query in queries
+        ]
+        if not queries:
+            return []
+        threads = threads or os.cpu_count() or 1
+
+        def run(query):
+            db = self._acquire()
+            try:
+                return self._query(query[0], query[1], dtype=dtype, connection=db)
+            finally:
+                self._release(db)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(threads, len(queries))
+        ) as executor:
+            return list(executor.map(run, queries))
+
     def get_row_count(self, table):
         """Get row counts for a table.
 
@@ -128,9 +441,11 @@ class BASEdb(object):
         row_count: int
                    Number of rows in table
         """
-        return self.cursor.execute(
-            "SELECT max(rowid) FROM {}".format(table)
-        ).fetchone()[0]
+        return (
+            self.connection()
+            .execute("SELECT max(rowid) FROM {}".format(table))
+            .fetchone()[0]
+        )
 
     def all_row_counts(self):
         """Get row counts of all tables in the db file.
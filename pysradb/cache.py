@@ -0,0 +1,234 @@
+"""Persistent on-disk cache for SRA/GEO/ENA lookups"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from .exceptions import CacheMissException
+from .utils import mkdir_p
+
+DAY = 24 * 60 * 60
+# Time to live (seconds) per endpoint
+DEFAULT_TTL = {
+    "esummary": 7 * DAY,
+    "efetch": 7 * DAY,
+    "ena_filereport": DAY,
+    "ena_search": DAY,
+    "file_size": 7 * DAY,
+}
+# Time to live for endpoints not listed above
+FALLBACK_TTL = 7 * DAY
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def _default_cache_path():
+    cache_home = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(cache_home, "pysradb", "responses.sqlite")
+
+
+def _normalize_params(params):
+    """Normalize query parameters so equivalent lookups share a key.
+
+    Accession lists are de-duplicated and sorted, strings are stripped.
+    """
+    normalized = {}
+    for key, value in params.items():
+        if isinstance(value, (list, tuple, set)):
+            value = sorted(set(str(x).strip() for x in value))
+            if len(value) == 1:
+                value = value[0]
+        elif isinstance(value, str):
+            value = value.strip()
+        normalized[key] = value
+    return normalized
+
+
+class ResponseCache(object):
+    def __init__(self, path=None, ttl=None, max_size=DEFAULT_MAX_SIZE, offline=False):
+        """Initialize a persistent response cache.
+
+        Responses are stored in a SQLite file keyed by the endpoint and
+        its normalized parameters. Entries older than the endpoint's TTL
+        are ignored, and the least recently used entries are evicted once
+        the cache grows beyond `max_size` bytes.
+
+        Parameters
+        ----------
+        path: string
+              Location of the cache file.
+              Defaults to ~/.cache/pysradb/responses.sqlite
+        ttl: int or dict
+             Time to live in seconds, either for all endpoints or as a
+             dict keyed by endpoint ("esummary", "efetch", "ena_filereport",
+             "ena_search")
+             overriding DEFAULT_TTL. A TTL of None never expires.
+        max_size: int
+                  Maximum size of the cached responses in bytes
+        offline: bool
+                 Only answer from the cache. A lookup that is not cached
+                 raises CacheMissException instead of hitting the network.
+        """
+        if path is None:
+            path = _default_cache_path()
+        mkdir_p(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self.ttl = dict(DEFAULT_TTL)
+        if isinstance(ttl, dict):
+            self.ttl.update(ttl)
+        elif ttl is not None:
+            self.ttl = {endpoint: ttl for endpoint in self.ttl}
+        self.max_size = max_size
+        self.offline = offline
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, endpoint TEXT, created REAL, "
+            "accessed REAL, size INTEGER, value BLOB)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """Create the cache key for an endpoint and its parameters.
+
+        Parameters
+        ----------
+        endpoint: string
+                  Name of the endpoint
+        params: dict
+                Query parameters
+
+        Returns
+        -------
+        key: string
+        """
+        normalized = json.dumps(
+            [endpoint, _normalize_params(params)], sort_keys=True, default=str
+        )
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, endpoint, params):
+        """Get a cached response.
+
+        Parameters
+        ----------
+        endpoint: string
+                  Name of the endpoint
+        params: dict
+                Query parameters
+
+        Returns
+        -------
+        value: object
+               Cached response, or None if not cached or expired
+        """
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT created, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            created, value = row
+            ttl = self.ttl.get(endpoint, FALLBACK_TTL)
+            if ttl is not None and now - created > ttl:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.db.commit()
+        return json.loads(
+            zlib.decompress(value).decode("utf-8"), object_pairs_hook=OrderedDict
+        )
+
+    def set(self, endpoint, params, value):
+        """Store a response.
+
+        Parameters
+        ----------
+        endpoint: string
+                  Name of the endpoint
+        params: dict
+                Query parameters
+        value: object
+               JSON serializable response
+        """
+        key = self.make_key(endpoint, params)
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, now, now, len(blob), blob),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until under max_size."""
+        if self.max_size is None:
+            return
+        total = self.db.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+        if not total or total <= self.max_size:
+            return
+        rows = self.db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall()
+        evict = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evict.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+    def get_or_fetch(self, endpoint, params, fetch):
+        """Get a cached response, fetching and storing it if missing.
+
+        Parameters
+        ----------
+        endpoint: string
+                  Name of the endpoint
+        params: dict
+                Query parameters
+        fetch: callable
+               Called without arguments to fetch the response on a miss.
+               None responses are not cached.
+
+        Returns
+        -------
+        value: object
+        """
+        value = self.get(endpoint, params)
+        if value is not None:
+            return value
+        if self.offline:
+            raise CacheMissException(endpoint, params)
+        value = fetch()
+        if value is not None:
+            self.set(endpoint, params, value)
+        return value
+
+    def clear(self):
+        """Remove all cached responses."""
+        with self._lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+
+    def close(self):
+        """Close the cache file."""
+        self.db.close()
@@ -14,12 +14,15 @@ from . import __version__
 from .exceptions import IncorrectFieldException
 from .exceptions import MissingQueryException
 from .geoweb import GEOweb
+from .scheduler import DEFAULT_HOST_CONNECTIONS
 from .search import EnaSearch
 from .search import GeoSearch
 from .search import SraSearch
 from .sradb import SRAdb
 from .sradb import download_sradb_file
+from .sraindex import build_accession_index
 from .sraweb import SRAweb
+from .telemetry import DownloadTelemetry
 from .utils import confirm
 
 pd.set_option("display.max_rows", None)
@@ -79,6 +82,16 @@ def metadata(srp_id, assay, desc, detailed, expand, saveto):
 ################################################################
 
 
+###################### metadb ##############################
+def metadb(action, db, index_file):
+    if action == "index":
+        index_file = build_accession_index(db, index_file)
+        print("Accession index written to {}".format(index_file))
+
+
+################################################################
+
+
 ################# download ##########################
 def download(
     out_dir,
@@ -89,43 +102,74 @@ def download(
     col="public_url",
     use_ascp=False,
     threads=1,
+    segments=1,
+    host_connections=DEFAULT_HOST_CONNECTIONS,
+    max_bandwidth=None,
+    engine="thread",
+    metrics_jsonl=None,
+    metrics_prom=None,
 ):
     if out_dir is None:
         out_dir = os.path.join(os.getcwd(), "pysradb_downloads")
+    if max_bandwidth:
+        # MB/s on the command line
+        max_bandwidth = max_bandwidth * 1e6
+    telemetry = None
+    if metrics_jsonl or metrics_prom:
+        telemetry = DownloadTelemetry(
+            jsonl_path=metrics_jsonl, prometheus_path=metrics_prom
+        )
     sradb = SRAweb()
     geoweb = GEOweb()
-    # This block is triggered only if no -p or -g arguments are provided.
-    # In this case, the input is taken from the pipe and assumed to be SRA, not GEO
-    # TODO: at some point, we need to fix this
-    if not srp and not geo:
-        df = pd.read_csv(sys.stdin, sep="\t")
-        sradb.download(
-            df=df,
-            out_dir=out_dir,
-            filter_by_srx=srx,
-            skip_confirmation=True,
-            use_ascp=use_ascp,
-            url_col=col,
-            threads=threads,
-        )
-    # This block is triggered for downloads using the -p argument
-    if srp:
-        for srp_x in srp:
-            metadata = sradb.sra_metadata(srp_x, detailed=True)
+    try:
+        # This block is triggered only if no -p or -g arguments are provided.
+        # In this case, the input is taken from the pipe and assumed to be SRA, not GEO
+        # TODO: at some point, we need to fix this
+        if not srp and not geo:
+            df = pd.read_csv(sys.stdin, sep="\t")
             sradb.download(
-                df=metadata,
+                df=df,
                 out_dir=out_dir,
                 filter_by_srx=srx,
-                skip_confirmation=skip_confirmation,
+                skip_confirmation=True,
                 use_ascp=use_ascp,
+                url_col=col,
                 threads=threads,
+                segments=segments,
+                host_connections=host_connections,
+                max_bandwidth=max_bandwidth,
+                engine=engine,
+                telemetry=telemetry,
             )
-    # This block is triggered for downloads using the -g argument
-    if geo:
-        for geo_x in geo:
-            links, root_url = geoweb.get_download_links(geo_x)
-            geoweb.download(links=links, root_url=root_url, gse=geo_x, out_dir=out_dir)
-    sradb.close()
+        # This block is triggered for downloads using the -p argument
+        if srp:
+            for srp_x in srp:
+                metadata = sradb.sra_metadata(srp_x, detailed=True)
+                sradb.download(
+                    df=metadata,
+                    out_dir=out_dir,
+                    filter_by_srx=srx,
+                    skip_confirmation=skip_confirmation,
+                    use_ascp=use_ascp,
+                    threads=threads,
+                    segments=segments,
+                    host_connections=host_connections,
+                    max_bandwidth=max_bandwidth,
+                    engine=engine,
+                    telemetry=telemetry,
+                )
+        # This block is triggered for downloads using the -g argument
+        if geo:
+            for geo_x in geo:
+                links, root_url = geoweb.get_download_links(geo_x)
+                geoweb.download(
+                    links=links, root_url=root_url, gse=geo_x, out_dir=out_dir
+                )
+    finally:
+        # metrics of failed runs are written too
+        sradb.close()
+        if telemetry is not None:
+            telemetry.close()
 
 
 #########################################################
@@ -599,6 +643,24 @@ def parse_args(args=None):
     subparser.add_argument("srp_id", nargs="+")
     subparser.set_defaults(func=metadata)
 
+    # pysradb metadb
+    subparser = subparsers.add_parser(
+        "metadb", help="Manage a local SRAmetadb.sqlite file"
+    )
+    subparser.add_argument(
+        "action",
+        choices=["index"],
+        help="index: build the accession index used by SRAdb for fast conversions",
+    )
+    subparser.add_argument(
+        "--db", required=True, help="Path to SRAmetadb.sqlite", metavar="PATH"
+    )
+    subparser.add_argument(
+        "--index-file",
+        help="Path of the index (default: next to the SRAmetadb file)",
+    )
+    subparser.set_defaults(func=metadb)
+
     # pysradb download
     subparser = subparsers.add_parser("download", help="Download SRA project (SRPnnnn)")
     subparser.add_argument("--out-dir", help="Output directory root")
@@ -617,6 +679,37 @@ def parse_args(args=None):
     subparser.add_argument(
         "--threads", "-t", help="Number of threads", default=1, type=int
     )
+    subparser.add_argument(
+        "--segments",
+        help="Number of connections per file (HTTP byte ranges)",
+        default=1,
+        type=int,
+    )
+    subparser.add_argument(
+        "--host-connections",
+        help="Maximum number of files downloaded at once from the same host",
+        default=DEFAULT_HOST_CONNECTIONS,
+        type=int,
+    )
+    subparser.add_argument(
+        "--max-bandwidth",
+        help="Total download bandwidth in MB/s (default: unlimited)",
+        type=float,
+    )
+    subparser.add_argument(
+        "--engine",
+        choices=["thread", "async"],
+        default="thread",
+        help="Download engine, async is suited to many small files (needs aiohttp)",
+    )
+    subparser.add_argument(
+        "--metrics-jsonl",
+        help="Append per-file download metrics to this file as JSON lines",
+    )
+    subparser.add_argument(
+        "--metrics-prom",
+        help="Write per-host download metrics to this Prometheus text file",
+    )
     subparser.set_defaults(func=download)
 
     # pysradb search
@@ -1177,6 +1270,8 @@ def parse_args(args=None):
             args.expand,
             args.saveto,
         )
+    elif args.command == "metadb":
+        metadb(args.action, args.db, args.index_file)
     elif args.command == "download":
         download(
             args.out_dir,
@@ -1187,6 +1282,12 @@ def parse_args(args=None):
             args.col,
             args.use_ascp,
             args.threads,
+            args.segments,
+            args.host_connections,
+            args.max_bandwidth,
+            args.engine,
+            args.metrics_jsonl,
+            args.metrics_prom,
         )
     elif args.command == "search":
         flags = vars(args)
@@ -1,52 +1,114 @@
 """Utility function to download data"""
 
+import concurrent.futures
 import hashlib
+import json
 import math
 import os
 import shutil
 import sys
+import threading
 import warnings
+from collections import OrderedDict
 from urllib.parse import urlparse
-from ftplib import FTP
+from ftplib import error_perm
 
 import numpy as np
 import requests
 from tqdm.autonotebook import tqdm
 
-from .utils import requests_3_retries
+from .exceptions import MD5MismatchException
+from .transport import get_default_ftp_pool
+from .transport import get_default_transport
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 import pandas as pd
 
 tqdm.pandas()
 
+# Segmented downloads: files are split in at least this large byte ranges
+MIN_SEGMENT_SIZE = 32 * 1024 * 1024
+# Segment progress is saved after every this many bytes
+SEGMENT_CHECKPOINT_SIZE = 16 * 1024 * 1024
+# Concurrent requests used to look up file sizes before downloading
+FILE_SIZE_THREADS = 16
+# Control connections opened per FTP host to look up file sizes
+FTP_SIZE_CONNECTIONS = 4
 
-def _get_ftp_file_size(url):
+
+def _get_ftp_file_size(url, ftp_pool=None):
     """Get file size from FTP server.
 
     Parameters
     ----------
     url : str
         FTP URL
+    ftp_pool : FTPConnectionPool
+        Pool of FTP connections to use (optional)
 
     Returns
     -------
     size : int
         File size in bytes, or 0 if unable to determine
     """
-    try:
-        parsed = urlparse(url)
-        ftp = FTP(parsed.netloc)
-        ftp.login()
-        size = ftp.size(parsed.path)
-        ftp.quit()
-        return size if size is not None else 0
-    except Exception:
-        return 0
+    parsed = urlparse(url)
+    return _get_ftp_file_sizes(parsed.netloc, [parsed.path], ftp_pool=ftp_pool)[0]
+
+
+def _get_ftp_file_sizes(host, paths, timeout=10, ftp_pool=None):
+    """Get the sizes of several files over a single FTP connection.
+
+    Parameters
+    ----------
+    host : str
+        FTP host
+    paths : list
+        File paths on the host
+    ftp_pool : FTPConnectionPool
+        Pool of FTP connections to use (optional)
+
+    Returns
+    -------
+    sizes : list
+        File size in bytes for each path, 0 if unable to determine
+    """
+    if ftp_pool is None:
+        ftp_pool = get_default_ftp_pool()
+    sizes = []
+    failures = 0
+    while len(sizes) < len(paths):
+        connected = False
+        try:
+            with ftp_pool.connection(host, timeout) as ftp:
+                connected = True
+                for path in paths[len(sizes) :]:
+                    try:
+                        sizes.append(ftp.size(path) or 0)
+                    except error_perm:
+                        # missing file, the connection is still usable
+                        sizes.append(0)
+                    failures = 0
+        except Exception:
+            if not connected:
+                # the host is unreachable, do not wait for it once per path
+                break
+            # reconnect once if the control connection was dropped
+            failures += 1
+            if failures == 2:
+                sizes.append(0)
+                failures = 0
+    return sizes + [0] * (len(paths) - len(sizes))
 
 
 def _download_ftp_file(
-    url, file_path, timeout=10, block_size=1024 * 1024, show_progress=False
+    url,
+    file_path,
+    timeout=10,
+    block_size=1024 * 1024,
+    show_progress=False,
+    rate_limiter=None,
+    ftp_pool=None,
+    md5_hash=None,
 ):
     """Download file from FTP server.
 
@@ -62,49 +124,65 @@ def _download_ftp_file(
         Block size for downloading
     show_progress : bool
         Show progress bar
+    rate_limiter : RateLimiter
+        Bandwidth limit, one token per byte (optional)
+    ftp_pool : FTPConnectionPool
+        Pool of FTP connections to use (optional)
+    md5_hash : str
+        Expected MD5, checked as the data is written (optional)
     """
+    if ftp_pool is None:
+        ftp_pool = get_default_ftp_pool()
     parsed = urlparse(url)
     tmp_file_path = file_path + ".part"
 
     # Check if partial file exists
     first_byte = os.path.getsize(tmp_file_path) if os.path.exists(tmp_file_path) else 0
     file_mode = "ab" if first_byte else "wb"
+    md5 = _file_md5(tmp_file_path) if md5_hash else None
 
     try:
-        ftp = FTP(parsed.netloc, timeout=timeout)
-        ftp.login()
-
-        file_size = ftp.size(parsed.path)
-        if file_size is None:
-            file_size = -1
-
-        if show_progress and file_size > 0:
-            desc = "Downloading {}".format(url.split("/")[-1])
-            pbar = tqdm(
-                total=file_size,
-                initial=first_byte,
-                unit="B",
-                unit_scale=True,
-                desc=desc,
-            )
-
-        with open(tmp_file_path, file_mode) as f:
-            if first_byte > 0:
-                ftp.voidcmd(f"REST {first_byte}")
-
-            def callback(data):
-                f.write(data)
-                if show_progress and file_size > 0:
-                    pbar.update(len(data))
+        # the connection is discarded if the transfer is cut mid-way
+        with ftp_pool.connection(parsed.netloc, timeout) as ftp:
+            file_size = ftp.size(parsed.path)
+            if file_size is None:
+                file_size = -1
+
+            if show_progress and file_size > 0:
+                desc = "Downloading {}".format(url.split("/")[-1])
+                pbar = tqdm(
+                    total=file_size,
+                    initial=first_byte,
+                    unit="B",
+                    unit_scale=True,
+                    desc=desc,
+                )
 
-            ftp.retrbinary(f"RETR {parsed.path}", callback, blocksize=block_size)
+            with open(tmp_file_path, file_mode) as f:
+
+                def callback(data):
+                    if rate_limiter is not None:
+                        rate_limiter.acquire(len(data))
+                    f.write(data)
+                    if md5 is not None:
+                        md5.update(data)
+                    if show_progress and file_size > 0:
+                        pbar.update(len(data))
+
+                ftp.retrbinary(
+                    f"RETR {parsed.path}",
+                    callback,
+                    blocksize=block_size,
+                    rest=first_byte or None,
+                )
 
         if show_progress and file_size > 0:
             pbar.close()
 
-        ftp.quit()
-
         if file_size == -1 or file_size == os.path.getsize(tmp_file_path):
+            if md5 is not None and md5.hexdigest() != md5_hash:
+                os.remove(tmp_file_path)
+                raise MD5MismatchException(url)
             shutil.move(tmp_file_path, file_path)
         else:
             raise Exception(
@@ -114,6 +192,8 @@ def _download_ftp_file(
     except Exception as e:
         if show_progress and "pbar" in locals():
             pbar.close()
+        if isinstance(e, MD5MismatchException):
+            raise
         raise Exception(f"FTP download failed: {e}")
 
 
@@ -142,36 +222,22 @@ def millify(n):
     return "{:.1f}{}".format(n / 10 ** (3 * millidx), millnames[millidx])
 
 
-def get_file_size(row, url_col):
-    """Get size of file to be downloaded.
-
-    Parameters
-    ----------
-    row: pd.DataFrame row
-
-    url_col: str
-        url_column
-
-    Returns
-    -------
-    content_length: int
-    """
+def _file_size_url(row, url_col):
+    """Get the URL whose size is looked up for a download row."""
     if row[url_col] is not None:
         url = row[url_col]
     else:
-        url = row.download_url
-    if url is pd.NA:
-        return 0
-    if not isinstance(url, str):
-        return 0
+        url = row["download_url"]
+    if url is pd.NA or not isinstance(url, str):
+        return None
     if url.startswith("ftp."):
         url = "ftp://" + url
+    return url
 
-    if url.startswith("ftp://"):
-        return _get_ftp_file_size(url)
 
+def _get_http_file_size(url, run_accession, transport):
     try:
-        r = requests_3_retries().head(url)
+        r = transport.head(url)
         size = int(r.headers["content-length"])
         r.raise_for_status()
     except requests.exceptions.Timeout:
@@ -179,40 +245,371 @@ def get_file_size(row, url_col):
     except requests.exceptions.HTTPError:
         print(
             f"The download URL:  {url}  is likely invalid.\n"
-            f"Removing {row.run_accession} from the download list\n",
+            f"Removing {run_accession} from the download list\n",
             flush=True,
         )
-        return np.NaN
+        return np.nan
     except KeyError:
         print("Key error for: " + url, flush=True)
         return 0
     return size
 
 
-def md5_validate_file(file_path, md5_hash):
-    """Check file containt against an MD5.
+def get_file_size(row, url_col, transport=None):
+    """Get size of file to be downloaded.
+
+    Parameters
+    ----------
+    row: pd.DataFrame row
+
+    url_col: str
+        url_column
+
+    transport: HTTPTransport
+        Pooled HTTP transport to use (optional)
+
+    Returns
+    -------
+    content_length: int
+    """
+    url = _file_size_url(row, url_col)
+    if url is None:
+        return 0
+
+    if url.startswith("ftp://"):
+        return _get_ftp_file_size(url)
+
+    if transport is None:
+        transport = get_default_transport()
+    return _get_http_file_size(url, row["run_accession"], transport)
+
+
+def get_file_sizes(
+    df, url_col, threads=FILE_SIZE_THREADS, transport=None, cache=None, ftp_pool=None
+):
+    """Get sizes of all files to be downloaded.
+
+    HTTP sizes are looked up concurrently over the pooled transport.
+    FTP sizes are looked up over a few control connections per host,
+    each of them reused for many files. Sizes found are stored in the
+    response cache (if given) so that a re-run does not look them up again.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Download rows, with `url_col`, download_url and run_accession
+    url_col: str
+        url_column
+    threads: int
+        Number of concurrent lookups
+    transport: HTTPTransport
+        Pooled HTTP transport to use (optional)
+    cache: ResponseCache
+        Cache for the sizes (optional)
+    ftp_pool: FTPConnectionPool
+        Pool of FTP connections to use (optional)
+
+    Returns
+    -------
+    sizes: list
+        Size of each row's file, in the order of `df`
+    """
+    if transport is None:
+        transport = get_default_transport()
+    records = df.to_dict("records")
+    sizes = [0] * len(records)
+    http_jobs = []
+    ftp_jobs = OrderedDict()
+    for i, record in enumerate(records):
+        url = _file_size_url(record, url_col)
+        if url is None:
+            continue
+        if cache is not None:
+            size = cache.get("file_size", {"url": url})
+            if size is not None:
+                sizes[i] = size
+                continue
+        if url.startswith("ftp://"):
+            parsed = urlparse(url)
+            ftp_jobs.setdefault(parsed.netloc, []).append((i, url, parsed.path))
+        else:
+            http_jobs.append((i, url, record.get("run_accession")))
+
+    def probe_ftp(host, jobs):
+        for (i, url, _), size in zip(
+            jobs,
+            _get_ftp_file_sizes(host, [path for _, _, path in jobs], ftp_pool=ftp_pool),
+        ):
+            sizes[i] = size
+
+    def probe_http(i, url, run_accession):
+        sizes[i] = _get_http_file_size(url, run_accession, transport)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(probe_http, *job) for job in http_jobs]
+        for host, jobs in ftp_jobs.items():
+            n_connections = min(FTP_SIZE_CONNECTIONS, len(jobs))
+            for k in range(n_connections):
+                futures.append(executor.submit(probe_ftp, host, jobs[k::n_connections]))
+        for future in futures:
+            future.result()
+
+    if cache is not None:
+        for job in http_jobs + [job for jobs in ftp_jobs.values() for job in jobs]:
+            size = sizes[job[0]]
+            # failed lookups (0 or NaN) are retried next time
+            if size == size and size > 0:
+                cache.set("file_size", {"url": job[1]}, size)
+    return sizes
+
+
+def _file_md5(file_path, md5=None):
+    """Feed the content of a file, if it exists, into an MD5.
+
+    Used to pick up hashing where a partial download left off. hashlib
+    objects cannot be saved, so the prefix is read once per resume.
 
     Parameters
     ----------
     file_path: string
                Path to file
-    md5_hash: string
-             Expected md5 hash
+    md5: hashlib.md5
+         Hash to update (default: a new one)
 
     Returns
     -------
-    valid: bool
-           True if expected and observed md5 match
+    md5: hashlib.md5
     """
-    observed_md5 = hashlib.md5()
+    if md5 is None:
+        md5 = hashlib.md5()
+    if not os.path.exists(file_path):
+        return md5
     with open(file_path, "rb") as f:
         while True:
             # read 1MB
             chunk = f.read(1000 * 1000)
             if not chunk:
                 break
-            observed_md5.update(chunk)
-    return observed_md5.hexdigest() == md5_hash
+            md5.update(chunk)
+    return md5
+
+
+def md5_validate_file(file_path, md5_hash):
+    """Check file containt against an MD5.
+
+    Parameters
+    ----------
+    file_path: string
+               Path to file
+    md5_hash: string
+             Expected md5 hash
+
+    Returns
+    -------
+    valid: bool
+           True if expected and observed md5 match
+    """
+    return _file_md5(file_path).hexdigest() == md5_hash
+
+
+def _segments_path(file_path):
+    return file_path + ".part.segments"
+
+
+class _SegmentState(object):
+    def __init__(self, path, url, file_size, segments):
+        """Progress of a segmented download, saved next to the .part file.
+
+        Parameters
+        ----------
+        path: string
+              Location of the state (JSON) file
+        url: string
+             URL being downloaded
+        file_size: int
+                   Size of the file in bytes
+        segments: list
+                  List of [start, end, done] byte offsets: the segment covers
+                  start..end (inclusive) and `done` bytes of it are written
+        """
+        self.path = path
+        self.url = url
+        self.file_size = file_size
+        self.segments = segments
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, url, file_size):
+        """Load the saved state, or None if it does not match this download."""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if state.get("url") != url or state.get("file_size") != file_size:
+            return None
+        return cls(path, url, file_size, state["segments"])
+
+    @classmethod
+    def create(cls, path, url, file_size, n_segments, first_byte=0):
+        """Split the bytes not yet downloaded into `n_segments` ranges."""
+        segments = []
+        if first_byte:
+            # an existing single stream .part file is a finished first segment
+            segments.append([0, first_byte - 1, first_byte])
+        remaining = file_size - first_byte
+        n_segments = max(1, min(n_segments, remaining // MIN_SEGMENT_SIZE))
+        segment_size = max(1, int(math.ceil(remaining / n_segments)))
+        for start in range(first_byte, file_size, segment_size):
+            segments.append([start, min(start + segment_size, file_size) - 1, 0])
+        return cls(path, url, file_size, segments)
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "url": self.url,
+                        "file_size": self.file_size,
+                        "segments": self.segments,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.path)
+
+    def downloaded(self):
+        return sum(done for _, _, done in self.segments)
+
+    def pending(self):
+        """Indices of the segments that are not complete."""
+        return [
+            index
+            for index, (start, end, done) in enumerate(self.segments)
+            if done < end - start + 1
+        ]
+
+
+def _download_segment(
+    session, url, fd, state, index, timeout, block_size, pbar, rate_limiter
+):
+    start, end, done = state.segments[index]
+    headers = {"Range": "bytes={}-{}".format(start + done, end)}
+    r = session.get(url, headers=headers, stream=True, timeout=timeout)
+    r.raise_for_status()
+    if r.status_code != 206:
+        raise IOError("Server ignored the byte range request for {}".format(url))
+    offset = start + done
+    since_checkpoint = 0
+    for chunk in r.iter_content(chunk_size=block_size):
+        if not chunk:
+            continue
+        chunk = chunk[: end + 1 - offset]
+        if rate_limiter is not None:
+            rate_limiter.acquire(len(chunk))
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+        since_checkpoint += len(chunk)
+        state.segments[index][2] = offset - start
+        if pbar is not None:
+            pbar.update(len(chunk))
+        if since_checkpoint >= SEGMENT_CHECKPOINT_SIZE:
+            state.save()
+            since_checkpoint = 0
+        if offset > end:
+            break
+    r.close()
+    if offset <= end:
+        raise IOError(
+            "Segment {}-{} of {} ended early at byte {}".format(start, end, url, offset)
+        )
+
+
+def _download_segmented(
+    session,
+    url,
+    file_path,
+    file_size,
+    segments,
+    md5_hash=None,
+    timeout=10,
+    block_size=1024 * 1024,
+    show_progress=False,
+    rate_limiter=None,
+):
+    """Download `url` as concurrent byte ranges into a preallocated file.
+
+    Progress is saved per segment next to the .part file, so an interrupted
+    download resumes only the missing ranges. The completed file is moved
+    to `file_path`.
+    """
+    tmp_file_path = file_path + ".part"
+    state_path = _segments_path(file_path)
+    state = _SegmentState.load(state_path, url, file_size)
+    if state is None:
+        # a .part file without saved segments was written by a single stream
+        first_byte = (
+            os.path.getsize(tmp_file_path) if os.path.exists(tmp_file_path) else 0
+        )
+        if first_byte > file_size:
+            first_byte = 0
+        state = _SegmentState.create(state_path, url, file_size, segments, first_byte)
+        state.save()
+    fd = os.open(tmp_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+    pbar = None
+    try:
+        # sparse preallocation, segments fill in their own ranges
+        os.ftruncate(fd, file_size)
+        if show_progress:
+            pbar = tqdm(
+                total=file_size,
+                initial=state.downloaded(),
+                unit="B",
+                unit_scale=True,
+                desc="Downloading {}".format(url.split("/")[-1]),
+            )
+        pending = state.pending()
+        errors = []
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(pending)
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _download_segment,
+                        session,
+                        url,
+                        fd,
+                        state,
+                        index,
+                        timeout,
+                        block_size,
+                        pbar,
+                        rate_limiter,
+                    )
+                    for index in pending
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+        os.fsync(fd)
+        state.save()
+        if errors:
+            raise IOError(
+                "{} of {} segments of {} failed, rerun to resume: {}".format(
+                    len(errors), len(state.segments), url, errors[0]
+                )
+            )
+    finally:
+        os.close(fd)
+        if pbar is not None:
+            pbar.close()
+    os.remove(state_path)
+    # segments arrive out of order, so the MD5 is computed at the end
+    if md5_hash and not md5_validate_file(tmp_file_path, md5_hash):
+        os.remove(tmp_file_path)
+        raise MD5MismatchException(url)
+    shutil.move(tmp_file_path, file_path)
 
 
 def download_file(
@@ -222,6 +619,11 @@ def download_file(
     timeout=10,
     block_size=1024 * 1024,
     show_progress=False,
+    transport=None,
+    segments=1,
+    rate_limiter=None,
+    ftp_pool=None,
+    telemetry=None,
 ):
     """Resumable download.
     Expect the server to support byte ranges.
@@ -240,6 +642,20 @@ def download_file(
                 Chunkx of bytes to read (default: 1024 * 1024 = 1MB)
     show_progress: bool
                    Show progress bar
+    transport: HTTPTransport
+               Pooled HTTP transport to use (optional)
+    segments: int
+              Download large files over this many connections at once,
+              each fetching its own byte range (HTTP only). Requires
+              os.pwrite, otherwise a single stream is used.
+    rate_limiter: RateLimiter
+                  Bandwidth limit shared by concurrent downloads, one token
+                  per byte (optional)
+    ftp_pool: FTPConnectionPool
+              Pool of FTP connections to use (optional)
+    telemetry: DownloadTelemetry
+               Records the bytes, duration and time to first byte of
+               the download (optional)
     """
     if url.startswith("ftp."):
         url = "ftp://" + url
@@ -247,22 +663,93 @@ def download_file(
     if os.path.exists(file_path) and os.path.getsize(file_path):
         return
 
+    if telemetry is not None:
+        # the meter counts the chunks on their way to the rate limiter
+        meter = telemetry.meter(rate_limiter)
+        error = None
+        try:
+            download_file(
+                url,
+                file_path,
+                md5_hash=md5_hash,
+                timeout=timeout,
+                block_size=block_size,
+                show_progress=show_progress,
+                transport=transport,
+                segments=segments,
+                rate_limiter=meter,
+                ftp_pool=ftp_pool,
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            telemetry.record(url, file_path, meter, error)
+        return
+
     if url.startswith("ftp://"):
-        _download_ftp_file(url, file_path, timeout, block_size, show_progress)
-        # if there's a hash value, validate the file
-        if md5_hash and not md5_validate_file(file_path, md5_hash):
-            raise Exception("Error validating the file against its MD5 hash")
+        _download_ftp_file(
+            url,
+            file_path,
+            timeout,
+            block_size,
+            show_progress,
+            rate_limiter,
+            ftp_pool,
+            md5_hash,
+        )
         return
 
-    session = requests
+    session = transport if transport is not None else get_default_transport()
     tmp_file_path = file_path + ".part"
     first_byte = os.path.getsize(tmp_file_path) if os.path.exists(tmp_file_path) else 0
     file_mode = "ab" if first_byte else "wb"
     file_size = -1
+    md5 = None
     try:
-        file_size = int(session.head(url).headers["Content-length"])
+        head = session.head(url, timeout=timeout)
+        file_size = int(head.headers["Content-length"])
+        resume_segments = os.path.exists(_segments_path(file_path))
+        if (
+            (segments > 1 or resume_segments)
+            and hasattr(os, "pwrite")
+            and head.headers.get("Accept-Ranges", "").lower() == "bytes"
+            and (file_size >= 2 * MIN_SEGMENT_SIZE or resume_segments)
+        ):
+            _download_segmented(
+                session,
+                url,
+                file_path,
+                file_size,
+                max(segments, 1),
+                md5_hash=md5_hash,
+                timeout=timeout,
+                block_size=block_size,
+                show_progress=show_progress,
+                rate_limiter=rate_limiter,
+            )
+            return
+        if resume_segments:
+            # byte ranges are no longer available: the preallocated .part
+            # has holes a single stream cannot fill, start over
+            os.remove(_segments_path(file_path))
+            if os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
+            first_byte = 0
+            file_mode = "wb"
+        # the MD5 is computed as chunks are written, starting from the
+        # data a previous attempt left in the .part file
+        md5 = _file_md5(tmp_file_path) if md5_hash else None
+        if first_byte >= file_size:
+            # nothing left to fetch
+            return
         headers = {"Range": "bytes=%s-" % first_byte}
-        r = session.get(url, headers=headers, stream=True)
+        r = session.get(url, headers=headers, stream=True, timeout=timeout)
+        if first_byte and r.status_code != 206:
+            # the server sent the whole file, start over
+            first_byte = 0
+            file_mode = "wb"
+            md5 = hashlib.md5() if md5_hash else None
         if show_progress:
             desc = "Downloading {}".format(url.split("/")[-1])
             pbar = tqdm(
@@ -275,7 +762,11 @@ def download_file(
         with open(tmp_file_path, file_mode) as f:
             for chunk in r.iter_content(chunk_size=block_size):
                 if chunk:  # filter out keep-alive new chunks
+                    if rate_limiter is not None:
+                        rate_limiter.acquire(len(chunk))
                     f.write(chunk)
+                    if md5 is not None:
+                        md5.update(chunk)
                     if show_progress:
                         pbar.update(len(chunk))
         if show_progress:
@@ -283,19 +774,29 @@ def download_file(
     except IOError as e:
         sys.stderr.write("IO Error - {}\n".format(e))
     finally:
-        # Move the temp file to desired location
-        if os.path.exists(tmp_file_path):
+        # Move the temp file to desired location, unless it is a partial
+        # segmented download (preallocated to the full size) to be resumed
+        if os.path.exists(tmp_file_path) and not os.path.exists(
+            _segments_path(file_path)
+        ):
             actual_size = os.path.getsize(tmp_file_path)
             if file_size == actual_size:
-                if md5_hash and not md5_validate_file(tmp_file_path, md5_hash):
-                    raise Exception("Error validating the file against its MD5 hash")
+                if md5_hash:
+                    if md5 is None:
+                        md5 = _file_md5(tmp_file_path)
+                    if md5.hexdigest() != md5_hash:
+                        # corrupt, do not resume from it
+                        os.remove(tmp_file_path)
+                        raise MD5MismatchException(url)
                 shutil.move(tmp_file_path, file_path)
             elif file_size == -1:
                 # Server didn't provide Content-Length, move the file anyway
                 shutil.move(tmp_file_path, file_path)
             else:
-                print(
-                    f"Warning: File size mismatch for {url}. Expected: {file_size}, Got: {actual_size}"
+                if actual_size > file_size:
+                    # cannot be resumed
+                    os.remove(tmp_file_path)
+                # a short .part is kept and resumed on the next attempt
+                raise IOError(
+                    f"File size mismatch for {url}. Expected: {file_size}, Got: {actual_size}"
                 )
-                if actual_size > 0:
-                    shutil.move(tmp_file_path, file_path)
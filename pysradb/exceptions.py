@@ -24,3 +24,25 @@ class IncorrectFieldException(Exception):
     """Exception raised when the user enters incorrect inputs for a flag."""
 
     pass
+
+
+class CacheMissException(Exception):
+    """Exception raised when an offline cache has no entry for a lookup."""
+
+    def __init__(self, endpoint, params):
+        self.message = (
+            "No cached response for {} {} and the cache is in offline mode.".format(
+                endpoint, params
+            )
+        )
+        super().__init__(self.message)
+
+
+class MD5MismatchException(Exception):
+    """Exception raised when a downloaded file does not match its MD5."""
+
+    def __init__(self, url):
+        self.message = "Error validating the file against its MD5 hash: {}".format(
+            url
+        )
+        super().__init__(self.message)
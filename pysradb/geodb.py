@@ -72,7 +72,7 @@ def download_geodb_file(download_dir=os.getcwd(), overwrite=True):
 
 
 class GEOdb(BASEdb):
-    def __init__(self, sqlite_file):
+    def __init__(self, sqlite_file, immutable=False):
         """Initialize SRAdb.
 
         Parameters
@@ -80,10 +80,12 @@ class GEOdb(BASEdb):
 
         sqlite_file: string
                      Path to unzipped SRAmetadb.sqlite file
+        immutable: bool
+                   Open the file as immutable, see `BASEdb`
 
 
         """
-        super(GEOdb, self).__init__(sqlite_file)
+        super(GEOdb, self).__init__(sqlite_file, immutable=immutable)
         self._db_type = "GEO"
         self.valid_in_type = ["GSE", "GPL", "GSM", "GDS"]
 
@@ -100,7 +102,7 @@ class GEOdb(BASEdb):
         metadata_df: DataFrame
                      A dataframe with relevant fields
         """
-        return self.query("SELECT * from gse WHERE gse='{}';".format(gse))
+        return self.query("SELECT * from gse WHERE gse=?;", [gse])
 
     def gsm_metadata(self, gsm):
         """Get metadata for GSM ID.
@@ -115,7 +117,7 @@ class GEOdb(BASEdb):
         metadata_df: DataFrame
                      A dataframe with relevant fields
         """
-        return self.query("SELECT * from gsm WHERE gsm='{}';".format(gsm))
+        return self.query("SELECT * from gsm WHERE gsm=?;", [gsm])
 
     def geo_convert(self, from_acc):
         """Convert one GEO accession to other.
@@ -130,9 +132,7 @@ class GEOdb(BASEdb):
         mapping_df: DataFrame
                     A dataframe with relevant mappings
         """
-        return self.query(
-            "SELECT * FROM geoConvert WHERE from_acc='{}';".format(from_acc)
-        )
+        return self.query("SELECT * FROM geoConvert WHERE from_acc=?;", [from_acc])
 
     def gse_to_gsm(self, gse):
         """Fetch GSMs for a GSE.
@@ -147,7 +147,7 @@ class GEOdb(BASEdb):
         mapping_df: DataFrame
                     A dataframe with relevant mappings
         """
-        return self.query("SELECT * FROM gse_gsm WHERE gse='{}'".format(gse))
+        return self.query("SELECT * FROM gse_gsm WHERE gse=?", [gse])
 
     def gsm_to_gse(self, gsm):
         """Fetch GSE for a GSM.
@@ -162,7 +162,7 @@ class GEOdb(BASEdb):
         mapping_df: DataFrame
                     A dataframe with relevant mappings
         """
-        mapping_df = self.query("SELECT * FROM gse_gsm WHERE gsm='{}'".format(gsm))
+        mapping_df = self.query("SELECT * FROM gse_gsm WHERE gsm=?", [gsm])
         return mapping_df.loc[:, ["gsm", "gse"]]
 
     def guess_srp_from_gse(self, gse):
@@ -178,7 +178,7 @@ class GEOdb(BASEdb):
         srp: string
              SRP ID
         """
-        results = self.query('SELECT * FROM gse WHERE gse = "' + gse + '"')
+        results = self.query("SELECT * FROM gse WHERE gse = ?", [gse])
         if results.shape[0] == 1:
             supp_file = results["supplementary_file"][0]
             if supp_file:
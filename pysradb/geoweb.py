@@ -3,12 +3,12 @@
 import gzip
 import os
 import re
-import requests
 import sys
 from lxml import html
 
 from .download import download_file
 from .geodb import GEOdb
+from .transport import HTTPTransport
 from .utils import _get_url
 from .utils import copyfileobj
 from .utils import get_gzip_uncompressed_size
@@ -19,8 +19,18 @@ if sys.version_info[0] < 3:
 
 
 class GEOweb(GEOdb):
-    def __init__(self):
-        """Initialize GEOweb without any database."""
+    def __init__(self, transport=None):
+        """Initialize GEOweb without any database.
+
+        Parameters
+        ----------
+        transport: HTTPTransport
+                   Pooled HTTP transport to use for all requests.
+                   A new one is created if not supplied.
+        """
+        if transport is None:
+            transport = HTTPTransport()
+        self.transport = transport
 
     def get_download_links(self, gse):
         """Obtain all links from the GEO FTP page.
@@ -37,7 +47,7 @@ class GEOweb(GEOdb):
         """
         prefix = gse[:-3]
         url = f"https://ftp.ncbi.nlm.nih.gov/geo/series/{prefix}nnn/{gse}/suppl/"
-        link_objects = html.fromstring(requests.get(url).content).xpath("//a")
+        link_objects = html.fromstring(self.transport.get(url).content).xpath("//a")
         links = [i.attrib["href"] for i in link_objects]
         # remove vulnerability link
         links = [
@@ -93,7 +103,7 @@ class GEOweb(GEOdb):
             tar_file = tar_list[0]
             if verbose:
                 print(f"\nThe tar file {tar_file} contains the following files:\n")
-                file_list_contents = requests.get(
+                file_list_contents = self.transport.get(
                     root_url + "filelist.txt"
                 ).content.decode("utf-8")
                 print(file_list_contents)
@@ -105,4 +115,9 @@ class GEOweb(GEOdb):
             if link == "filelist.txt":
                 prefix = gse + "_"
             geo_path = os.path.join(out_dir, prefix + link)
-            download_file(root_url + link, geo_path, show_progress=True)
+            download_file(
+                root_url + link,
+                geo_path,
+                show_progress=True,
+                transport=self.transport,
+            )
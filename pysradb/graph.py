@@ -0,0 +1,232 @@
+"""In-memory graph of relationships between SRA/GEO accessions"""
+
+import re
+import threading
+from collections import OrderedDict
+from collections import defaultdict
+
+import pandas as pd
+
+from .sradb import VALID_IN_TYPE
+
+# SRA accession prefixes plus GEO series/samples
+ACCESSION_TYPES = dict(VALID_IN_TYPE, GSE="gse", GSM="gsm")
+# Columns of a summary table that link its rows together
+SRA_ACCESSION_COLUMNS = [
+    "experiment_accession",
+    "study_accession",
+    "sample_accession",
+    "run_accession",
+]
+
+
+def accession_type(accession):
+    """Get the type of an accession.
+
+    Parameters
+    ----------
+    accession: string
+               Accession, for example SRP016501 or GSM1020644
+
+    Returns
+    -------
+    accession_type: string
+                    One of submission, study, sample, experiment, run,
+                    gse or gsm.
+                    None if the accession is not recognized.
+    """
+    if not isinstance(accession, str):
+        return None
+    return ACCESSION_TYPES.get(re.sub("\\d+$", "", accession.strip()).upper())
+
+
+def _as_list(accessions):
+    if isinstance(accessions, str):
+        return [accessions]
+    return list(accessions)
+
+
+class AccessionGraph(object):
+    def __init__(self):
+        """Initialize an empty accession graph.
+
+        The graph records every SRP/SRX/SRS/SRR/GSE/GSM relationship
+        learned from esummary responses so that later conversions in the
+        same session can be answered without another request.
+
+        Summary records are kept per experiment. An accession is considered
+        resolved once its complete set of experiments is known: studies and
+        samples that were looked up directly, and every experiment and run
+        seen in a response (summary records list all runs of an experiment).
+        """
+        self._lock = threading.Lock()
+        self.edges = defaultdict(set)
+        self.experiments = OrderedDict()
+        self.resolved = set()
+        self.gds_results = {}
+
+    def add_edge(self, accession1, accession2):
+        """Record a relationship between two accessions."""
+        if not isinstance(accession1, str) or not isinstance(accession2, str):
+            return
+        with self._lock:
+            self.edges[accession1].add(accession2)
+            self.edges[accession2].add(accession1)
+
+    def neighbors(self, accession, accession_type_=None):
+        """Get the known accessions related to `accession`.
+
+        Parameters
+        ----------
+        accession: string
+                   Accession to look up
+        accession_type_: string
+                         Only return accessions of this type
+                         (study, sample, experiment, run, gse or gsm)
+
+        Returns
+        -------
+        neighbors: list
+                   Sorted list of related accessions
+        """
+        with self._lock:
+            neighbors = set(self.edges.get(accession, set()))
+        if accession_type_ is not None:
+            neighbors = [x for x in neighbors if accession_type(x) == accession_type_]
+        return sorted(neighbors)
+
+    def add_sra_records(self, terms, records):
+        """Record summary rows returned by an SRA esummary lookup.
+
+        Parameters
+        ----------
+        terms: string or list
+               Accessions that were looked up
+        records: list
+                 Summary rows (one per run) with study_accession,
+                 experiment_accession, sample_accession and
+                 run_accession keys
+        """
+        self.add_sra_table(terms, pd.DataFrame(records))
+
+    def add_sra_table(self, terms, table):
+        """Record the summary table returned by an SRA esummary lookup.
+
+        Relationships are read from the accession columns only. The rows
+        are kept in `table` and turned into records by `sra_records`.
+
+        Parameters
+        ----------
+        terms: string or list
+               Accessions that were looked up
+        table: DataFrame
+               Summary table (one row per run) with study_accession,
+               experiment_accession, sample_accession and run_accession
+               columns
+        """
+        table = table.reset_index(drop=True)
+        accessions = table.reindex(columns=SRA_ACCESSION_COLUMNS)
+        experiments = OrderedDict()
+        seen = set()
+        resolved = set()
+        for position, (experiment, study, sample, run) in enumerate(
+            accessions.itertuples(index=False)
+        ):
+            experiments.setdefault(experiment, []).append(position)
+            for accession in [study, sample, run]:
+                if isinstance(accession, str):
+                    self.add_edge(experiment, accession)
+                    seen.add(accession)
+            if isinstance(run, str):
+                resolved.add(run)
+            resolved.add(experiment)
+        with self._lock:
+            self.experiments.update(
+                (experiment, (table, positions))
+                for experiment, positions in experiments.items()
+            )
+            self.resolved.update(resolved)
+            for term in _as_list(terms):
+                if term in seen:
+                    self.resolved.add(term)
+
+    def sra_records(self, terms):
+        """Get the summary rows for previously resolved accessions.
+
+        Parameters
+        ----------
+        terms: string or list
+               Accessions to look up
+
+        Returns
+        -------
+        records: list
+                 Summary rows of all experiments related to `terms`,
+                 or None if any of the accessions was not resolved before
+        """
+        terms = _as_list(terms)
+        with self._lock:
+            if not terms or not all(term in self.resolved for term in terms):
+                return None
+            experiments = set()
+            for term in terms:
+                if accession_type(term) == "experiment":
+                    experiments.add(term)
+                else:
+                    experiments.update(
+                        x for x in self.edges[term] if accession_type(x) == "experiment"
+                    )
+            # keep the order in which experiments were returned by NCBI
+            rows = [
+                self.experiments[experiment]
+                for experiment in self.experiments
+                if experiment in experiments
+            ]
+        return [
+            record
+            for table, positions in rows
+            for record in table.iloc[positions].to_dict("records")
+        ]
+
+    def add_gds_records(self, terms, records):
+        """Record the results of a GEO DataSets lookup.
+
+        GSM-SRX and GSE-SRP relationships are added to the graph and the
+        records are memoized for the exact set of terms.
+
+        Parameters
+        ----------
+        terms: string or list
+               Accessions that were looked up
+        records: list
+                 GEO DataSets records with accession, entrytype and SRA keys
+        """
+        for record in records:
+            if record.get("entrytype") in ["GSE", "GSM"]:
+                self.add_edge(record.get("accession"), record.get("SRA"))
+        key = tuple(sorted(set(_as_list(terms))))
+        with self._lock:
+            self.gds_results[key] = [record.copy() for record in records]
+
+    def gds_records(self, terms):
+        """Get memoized GEO DataSets records for the exact set of terms.
+
+        Returns
+        -------
+        records: list
+                 Records, or None if these terms were not looked up before
+        """
+        key = tuple(sorted(set(_as_list(terms))))
+        with self._lock:
+            records = self.gds_results.get(key)
+            if records is None:
+                return None
+            return [record.copy() for record in records]
+
+    def clear(self):
+        """Forget everything learned so far."""
+        with self._lock:
+            self.edges.clear()
+            self.experiments.clear()
+            self.resolved.clear()
+            self.gds_results.clear()
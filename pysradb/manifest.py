@@ -0,0 +1,155 @@
+"""Journal of the files downloaded into a directory"""
+
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_FILENAME = ".pysradb_manifest.sqlite"
+
+# Download states
+PENDING = "pending"
+DOWNLOADING = "downloading"
+DONE = "done"
+FAILED = "failed"
+CORRUPT = "corrupt"
+
+MANIFEST_COLUMNS = [
+    "file_path",
+    "run_accession",
+    "url",
+    "size",
+    "md5",
+    "bytes_done",
+    "status",
+    "updated",
+]
+
+
+class DownloadManifest(object):
+    def __init__(self, out_dir):
+        """Open (or create) the download manifest of a directory.
+
+        The manifest is a SQLite file in `out_dir` with one row per
+        downloaded file: its URL, expected size and MD5, how many bytes
+        are on disk and whether it is pending, done (complete and
+        verified), failed (partial data kept for resuming) or corrupt
+        (failed verification and queued again). A restarted batch is
+        planned from the manifest, without looking at the files or
+        asking the servers for their sizes again.
+
+        Parameters
+        ----------
+        out_dir: string
+                 Download directory. File paths are stored relative to it.
+        """
+        self.out_dir = os.path.abspath(out_dir)
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.path = os.path.join(self.out_dir, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "file_path TEXT PRIMARY KEY, run_accession TEXT, url TEXT, "
+            "size INTEGER, md5 TEXT, bytes_done INTEGER, status TEXT, "
+            "updated REAL)"
+        )
+        self.db.commit()
+
+    def _key(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.out_dir)
+
+    def get(self, file_paths):
+        """Get the manifest entries of files.
+
+        Parameters
+        ----------
+        file_paths: list
+                    Local paths of the files
+
+        Returns
+        -------
+        entries: list
+                 One dict per file (see MANIFEST_COLUMNS) with the
+                 file_path as given, or None for files not in the manifest
+        """
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT {} FROM downloads".format(",".join(MANIFEST_COLUMNS))
+            ).fetchall()
+        entries = {row[0]: dict(zip(MANIFEST_COLUMNS, row)) for row in rows}
+        result = []
+        for file_path in file_paths:
+            entry = entries.get(self._key(file_path))
+            if entry is not None:
+                entry["file_path"] = file_path
+            result.append(entry)
+        return result
+
+    def add(self, entries):
+        """Record the files of a batch.
+
+        A file already in the manifest keeps its state, unless it is now
+        downloaded from another URL, in which case it starts over.
+
+        Parameters
+        ----------
+        entries: list
+                 Dicts with file_path, run_accession, url, size and md5
+        """
+        now = time.time()
+        with self._lock:
+            for entry in entries:
+                self.db.execute(
+                    "INSERT INTO downloads VALUES (?, ?, ?, ?, ?, 0, ?, ?) "
+                    "ON CONFLICT(file_path) DO UPDATE SET "
+                    "run_accession = excluded.run_accession, "
+                    "size = COALESCE(excluded.size, size), "
+                    "md5 = COALESCE(excluded.md5, md5), "
+                    "status = CASE WHEN url = excluded.url THEN status "
+                    "ELSE excluded.status END, "
+                    "bytes_done = CASE WHEN url = excluded.url THEN bytes_done "
+                    "ELSE 0 END, "
+                    "url = excluded.url, updated = excluded.updated",
+                    (
+                        self._key(entry["file_path"]),
+                        entry.get("run_accession"),
+                        entry["url"],
+                        entry.get("size"),
+                        entry.get("md5"),
+                        PENDING,
+                        now,
+                    ),
+                )
+            self.db.commit()
+
+    def update(self, file_path, status, bytes_done=None):
+        """Set the state of a file.
+
+        Parameters
+        ----------
+        file_path: string
+                   Local path of the file
+        status: string
+                One of PENDING, DOWNLOADING, DONE, FAILED or CORRUPT
+        bytes_done: int
+                    Bytes on disk (unchanged if None)
+        """
+        with self._lock:
+            self.db.execute(
+                "UPDATE downloads SET status = ?, "
+                "bytes_done = COALESCE(?, bytes_done), updated = ? "
+                "WHERE file_path = ?",
+                (status, bytes_done, time.time(), self._key(file_path)),
+            )
+            self.db.commit()
+
+    def close(self):
+        """Close the manifest file."""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
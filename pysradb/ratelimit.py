@@ -0,0 +1,150 @@
+"""Token bucket rate limiting for NCBI E-utilities"""
+
+import os
+import threading
+import time
+import warnings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+EUTILS_HOST = "eutils.ncbi.nlm.nih.gov"
+# Requests per second allowed by NCBI with and without an API key
+EUTILS_RATE = 3
+EUTILS_RATE_API_KEY = 10
+
+
+class RateLimiter(object):
+    def __init__(self, rate, burst=1, lock_file=None):
+        """Initialize a token bucket rate limiter.
+
+        Implemented as a generic cell rate algorithm: every call to
+        `acquire` reserves the next free slot(s) of the bucket and then
+        sleeps until that slot is due, so concurrent callers are spaced
+        out at exactly `rate` tokens per second instead of sleeping for
+        a fixed interval after every request.
+
+        Parameters
+        ----------
+        rate: float
+              Tokens replenished per second
+        burst: int
+               Bucket capacity, i.e. how many tokens can be taken
+               at once after the limiter has been idle
+        lock_file: string
+                   Path to a file used to share the bucket across
+                   processes (POSIX only). All processes using the same
+                   file draw from a single bucket, for example several
+                   pipelines sharing one NCBI API key.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = float(rate)
+        self.burst = burst
+        self.interval = 1.0 / self.rate
+        self.lock_file = lock_file
+        if lock_file is not None and fcntl is None:
+            warnings.warn(
+                "Sharing a rate limit across processes is not supported on "
+                "this platform. Falling back to a per-process rate limit."
+            )
+            self.lock_file = None
+        # theoretical arrival time of the next token
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tat, now, tokens):
+        """Reserve `tokens` and return the new tat and the time to wait."""
+        tolerance = (self.burst - 1) * self.interval
+        start = max(tat, now)
+        wait = max(0.0, tat - tolerance - now)
+        return start + tokens * self.interval, wait
+
+    def _reserve_shared(self, tokens):
+        mode = "r+" if os.path.exists(self.lock_file) else "a+"
+        with open(self.lock_file, mode) as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                try:
+                    tat = float(fh.read().strip() or 0)
+                except ValueError:
+                    tat = 0.0
+                tat, wait = self._reserve(tat, time.time(), tokens)
+                fh.seek(0)
+                fh.truncate()
+                fh.write(repr(tat))
+                fh.flush()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+        return wait
+
+    def reserve(self, tokens=1):
+        """Take `tokens` from the bucket without blocking.
+
+        The caller must wait for the returned time before going ahead,
+        for example with `asyncio.sleep` in an event loop.
+
+        Parameters
+        ----------
+        tokens: int
+                Number of tokens to take
+
+        Returns
+        -------
+        wait: float
+              Seconds to wait
+        """
+        with self._lock:
+            if self.lock_file is not None:
+                return self._reserve_shared(tokens)
+            self._tat, wait = self._reserve(self._tat, time.monotonic(), tokens)
+            return wait
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` can be taken from the bucket.
+
+        Parameters
+        ----------
+        tokens: int
+                Number of tokens to take
+
+        Returns
+        -------
+        waited: float
+                Seconds spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def eutils_rate_limiter(api_key=None, lock_file=None):
+    """Create a rate limiter matching the NCBI E-utilities quota.
+
+    Parameters
+    ----------
+    api_key: string
+             NCBI API key. Raises the quota from 3 to 10 requests
+             per second.
+    lock_file: string
+               Path to a file to share the quota across processes
+
+    Returns
+    -------
+    rate_limiter: RateLimiter
+    """
+    rate = EUTILS_RATE_API_KEY if api_key is not None else EUTILS_RATE
+    return RateLimiter(rate, lock_file=lock_file)
@@ -0,0 +1,223 @@
+"""Scheduling of many downloads across hosts"""
+
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from tqdm.autonotebook import tqdm
+
+# Concurrent connections allowed to a single host
+DEFAULT_HOST_CONNECTIONS = 4
+# Number of times a failed download is retried
+DEFAULT_RETRIES = 3
+# Seconds to wait before the first retry, doubled after every attempt
+DEFAULT_BACKOFF = 5
+
+
+def url_host(url):
+    """Get the host a download URL points to.
+
+    Parameters
+    ----------
+    url: string
+         URL, with or without the scheme (for example ftp.sra.ebi.ac.uk/vol1/...)
+
+    Returns
+    -------
+    host: string
+          Lower case host name, or None for an empty URL
+    """
+    if not isinstance(url, str) or not url:
+        return None
+    if "://" not in url:
+        url = "ftp://" + url
+    return urlparse(url).netloc.lower() or None
+
+
+def host_limit(host_connections, host):
+    """Get the maximum number of concurrent jobs for `host`.
+
+    Parameters
+    ----------
+    host_connections: int or dict
+                      Limit for all hosts, or a dict of per-host limits
+                      with DEFAULT_HOST_CONNECTIONS for the other hosts
+    host: string
+          Host name
+
+    Returns
+    -------
+    limit: int
+    """
+    if isinstance(host_connections, dict):
+        limit = host_connections.get(host, DEFAULT_HOST_CONNECTIONS)
+    else:
+        limit = host_connections
+    return max(1, limit)
+
+
+class DownloadScheduler(object):
+    def __init__(
+        self,
+        threads=1,
+        host_connections=DEFAULT_HOST_CONNECTIONS,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        show_progress=True,
+    ):
+        """Initialize a download scheduler.
+
+        Jobs run on `threads` workers. A worker always starts the largest
+        pending job whose host has a free connection, so the biggest files
+        do not end up as stragglers at the end of a batch and no single
+        host is sent more than its share of concurrent connections.
+        Failed jobs are put back in the queue and retried with exponential
+        backoff.
+
+        Parameters
+        ----------
+        threads: int
+                 Number of jobs to run at once
+        host_connections: int or dict
+                          Maximum number of concurrent jobs per host.
+                          A dict maps host names to their own limit, with
+                          DEFAULT_HOST_CONNECTIONS for the other hosts.
+        retries: int
+                 Number of times a failed job is retried
+        backoff: float
+                 Seconds to wait before the first retry, doubled after
+                 every failed attempt
+        show_progress: bool
+                       Show a progress bar of completed jobs
+        """
+        if threads < 1:
+            raise ValueError("threads must be at least 1")
+        self.threads = threads
+        self.host_connections = host_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.show_progress = show_progress
+        self._cond = threading.Condition()
+
+    def host_limit(self, host):
+        """Maximum number of concurrent jobs for `host`."""
+        return host_limit(self.host_connections, host)
+
+    def _next_job(self, pending, running):
+        """Pick the next job to run. Must be called holding the lock.
+
+        Returns the index of the job in `pending` (None if no job can be
+        started now) and the seconds until a job waiting for a retry is due.
+        """
+        now = time.monotonic()
+        retry_in = None
+        for i, job in enumerate(pending):
+            if job["not_before"] > now:
+                delay = job["not_before"] - now
+                retry_in = delay if retry_in is None else min(retry_in, delay)
+                continue
+            if running.get(job["host"], 0) < self.host_limit(job["host"]):
+                return i, retry_in
+        return None, retry_in
+
+    def run(self, func, items, hosts, sizes=None):
+        """Run `func` on every item.
+
+        Parameters
+        ----------
+        func: callable
+              Function called with a single item
+        items: list
+               Items to process, for example download records
+        hosts: list
+               Host each item connects to (None if unknown)
+        sizes: list
+               Size of each item in bytes, used to start the largest
+               items first (optional)
+
+        Returns
+        -------
+        results: list
+                 Return value of `func` for each item, in input order
+
+        Raises
+        ------
+        RuntimeError
+            If some items still failed after all retries
+        """
+        items = list(items)
+        hosts = list(hosts)
+        if sizes is None:
+            sizes = [0] * len(items)
+        sizes = [size if size == size and size is not None else 0 for size in sizes]
+        pending = [
+            {"index": i, "host": host, "size": size, "attempt": 0, "not_before": 0}
+            for i, (host, size) in enumerate(zip(hosts, sizes))
+        ]
+        # largest first, input order between jobs of the same size
+        pending.sort(key=lambda job: (-job["size"], job["index"]))
+        running = {}
+        state = {"running": 0}
+        results = [None] * len(items)
+        errors = {}
+        pbar = tqdm(total=len(items), disable=not self.show_progress)
+
+        def worker():
+            while True:
+                with self._cond:
+                    while True:
+                        if not pending and not state["running"]:
+                            self._cond.notify_all()
+                            return
+                        i, retry_in = self._next_job(pending, running)
+                        if i is not None:
+                            break
+                        if not pending:
+                            # the running jobs may still fail and be retried
+                            self._cond.wait()
+                        else:
+                            self._cond.wait(retry_in)
+                    job = pending.pop(i)
+                    running[job["host"]] = running.get(job["host"], 0) + 1
+                    state["running"] += 1
+                error = None
+                try:
+                    results[job["index"]] = func(items[job["index"]])
+                except Exception as e:
+                    error = e
+                with self._cond:
+                    running[job["host"]] -= 1
+                    state["running"] -= 1
+                    if error is None:
+                        pbar.update()
+                    elif job["attempt"] < self.retries:
+                        delay = self.backoff * 2 ** job["attempt"]
+                        sys.stderr.write(
+                            "Retrying in {}s after error: {}\n".format(delay, error)
+                        )
+                        job["attempt"] += 1
+                        job["not_before"] = time.monotonic() + delay
+                        pending.append(job)
+                        pending.sort(key=lambda job: (-job["size"], job["index"]))
+                    else:
+                        errors[job["index"]] = error
+                        pbar.update()
+                    self._cond.notify_all()
+
+        workers = [
+            threading.Thread(target=worker, daemon=True)
+            for _ in range(min(self.threads, len(items)))
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        pbar.close()
+        if errors:
+            raise RuntimeError(
+                "{} of {} downloads failed: {}".format(
+                    len(errors), len(items), "; ".join(map(str, errors.values()))
+                )
+            )
+        return results
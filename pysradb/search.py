@@ -14,7 +14,9 @@ from tqdm import tqdm
 
 from .exceptions import IncorrectFieldException
 from .exceptions import MissingQueryException
-from .utils import requests_3_retries
+from .ratelimit import EUTILS_HOST
+from .ratelimit import eutils_rate_limiter
+from .transport import HTTPTransport
 from .utils import scientific_name_to_taxid
 
 SEARCH_REQUEST_TIMEOUT = 20
@@ -73,6 +75,9 @@ class QuerySearch:
         Setting this to True may cause the program to behave in unexpected
         ways, but allows the user to search queries that does not pass the
         format check.
+    transport: HTTPTransport
+        Pooled HTTP transport used for all requests made by this search.
+        A new one is created if not supplied.
 
     Methods
     -------
@@ -109,7 +114,11 @@ class QuerySearch:
         strategy=None,
         title=None,
         suppress_validation=False,
+        transport=None,
     ):
+        if transport is None:
+            transport = HTTPTransport()
+        self.transport = transport
         try:
             int_verbosity = int(verbosity)
             if int_verbosity not in range(4):
@@ -733,6 +742,7 @@ class SraSearch(QuerySearch):
         strategy=None,
         title=None,
         suppress_validation=False,
+        transport=None,
     ):
         super().__init__(
             verbosity,
@@ -749,17 +759,28 @@ class SraSearch(QuerySearch):
             strategy,
             title,
             suppress_validation,
+            transport,
         )
         self.entries = {}
         self.number_entries = 0
         self.uids = []
+        self._set_eutils_rate_limiter()
+
+    def _set_eutils_rate_limiter(self):
+        """Throttle E-utilities requests to the NCBI quota.
+
+        An existing limiter on the transport (for example one shared
+        with an API key aware SRAweb instance) is kept.
+        """
+        if self.transport.get_rate_limiter(EUTILS_HOST) is None:
+            self.transport.set_rate_limiter(EUTILS_HOST, eutils_rate_limiter())
 
     def search(self):
         # Step 1: retrieves the list of uids that satisfies the input
         # search query
         payload = self._format_request()
         try:
-            r = requests_3_retries().get(
+            r = self.transport.get(
                 "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi",
                 params=payload,
                 timeout=SEARCH_REQUEST_TIMEOUT,
@@ -782,7 +803,7 @@ class SraSearch(QuerySearch):
                 pbar.update(min(SRA_SEARCH_GROUP_SIZE, len(self.uids) - i))
                 payload2 = {"db": "sra", "retmode": "xml", "id": current_uids}
 
-                r = requests_3_retries().get(
+                r = self.transport.get(
                     "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi",
                     params=payload2,
                     timeout=SEARCH_REQUEST_TIMEOUT,
@@ -1258,7 +1279,7 @@ class EnaSearch(QuerySearch):
             self._format_request(), quote_via=urllib.parse.quote
         )
         try:
-            r = requests_3_retries().get(
+            r = self.transport.get(
                 "https://www.ebi.ac.uk/ena/portal/api/search",
                 params=payload,
                 timeout=SEARCH_REQUEST_TIMEOUT,
@@ -1304,7 +1325,8 @@ class EnaSearch(QuerySearch):
                 rf'run_accession="{self.fields["accession"]}") AND '
             )
         if self.fields["organism"]:
-            term += rf'tax_eq({scientific_name_to_taxid(self.fields["organism"])}) AND '
+            taxid = scientific_name_to_taxid(self.fields["organism"], self.transport)
+            term += rf"tax_eq({taxid}) AND "
         if self.fields["layout"]:
             term += rf'library_layout="{self.fields["layout"].upper()}" AND '
         if self.fields["mbases"]:
@@ -1555,6 +1577,7 @@ class GeoSearch(SraSearch):
         geo_dataset_type=None,
         geo_entry_type=None,
         suppress_validation=False,
+        transport=None,
     ):
         self.geo_fields = {
             "query": geo_query,
@@ -1602,9 +1625,11 @@ class GeoSearch(SraSearch):
                 strategy,
                 title,
                 suppress_validation,
+                transport,
             )
         except MissingQueryException:
             self.search_sra = False
+            self._set_eutils_rate_limiter()
         if not any(self.geo_fields.values()):
             self.search_geo = False
         if not self.search_geo and not self.search_sra:
@@ -1668,7 +1693,7 @@ class GeoSearch(SraSearch):
             # ELink to find corresponding uids in SRA
             geo_payload = self._format_geo_request()
             try:
-                r = requests_3_retries().get(
+                r = self.transport.get(
                     "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi",
                     params=geo_payload,
                     timeout=SEARCH_REQUEST_TIMEOUT,
@@ -1684,7 +1709,7 @@ class GeoSearch(SraSearch):
                     "query_key": query_key,
                     "WebEnv": web_env,
                 }
-                r = requests_3_retries().get(
+                r = self.transport.get(
                     "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi",
                     params=elink_payload,
                     timeout=SEARCH_REQUEST_TIMEOUT,
@@ -1701,7 +1726,7 @@ class GeoSearch(SraSearch):
                 # Step 2: Retrieve list of uids from SRA and
                 # Find the intersection of both lists of uids
                 if self.search_sra:
-                    r = requests_3_retries().get(
+                    r = self.transport.get(
                         "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi",
                         params=self._format_request(),
                         timeout=SEARCH_REQUEST_TIMEOUT,
@@ -1729,7 +1754,7 @@ class GeoSearch(SraSearch):
                     pbar.update(min(SRA_SEARCH_GROUP_SIZE, len(uids) - i))
                     payload2 = {"db": "sra", "retmode": "xml", "id": current_uids}
 
-                    r = requests_3_retries().get(
+                    r = self.transport.get(
                         "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi",
                         params=payload2,
                         timeout=SEARCH_REQUEST_TIMEOUT,
@@ -14,13 +14,28 @@ import numpy as np
 import pandas as pd
 from tqdm.autonotebook import tqdm
 from tqdm.contrib.concurrent import process_map
-from tqdm.contrib.concurrent import thread_map
 
+from .aiodownload import DEFAULT_ASYNC_CONCURRENCY
+from .aiodownload import download_files_async
+from .aspera import DEFAULT_ASCP_RATE
+from .aspera import AsperaTransfer
 from .basedb import BASEdb
 from .download import download_file
-from .download import get_file_size
+from .download import get_file_sizes
 from .download import millify
+from .exceptions import MD5MismatchException
 from .filter_attrs import expand_sample_attribute_columns
+from .manifest import CORRUPT
+from .manifest import DONE
+from .manifest import DOWNLOADING
+from .manifest import FAILED
+from .manifest import DownloadManifest
+from .ratelimit import RateLimiter
+from .scheduler import DEFAULT_HOST_CONNECTIONS
+from .scheduler import DEFAULT_RETRIES
+from .scheduler import DownloadScheduler
+from .scheduler import url_host
+from .sraindex import AccessionIndex
 from .taxid2name import TAXID_TO_NAME
 from .utils import _find_aspera_keypath
 from .utils import _get_url
@@ -30,7 +45,6 @@ from .utils import get_gzip_uncompressed_size
 from .utils import mkdir_p
 from .utils import order_dataframe
 from .utils import path_leaf
-from .utils import run_command
 from .utils import unique
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -48,61 +62,230 @@ SRADB_URL = [
     "https://gbnci-abcc.ncifcrf.gov/backup/SRAmetadb.sqlite.gz",
 ]
 
-ASCP_CMD_PREFIX = "ascp -k1 -T -l 300m -P33001 -i"
 PY3_VERSION = sys.version_info.minor
 
+# Accession prefixes accepted as input and the type they stand for
+VALID_IN_TYPE = {
+    "SRA": "submission",
+    "ERA": "submission",
+    "DRA": "submission",
+    "SRP": "study",
+    "ERP": "study",
+    "DRP": "study",
+    "SRS": "sample",
+    "ERS": "sample",
+    "DRS": "sample",
+    "SRX": "experiment",
+    "ERX": "experiment",
+    "DRX": "experiment",
+    "SRR": "run",
+    "ERR": "run",
+    "DRR": "run",
+}
+VALID_IN_ACC_TYPE = list(VALID_IN_TYPE.keys())
+
+# Base tables of SRAmetadb, joined the way sra/sra_ft denormalize them
+SRA_BASE_TABLES_SQL = (
+    "run JOIN experiment"
+    " ON run.experiment_accession = experiment.experiment_accession"
+    " LEFT JOIN sample ON experiment.sample_accession = sample.sample_accession"
+    " LEFT JOIN study ON experiment.study_accession = study.study_accession"
+)
+# Indexed accession column each input type is looked up in
+SRA_ACCESSION_COLUMNS = {
+    "study": "experiment.study_accession",
+    "experiment": "experiment.experiment_accession",
+    "sample": "experiment.sample_accession",
+    "run": "run.run_accession",
+}
+# Base table column of each sra_ft column available to exact lookups
+SRA_COLUMN_SOURCES = {
+    "study_accession": "experiment.study_accession",
+    "study_alias": "study.study_alias",
+    "experiment_accession": "experiment.experiment_accession",
+    "experiment_alias": "experiment.experiment_alias",
+    "experiment_title": "experiment.title",
+    "experiment_attribute": "experiment.experiment_attribute",
+    "library_name": "experiment.library_name",
+    "library_strategy": "experiment.library_strategy",
+    "library_source": "experiment.library_source",
+    "library_selection": "experiment.library_selection",
+    "library_layout": "experiment.library_layout",
+    "adapter_spec": "experiment.adapter_spec",
+    "sample_accession": "experiment.sample_accession",
+    "sample_alias": "sample.sample_alias",
+    "sample_attribute": "sample.sample_attribute",
+    "taxon_id": "sample.taxon_id",
+    "run_accession": "run.run_accession",
+    "run_alias": "run.run_alias",
+    "bases": "run.bases",
+    "spots": "run.spots",
+}
+# Terms OR-ed into a single full-text MATCH expression
+MATCH_CHUNK_SIZE = 500
+
+
+def _md5_column(url_column):
+    """Get the column holding the MD5s of the files in `url_column`.
+
+    ena_fastq_http_1 and ena_fastq_ftp_1 map to ena_fastq_md5_1,
+    NCBI columns such as public_url map to public_md5.
+    """
+    if url_column.startswith("ena_fastq_"):
+        return re.sub("^ena_fastq_(http|ftp)", "ena_fastq_md5", url_column)
+    if url_column.endswith("_url"):
+        return url_column[: -len("url")] + "md5"
+    return None
+
+
+def _url_md5s(df):
+    """Map every download URL in `df` to the MD5 given for it, if any."""
+    url_md5 = {}
+    for column in df.columns:
+        md5_column = _md5_column(column)
+        if md5_column in (None, column) or md5_column not in df.columns:
+            continue
+        for url, md5 in zip(df[column], df[md5_column]):
+            if isinstance(url, str) and isinstance(md5, str):
+                url_md5[url] = md5
+    return url_md5
 
-def _handle_download(record, use_ascp=False, pbar=None, ascp_bin=None, ascp_dir=None):
+
+def _download_location(record):
+    """Get the URL, local path and expected MD5 of a (non-aspera) download.
+
+    Parameters
+    ----------
+    record: dict
+            Download record, see `SRAdb.download`
+
+    Returns
+    -------
+    download_url: string
+    srr_location: string
+    md5_hash: string
+              None if unknown
+    """
+    srx_dir = os.path.join(
+        record["out_dir"], record["study_accession"], record["experiment_accession"]
+    )
+    download_url = record["download_url"]
+    md5_hash = None
+    if isinstance(record.get("srapath_url"), str):
+        download_url = record["srapath_url"]
+        md5_hash = record.get("md5")
+    download_filename = path_leaf(download_url)
+    if ".fastq.gz" not in download_filename:
+        srr_location = os.path.join(srx_dir, record["run_accession"] + ".sra")
+    else:
+        srr_location = os.path.join(srx_dir, download_filename)
+    if not isinstance(md5_hash, str):
+        md5_hash = None
+    return download_url, srr_location, md5_hash
+
+
+def _handle_download(
+    record,
+    pbar=None,
+    segments=1,
+    rate_limiter=None,
+    telemetry=None,
+):
     srp = record["study_accession"]
     srx = record["experiment_accession"]
     srr = record["run_accession"]
-    download_url = record["download_url"]
-    srapath_url = record["srapath_url"]
     out_dir = record["out_dir"]
     if pbar:
         pbar.set_description("{}/{}/{}".format(srp, srx, srr))
     srp_dir = os.path.join(out_dir, srp)
     srx_dir = os.path.join(srp_dir, srx)
-    download_filename = path_leaf(download_url)
-    if ".fastq.gz" not in download_filename:
-        srr_location = os.path.join(srx_dir, srr + ".sra")
-    else:
-        srr_location = os.path.join(srx_dir, download_filename)
     mkdir_p(srx_dir)
-    if use_ascp:
-        ascp = ASCP_CMD_PREFIX.replace("ascp", ascp_bin)
+    download_url, srr_location, md5_hash = _download_location(record)
+    download_file(
+        download_url,
+        srr_location,
+        md5_hash=md5_hash,
+        segments=segments,
+        rate_limiter=rate_limiter,
+        telemetry=telemetry,
+    )
+    if not os.path.exists(srr_location):
+        # partial data is kept next to it and resumed on the next attempt
+        raise IOError("Could not download {}".format(download_url))
+    if pbar:
+        pbar.update()
+
+
+def _aspera_files(records):
+    """List the aspera URLs of records and their destinations.
+
+    Returns
+    -------
+    urls: list
+    destinations: list
+                  Paths relative to the download directory (srp/srx/filename)
+    run_accessions: list
+    """
+    urls = []
+    destinations = []
+    run_accessions = []
+    for record in records:
+        srx_dir = os.path.join(
+            record["study_accession"], record["experiment_accession"]
+        )
         ena_cols = [x for x in list(record.keys()) if "ena_fastq_ftp" in x]
         for col in ena_cols:
             download_url = record[col]
-            cmd = "{} {} {} {}".format(
-                ascp, _find_aspera_keypath(ascp_dir), download_url, srx_dir
-            )
-            run_command(cmd, verbose=False)
+            if not isinstance(download_url, str) or not download_url:
+                continue
+            urls.append(download_url)
+            destinations.append(os.path.join(srx_dir, path_leaf(download_url)))
+            run_accessions.append(record["run_accession"])
+    return urls, destinations, run_accessions
+
+
+def _record_download_result(manifest, srr_location, error):
+    """Record the outcome of a download in the manifest."""
+    if error is None:
+        manifest.update(srr_location, DONE, bytes_done=os.path.getsize(srr_location))
+    elif isinstance(error, MD5MismatchException):
+        manifest.update(srr_location, CORRUPT, bytes_done=0)
     else:
-        if srapath_url is not None:
-            download_filename = path_leaf(srapath_url)
-            if ".fastq.gz" not in download_filename:
-                srr_location = os.path.join(srx_dir, srr + ".sra")
-            else:
-                srr_location = os.path.join(srx_dir, download_filename)
-            download_file(srapath_url, srr_location)
-        else:
-            download_file(download_url, srr_location)
-    if pbar:
-        pbar.update()
+        part_location = srr_location + ".part"
+        bytes_done = (
+            os.path.getsize(part_location) if os.path.exists(part_location) else 0
+        )
+        manifest.update(srr_location, FAILED, bytes_done=bytes_done)
 
 
-def _create_query(select_type_sql, gses):
-    sql = (
-        "SELECT DISTINCT "
-        + select_type_sql
-        + " FROM sra_ft WHERE sra_ft MATCH '"
-        + " OR ".join(gses)
-        + "';"
-    )
+def _handle_download_with_manifest(record, manifest, **kwargs):
+    """Download a record, keeping its manifest entry up to date."""
+    _, srr_location, _ = _download_location(record)
+    manifest.update(srr_location, DOWNLOADING)
+    try:
+        _handle_download(record, **kwargs)
+    except Exception as e:
+        _record_download_result(manifest, srr_location, e)
+        raise
+    _record_download_result(manifest, srr_location, None)
+
+
+def _create_query(select_type_sql):
+    sql = "SELECT DISTINCT " + select_type_sql + " FROM sra_ft WHERE sra_ft MATCH ?;"
     return sql
 
 
+def _concat_results(dfs, report=True):
+    """Concatenate the results of several lookups, dropping duplicate rows."""
+    dfs = [df for df in dfs if len(df.index)]
+    if not dfs:
+        if report:
+            sys.stderr.write("Found no matching results for query.\n")
+        return pd.DataFrame()
+    # a row can be found by terms of several chunks
+    return pd.concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+
+
 def _expand_sample_attrs(metadata_df):
     if "sample_attribute" in metadata_df.columns.tolist():
         metadata_df = expand_sample_attribute_columns(metadata_df)
@@ -210,7 +393,7 @@ def _verify_srametadb(filepath):
 
 
 class SRAdb(BASEdb):
-    def __init__(self, sqlite_file):
+    def __init__(self, sqlite_file, index_file=None, immutable=False, threads=1):
         """Initialize SRAdb.
 
         Parameters
@@ -218,47 +401,120 @@ class SRAdb(BASEdb):
 
         sqlite_file: string
                      Path to unzipped SRAmetadb.sqlite file
+        index_file: string
+                    Path to the accession index built by
+                    `pysradb metadb index` (default: next to sqlite_file,
+                    used if it exists)
+        immutable: bool
+                   Open the file as immutable, see `BASEdb`
+        threads: int
+                 Number of connections long accession lists are looked
+                 up over in parallel
 
 
         """
         _verify_srametadb(sqlite_file)
-        super(SRAdb, self).__init__(sqlite_file)
+        super(SRAdb, self).__init__(sqlite_file, immutable=immutable, threads=threads)
         self._db_type = "SRA"
-        self.valid_in_acc_type = [
-            "SRA",
-            "ERA",
-            "DRA",
-            "SRP",
-            "ERP",
-            "DRP",
-            "SRS",
-            "ERS",
-            "DRS",
-            "SRX",
-            "ERX",
-            "DRX",
-            "SRR",
-            "ERR",
-            "DRR",
-        ]
-        self.valid_in_type = {
-            "SRA": "submission",
-            "ERA": "submission",
-            "DRA": "submission",
-            "SRP": "study",
-            "ERP": "study",
-            "DRP": "study",
-            "SRS": "sample",
-            "ERS": "sample",
-            "DRS": "sample",
-            "SRX": "experiment",
-            "ERX": "experiment",
-            "DRX": "experiment",
-            "SRR": "run",
-            "ERR": "run",
-            "DRR": "run",
+        self.valid_in_acc_type = list(VALID_IN_ACC_TYPE)
+        self.valid_in_type = dict(VALID_IN_TYPE)
+        self._column_sources = self._base_table_columns()
+        self.index = AccessionIndex.open_for(sqlite_file, index_file)
+
+    def close(self):
+        """Close sqlite connection."""
+        super(SRAdb, self).close()
+        if self.index is not None:
+            self.index.close()
+
+    def _base_table_columns(self):
+        """Get the sra_ft columns that can be read from the base tables.
+
+        Returns
+        -------
+        column_sources: dict
+                        The entries of SRA_COLUMN_SOURCES present in this file
+        """
+        tables = set(self.list_tables())
+        if not set(["study", "experiment", "sample", "run"]).issubset(tables):
+            return {}
+        fields = {}
+        for table in ["study", "experiment", "sample", "run"]:
+            fields[table] = set(self.desc_table(table)["name"])
+        return {
+            column: source
+            for column, source in SRA_COLUMN_SOURCES.items()
+            if source.split(".")[1] in fields[source.split(".")[0]]
         }
 
+    def _lookup(self, select_type, accessions, exact=True):
+        """Get the distinct sra_ft rows of a list of accessions.
+
+        Accessions of a single type (SRP, SRX, SRS or SRR) are looked up
+        exactly in the indexed accession columns of the base tables,
+        with bound parameters. With an accession index, GSE/GSM aliases
+        and mixed types are first resolved to their runs through it.
+        Anything else (search strings, accessions missing from the index)
+        goes through full-text MATCH on sra_ft, with the terms bound as a
+        parameter in chunks of MATCH_CHUNK_SIZE.
+
+        Parameters
+        ----------
+        select_type: list
+                     sra_ft columns to select
+        accessions: list
+                    Accessions or search terms
+        exact: bool
+               False to always use full-text MATCH
+
+        Returns
+        -------
+        results: DataFrame
+        """
+        in_types = set(
+            self.valid_in_type.get(re.sub("\\d+$", "", acc).upper())
+            for acc in accessions
+        )
+        in_type = in_types.pop() if len(in_types) == 1 else None
+        if exact and all(column in self._column_sources for column in select_type):
+            sql = "SELECT DISTINCT {} FROM {} WHERE {{}} IN ({{{{}}}})".format(
+                ",".join(
+                    "{} AS {}".format(self._column_sources[column], column)
+                    for column in select_type
+                ),
+                SRA_BASE_TABLES_SQL,
+            )
+            if in_type in SRA_ACCESSION_COLUMNS:
+                return self.query_in(
+                    sql.format(SRA_ACCESSION_COLUMNS[in_type]),
+                    [acc.upper() for acc in accessions],
+                )
+            if self.index is not None:
+                known = self.index.known(accessions)
+                runs = self.index.descendants(known, "run") if known else []
+                # terms the index does not know are still searched for
+                accessions = [
+                    acc for acc in accessions if acc.strip().upper() not in known
+                ]
+                dfs = []
+                if runs:
+                    dfs.append(
+                        self.query_in(sql.format(SRA_ACCESSION_COLUMNS["run"]), runs)
+                    )
+                if accessions:
+                    dfs.append(self._match(select_type, accessions))
+                return _concat_results(dfs)
+        return _concat_results([self._match(select_type, accessions)])
+
+    def _match(self, select_type, terms):
+        """Get the distinct sra_ft rows matching any of `terms`."""
+        sql = _create_query(",".join(select_type))
+        dfs = [
+            self._query(sql, [" OR ".join(terms[i : i + MATCH_CHUNK_SIZE])])
+            for i in range(0, len(terms), MATCH_CHUNK_SIZE)
+        ]
+        return _concat_results(dfs, report=False)
+
     def sra_metadata(
         self,
         acc,
@@ -338,15 +594,7 @@ class SRAdb(BASEdb):
         output_columns = [x for x in output_columns if x != in_type]
         output_columns = unique(output_columns)
         select_type = [in_type + "_accession"] + output_columns
-        select_type_sql = (",").join(select_type)
-        sql = (
-            "SELECT DISTINCT "
-            + select_type_sql
-            + " FROM sra_ft WHERE sra_ft MATCH '"
-            + " OR ".join(acc)
-            + "';"
-        )
-        df = self.query(sql)
+        df = self._lookup(select_type, acc, exact=not acc_is_searchstr)
         if not len(df.index):
             sys.stderr.write("Empty results")
             return df
@@ -558,9 +806,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gses)
-        df = self.query(sql)
+        df = self._lookup(out_type, gses)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -596,9 +842,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gsms)
-        df = self.query(sql)
+        df = self._lookup(out_type, gsms)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -638,9 +882,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gsms)
-        df = self.query(sql)
+        df = self._lookup(out_type, gsms)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -677,9 +919,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gsms)
-        df = self.query(sql)
+        df = self._lookup(out_type, gsms)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -715,9 +955,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gsms)
-        df = self.query(sql)
+        df = self._lookup(out_type, gsms)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -751,9 +989,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gses)
-        df = self.query(sql)
+        df = self._lookup(out_type, gses)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -787,9 +1023,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, gsms)
-        df = self.query(sql)
+        df = self._lookup(out_type, gsms)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -825,9 +1059,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srrs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srrs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -862,9 +1094,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srrs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srrs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -899,9 +1129,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srxs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srxs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -936,9 +1164,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srss)
-        df = self.query(sql)
+        df = self._lookup(out_type, srss)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -973,9 +1199,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srss)
-        df = self.query(sql)
+        df = self._lookup(out_type, srss)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -1015,9 +1239,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srrs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srrs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -1056,9 +1278,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srxs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srxs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -1092,9 +1312,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srrs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srrs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -1133,9 +1351,7 @@ class SRAdb(BASEdb):
             ]
         if sample_attribute:
             out_type += ["sample_attribute"]
-        select_type_sql = (",").join(out_type)
-        sql = _create_query(select_type_sql, srxs)
-        df = self.query(sql)
+        df = self._lookup(out_type, srxs)
         df = _prettify_df(df, out_type, expand_sample_attributes)
         return df
 
@@ -1193,17 +1409,18 @@ class SRAdb(BASEdb):
         results: dict
                  Dictionary with relevant hits
         """
+        cursor = self.connection().cursor()
         if "GSM" in srx:
-            results = self.cursor.execute(
-                'select * from EXPERIMENT where experiment_alias = "{}"'.format(srx)
+            results = cursor.execute(
+                "select * from EXPERIMENT where experiment_alias = ?", (srx,)
             ).fetchall()
         else:
-            results = self.cursor.execute(
-                'select * from EXPERIMENT where experiment_accession = "{}"'.format(srx)
+            results = cursor.execute(
+                "select * from EXPERIMENT where experiment_accession = ?", (srx,)
             ).fetchall()
         assert len(results) == 1, "Got multiple hits"
         results = results[0]
-        column_names = list([x[0] for x in self.cursor.description])
+        column_names = list([x[0] for x in cursor.description])
         results = dict(list(zip(column_names, results)))
         return pd.DataFrame.from_dict(results, orient="index").T
 
@@ -1450,6 +1667,12 @@ class SRAdb(BASEdb):
         ascp_bin=None,
         skip_confirmation=False,
         threads=1,
+        segments=1,
+        host_connections=DEFAULT_HOST_CONNECTIONS,
+        max_bandwidth=None,
+        retries=DEFAULT_RETRIES,
+        engine="thread",
+        telemetry=None,
     ):
         """Download SRA files.
 
@@ -1469,11 +1692,51 @@ class SRAdb(BASEdb):
                   ['fasp'/'ftp'] fasp => faster download, ftp => slower
         ascp_dir: string
                   Location of ascp directory
+        threads: int
+                 Number of files to download in parallel. With
+                 engine="async", the number of transfers in flight
+                 (DEFAULT_ASYNC_CONCURRENCY if left at 1). With use_ascp,
+                 the number of concurrent ascp sessions (see
+                 `AsperaTransfer`), which share max_bandwidth.
+        segments: int
+                  Number of connections per file: large HTTP downloads
+                  are split in byte ranges fetched in parallel
+        host_connections: int or dict
+                          Maximum number of files downloaded at once from
+                          the same host, or a dict of per-host limits
+        max_bandwidth: float
+                       Total download bandwidth in bytes per second
+                       (default: unlimited)
+        retries: int
+                 Number of times a failed download is retried
+        engine: string
+                "thread" (default) runs one download per thread.
+                "async" runs all HTTP(S) downloads on one asyncio event
+                loop, for batches of many small files (requires aiohttp,
+                not available with use_ascp).
+        telemetry: DownloadTelemetry
+                   Records bytes, duration, throughput, time to first
+                   byte and failures of every download attempt, per file
+                   and per host (not available with use_ascp)
+
+        Files are downloaded largest first. Failed downloads are retried
+        with exponential backoff, resuming from the partial data. Files
+        with an MD5 in the metadata (for example ena_fastq_md5_1 for
+        ena_fastq_http_1) are verified while they are written.
+
+        Progress is journaled in a manifest in `out_dir`
+        (see `DownloadManifest`): a restarted download skips the files
+        completed before, reuses their known sizes, resumes partial files
+        and downloads corrupt ones again.
         """
+        if engine not in ["thread", "async"]:
+            raise ValueError("engine must be 'thread' or 'async'")
         if out_dir is None:
             out_dir = os.path.join(os.getcwd(), "pysradb_downloads")
         if srp:
             df = self.sra_metadata(srp, detailed=True)
+        if use_ascp and engine == "async":
+            raise ValueError("engine='async' does not support aspera downloads")
         if use_ascp:
             if ascp_dir is None:
                 ascp_dir = os.path.join(os.path.expanduser("~"), ".aspera")
@@ -1488,6 +1751,8 @@ class SRAdb(BASEdb):
                 use_ascp = False
             else:
                 ascp_bin = os.path.join(ascp_dir, "connect", "bin", "ascp")
+        # MD5s from the metadata (ENA fastq_md5, NCBI SRAFile md5), by URL
+        url_md5 = _url_md5s(df)
         # Does the necessary column formatting for the dataframe
         df = self._format_dataframe_for_download(df.copy(), url_col, use_ascp)
         if url_col not in df.columns.tolist():
@@ -1526,33 +1791,181 @@ class SRAdb(BASEdb):
         if not len(df.index):
             print("Could not locate {} in db".format(srp))
             sys.exit(0)
+        df["srapath_url"] = df[url_col].tolist()
+        df["md5"] = [url_md5.get(url) for url in df["srapath_url"]]
+        manifest = None
         if not use_ascp:
-            print("Checking download URLs", flush=True)
-            df["filesize"] = df.apply(
-                lambda x: get_file_size(x, url_col), axis=1
-            ).tolist()
-            df.dropna(subset=["filesize"])
+            # plan from the manifest of previous runs into out_dir
+            manifest = DownloadManifest(out_dir)
+            locations = [_download_location(record) for record in df.to_dict("records")]
+            entries = manifest.get([location for _, location, _ in locations])
+            done = [
+                entry is not None and entry["status"] == DONE and entry["url"] == url
+                for (url, _, _), entry in zip(locations, entries)
+            ]
+            if any(done):
+                print(
+                    "Skipping {} files already downloaded and verified".format(
+                        sum(done)
+                    ),
+                    flush=True,
+                )
+            keep = [not x for x in done]
+            df = df.loc[keep]
+            locations = [x for x, k in zip(locations, keep) if k]
+            entries = [x for x, k in zip(entries, keep) if k]
+            if not len(df.index):
+                manifest.close()
+                return df
+            # sizes recorded by earlier runs are not looked up again
+            sizes = [
+                entry["size"] if entry is not None and entry["url"] == url else None
+                for (url, _, _), entry in zip(locations, entries)
+            ]
+            unknown = [i for i, size in enumerate(sizes) if not size]
+            if unknown:
+                print("Checking download URLs", flush=True)
+                probed = get_file_sizes(
+                    df.iloc[unknown], url_col, cache=getattr(self, "cache", None)
+                )
+                for i, size in zip(unknown, probed):
+                    sizes[i] = size
+            df["filesize"] = sizes
+            manifest.add(
+                [
+                    {
+                        "file_path": location,
+                        "run_accession": run_accession,
+                        "url": url,
+                        "size": int(size) if size == size and size else None,
+                        "md5": md5_hash,
+                    }
+                    for (url, location, md5_hash), run_accession, size in zip(
+                        locations, df["run_accession"], sizes
+                    )
+                ]
+            )
+            # URLs whose size could not be probed are invalid or missing
+            reachable = [size == size for size in sizes]
+            if not all(reachable):
+                print(
+                    "Skipping {} files that could not be found".format(
+                        reachable.count(False)
+                    ),
+                    flush=True,
+                )
+                df = df.loc[reachable]
+                sizes = [size for size, k in zip(sizes, reachable) if k]
+                if not len(df.index):
+                    manifest.close()
+                    return df
             total_file_size = millify(np.sum(df["filesize"]))
             df["filesize"] = df["filesize"].apply(lambda x: millify(x)).tolist()
             print("The following files will be downloaded: \n")
             pd.set_option("display.max_colwidth", None)
-            print(df.to_string(index=False, justify="left", col_space=0))
+            print(
+                df.drop(columns=["srapath_url", "md5"]).to_string(
+                    index=False, justify="left", col_space=0
+                )
+            )
             print(os.linesep)
             print("Total size: {}".format(total_file_size))
             print(os.linesep, flush=True)
             if not skip_confirmation:
                 if not confirm("Start download? "):
+                    manifest.close()
                     sys.exit(0)
-        df["srapath_url"] = df[url_col].tolist()
-        thread_map(
-            partial(
-                _handle_download,
-                use_ascp=use_ascp,
+        else:
+            sizes = None
+        records = df.to_dict("records")
+        rate_limiter = None
+        if max_bandwidth:
+            rate_limiter = RateLimiter(max_bandwidth)
+        if engine == "async":
+            jobs = []
+            for record, size in zip(records, sizes):
+                url, srr_location, md5_hash = _download_location(record)
+                mkdir_p(os.path.dirname(srr_location))
+                jobs.append(
+                    {
+                        "url": url,
+                        "file_path": srr_location,
+                        "md5": md5_hash,
+                        "size": size,
+                    }
+                )
+            try:
+                download_files_async(
+                    jobs,
+                    concurrency=threads if threads > 1 else DEFAULT_ASYNC_CONCURRENCY,
+                    host_connections=host_connections,
+                    retries=retries,
+                    rate_limiter=rate_limiter,
+                    telemetry=telemetry,
+                    callback=lambda job, error: _record_download_result(
+                        manifest, job["file_path"], error
+                    ),
+                )
+            finally:
+                manifest.close()
+            return df
+        if use_ascp:
+            urls, destinations, run_accessions = _aspera_files(records)
+            file_paths = dict(
+                (url, os.path.join(out_dir, destination))
+                for url, destination in zip(urls, destinations)
+            )
+            transfer = AsperaTransfer(
                 ascp_bin=ascp_bin,
-                ascp_dir=ascp_dir,
-            ),
-            df.to_dict("records"),
-            max_workers=threads,
+                keypath=_find_aspera_keypath(ascp_dir),
+                sessions=threads,
+                rate=max_bandwidth * 8 / 1e6 if max_bandwidth else DEFAULT_ASCP_RATE,
+                retries=retries,
+            )
+            # failed transfers are journaled before run raises
+            manifest = DownloadManifest(out_dir)
+            try:
+                manifest.add(
+                    [
+                        {
+                            "file_path": file_paths[url],
+                            "run_accession": run_accession,
+                            "url": url,
+                        }
+                        for url, run_accession in zip(urls, run_accessions)
+                    ]
+                )
+                transfer.run(
+                    urls,
+                    destinations,
+                    out_dir,
+                    callback=lambda url, error: _record_download_result(
+                        manifest, file_paths[url], error
+                    ),
+                )
+            finally:
+                manifest.close()
+            return df
+        scheduler = DownloadScheduler(
+            threads=threads, host_connections=host_connections, retries=retries
         )
+        try:
+            scheduler.run(
+                partial(
+                    _handle_download_with_manifest,
+                    manifest=manifest,
+                    segments=segments,
+                    rate_limiter=rate_limiter,
+                    telemetry=telemetry,
+                ),
+                records,
+                hosts=[
+                    url_host(record["srapath_url"] or record["download_url"])
+                    for record in records
+                ],
+                sizes=sizes,
+            )
+        finally:
+            manifest.close()
 
         return df
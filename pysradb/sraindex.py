@@ -0,0 +1,269 @@
+"""Sidecar accession index of a local SRAmetadb.sqlite"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+import warnings
+
+from .basedb import chunk_params
+
+# Default index path: next to the SRAmetadb file
+INDEX_SUFFIX = ".pysradb-index"
+# Accession types, stored as their position in this list
+INDEX_TYPES = ["study", "experiment", "sample", "run", "gse", "gsm"]
+
+# (parent type, child type, SQL selecting parent and child accessions)
+INDEX_LINKS = [
+    (
+        "study",
+        "experiment",
+        "SELECT study_accession, experiment_accession FROM src.experiment",
+    ),
+    (
+        "sample",
+        "experiment",
+        "SELECT sample_accession, experiment_accession FROM src.experiment",
+    ),
+    ("experiment", "run", "SELECT experiment_accession, run_accession FROM src.run"),
+    (
+        "gse",
+        "study",
+        "SELECT study_alias, study_accession FROM src.study "
+        "WHERE study_alias LIKE 'GSE%'",
+    ),
+    (
+        "gsm",
+        "experiment",
+        "SELECT experiment_alias, experiment_accession FROM src.experiment "
+        "WHERE experiment_alias LIKE 'GSM%'",
+    ),
+    (
+        "gsm",
+        "sample",
+        "SELECT sample_alias, sample_accession FROM src.sample "
+        "WHERE sample_alias LIKE 'GSM%'",
+    ),
+]
+
+
+def accession_index_path(sqlite_file):
+    """Get the default path of the accession index of a SRAmetadb file."""
+    return sqlite_file + INDEX_SUFFIX
+
+
+def _source_signature(sqlite_file):
+    stat = os.stat(sqlite_file)
+    return str(stat.st_size), str(int(stat.st_mtime))
+
+
+def build_accession_index(sqlite_file, index_file=None):
+    """Build the accession index of a SRAmetadb.sqlite file.
+
+    The index is a compact SQLite file holding every SRP/SRX/SRS/SRR
+    accession and GSE/GSM alias once, as an integer id, plus the
+    parent/child links between them (GSE -> SRP -> SRX -> SRR,
+    SRS -> SRX, GSM -> SRX/SRS), both stored as WITHOUT ROWID B-trees.
+    It is written next to the SRAmetadb file, which is only read.
+
+    Parameters
+    ----------
+    sqlite_file: string
+                 Path to SRAmetadb.sqlite
+    index_file: string
+                Path of the index (default: `accession_index_path`)
+
+    Returns
+    -------
+    index_file: string
+    """
+    if index_file is None:
+        index_file = accession_index_path(sqlite_file)
+    tmp_file = index_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    db = sqlite3.connect("file:{}".format(tmp_file), uri=True)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("ATTACH DATABASE ? AS src", ("file:{}?mode=ro".format(sqlite_file),))
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute(
+            "CREATE TABLE accessions (id INTEGER PRIMARY KEY, "
+            "accession TEXT NOT NULL UNIQUE, type INTEGER NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE links (parent INTEGER, child INTEGER, "
+            "PRIMARY KEY (parent, child)) WITHOUT ROWID"
+        )
+        for table in ["study", "experiment", "sample", "run"]:
+            sys.stderr.write("Indexing {} accessions\n".format(table))
+            db.execute(
+                "INSERT OR IGNORE INTO accessions (accession, type) "
+                "SELECT UPPER({0}_accession), ? FROM src.{0} "
+                "WHERE {0}_accession IS NOT NULL".format(table),
+                (INDEX_TYPES.index(table),),
+            )
+        for parent_type, child_type, sql in INDEX_LINKS:
+            sys.stderr.write(
+                "Indexing {} -> {} links\n".format(parent_type, child_type)
+            )
+            if parent_type in ["gse", "gsm"]:
+                db.execute(
+                    "INSERT OR IGNORE INTO accessions (accession, type) "
+                    "WITH pairs (parent, child) AS ({}) "
+                    "SELECT UPPER(parent), ? FROM pairs".format(sql),
+                    (INDEX_TYPES.index(parent_type),),
+                )
+            db.execute(
+                "INSERT OR IGNORE INTO links "
+                "WITH pairs (parent, child) AS ({}) "
+                "SELECT p.id, c.id FROM pairs "
+                "JOIN accessions AS p ON p.accession = UPPER(pairs.parent) "
+                "JOIN accessions AS c ON c.accession = UPPER(pairs.child)".format(sql)
+            )
+        db.execute("CREATE INDEX links_child ON links (child, parent)")
+        size, mtime = _source_signature(sqlite_file)
+        db.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("source_size", size),
+                ("source_mtime", mtime),
+                ("created", str(time.time())),
+            ],
+        )
+        db.commit()
+        db.execute("DETACH DATABASE src")
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    os.replace(tmp_file, index_file)
+    return index_file
+
+
+class AccessionIndex(object):
+    def __init__(self, index_file):
+        """Open an accession index built by `build_accession_index`.
+
+        Parameters
+        ----------
+        index_file: string
+                    Path to the index
+        """
+        self.index_file = index_file
+        self.db = sqlite3.connect(
+            "file:{}?mode=ro".format(index_file), uri=True, check_same_thread=False
+        )
+        self.meta = dict(self.db.execute("SELECT key, value FROM meta").fetchall())
+        # the connection is shared by the threads using a SRAdb
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open_for(cls, sqlite_file, index_file=None):
+        """Open the index of a SRAmetadb file, if there is an up to date one.
+
+        Parameters
+        ----------
+        sqlite_file: string
+                     Path to SRAmetadb.sqlite
+        index_file: string
+                    Path to the index (default: `accession_index_path`)
+
+        Returns
+        -------
+        index: AccessionIndex
+               None if there is no index, or if it was built from another
+               version of `sqlite_file`
+        """
+        if index_file is None:
+            index_file = accession_index_path(sqlite_file)
+        if not os.path.exists(index_file):
+            return None
+        index = cls(index_file)
+        size, mtime = _source_signature(sqlite_file)
+        if (index.meta.get("source_size"), index.meta.get("source_mtime")) != (
+            size,
+            mtime,
+        ):
+            warnings.warn(
+                "Ignoring {}, it was built from another version of {}. "
+                "Rebuild it with `pysradb metadb index`.".format(
+                    index_file, sqlite_file
+                )
+            )
+            index.close()
+            return None
+        return index
+
+    def _walk(self, accessions, to_type, step):
+        if step == "down":
+            join = "links.parent = walk.id", "links.child"
+        else:
+            join = "links.child = walk.id", "links.parent"
+        accessions = list(dict.fromkeys(acc.strip().upper() for acc in accessions))
+        found = []
+        for placeholders, params in chunk_params(accessions):
+            with self._lock:
+                found += self.db.execute(
+                    "WITH RECURSIVE walk (id) AS ("
+                    "SELECT id FROM accessions WHERE accession IN ({}) "
+                    "UNION SELECT {} FROM links JOIN walk ON {}) "
+                    "SELECT accession FROM accessions JOIN walk USING (id) "
+                    "WHERE type = ?".format(placeholders, join[1], join[0]),
+                    params + [INDEX_TYPES.index(to_type)],
+                ).fetchall()
+        return sorted(set(acc for acc, in found))
+
+    def known(self, accessions):
+        """Get the accessions present in the index.
+
+        Parameters
+        ----------
+        accessions: list
+                    Accessions of any type
+
+        Returns
+        -------
+        accessions: set
+                    Upper case accessions found in the index
+        """
+        accessions = list(dict.fromkeys(acc.strip().upper() for acc in accessions))
+        found = []
+        for placeholders, params in chunk_params(accessions):
+            with self._lock:
+                found += self.db.execute(
+                    "SELECT accession FROM accessions "
+                    "WHERE accession IN ({})".format(placeholders),
+                    params,
+                ).fetchall()
+        return set(acc for acc, in found)
+
+    def descendants(self, accessions, to_type):
+        """Get the accessions of a type below a list of accessions.
+
+        Parameters
+        ----------
+        accessions: list
+                    Accessions of any indexed type
+        to_type: string
+                 One of INDEX_TYPES, for example "run"
+
+        Returns
+        -------
+        accessions: list
+                    Sorted accessions of `to_type`, including the input
+                    accessions of that type
+        """
+        return self._walk(accessions, to_type, "down")
+
+    def ancestors(self, accessions, to_type):
+        """Get the accessions of a type above a list of accessions.
+
+        See `descendants`.
+        """
+        return self._walk(accessions, to_type, "up")
+
+    def close(self):
+        """Close the index."""
+        self.db.close()
@@ -1,12 +1,18 @@
 """Utilities to interact with SRA online"""
 
 import concurrent.futures
+import itertools
+import json
 import os
 import pandas as pd
+import re
 import sys
+import threading
 import time
 import warnings
+import xml.etree.ElementTree as Et
 from collections import OrderedDict
+from functools import partial
 from json.decoder import JSONDecodeError
 from xml.parsers.expat import ExpatError
 
@@ -14,13 +20,100 @@ import numpy as np
 import pandas as pd
 import requests
 import xmltodict
+from lxml import etree
 
+from .graph import AccessionGraph
+from .graph import accession_type
+from .ratelimit import EUTILS_HOST
+from .ratelimit import eutils_rate_limiter
 from .sradb import SRAdb
+from .sradb import VALID_IN_TYPE
+from .transport import DEFAULT_POOL_MAXSIZE
+from .transport import HTTPTransport
+from .transport import get_default_transport
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
 from xml.sax.saxutils import escape
 
+# Initial page sizes (retmax) for esummary and efetch requests. efetch
+# pages are parsed into columns while they download, without building a
+# tree of the whole page, so they start out larger.
+DEFAULT_RETMAX = {"esummary": 500, "efetch": 2000}
+# E-utilities hard limit on retmax
+MAX_RETMAX = 10000
+MIN_RETMAX = 20
+# Page sizes adapt so that a page takes about this long and is about this big
+TARGET_PAGE_SECONDS = 10
+TARGET_PAGE_BYTES = 32 * 1024 * 1024
+# efetch responses are parsed as they arrive, in chunks of this size
+EFETCH_CHUNK_SIZE = 64 * 1024
+# Columns of the non-detailed sra_metadata() table
+SUMMARY_COLUMNS = [
+    "study_accession",
+    "study_title",
+    "experiment_accession",
+    "experiment_title",
+    "experiment_desc",
+    "organism_taxid",
+    "organism_name",
+    "library_name",
+    "library_strategy",
+    "library_source",
+    "library_selection",
+    "library_layout",
+    "sample_accession",
+    "sample_title",
+    "biosample",
+    "bioproject",
+    "instrument",
+    "instrument_model",
+    "instrument_model_desc",
+    "total_spots",
+    "total_size",
+]
+SUMMARY_RUN_COLUMNS = ["run_accession", "run_total_spots", "run_total_bases"]
+CATEGORICAL_COLUMNS = [
+    "library_strategy",
+    "library_source",
+    "library_selection",
+    "library_layout",
+    "instrument",
+    "instrument_model",
+    "instrument_model_desc",
+]
+INTEGER_COLUMNS = ["total_spots", "total_size", "run_total_spots", "run_total_bases"]
+ENA_COLUMNS = [
+    "ena_fastq_http",
+    "ena_fastq_http_1",
+    "ena_fastq_http_2",
+    "ena_fastq_ftp",
+    "ena_fastq_ftp_1",
+    "ena_fastq_ftp_2",
+    "ena_fastq_md5",
+    "ena_fastq_md5_1",
+    "ena_fastq_md5_2",
+]
+# Bulk ENA lookups pack this many runs into one POST request
+ENA_CHUNK_SIZE = 1000
+ENA_MAX_REQUEST_LENGTH = 64 * 1024
+ENA_SEARCH_FIELDS = ["run_accession", "fastq_ftp", "fastq_md5"]
+# Throttled (429) and server-side (5xx) ENA responses are retried this often
+ENA_MAX_RETRIES = 5
+# resolve_many() splits accession lists so that each esearch term stays
+# well below the E-utilities term/URL length limits
+RESOLVE_CHUNK_SIZE = 500
+RESOLVE_MAX_TERM_LENGTH = 8000
+RESOLVE_COLUMNS = [
+    "accession",
+    "study_accession",
+    "experiment_accession",
+    "sample_accession",
+    "run_accession",
+    "study_alias",
+    "experiment_alias",
+]
+
 
 def xmlescape(data):
     return escape(data, entities={"'": "&apos;", '"': "&quot;"})
@@ -38,29 +131,452 @@ def _order_first(df, column_order_list):
     return df
 
 
-def _retry_response(base_url, payload, key, max_retries=10):
+def _retry_response(base_url, payload, key, max_retries=10, transport=None):
     """Rerty fetching esummary if API rate limit exceeeds"""
+    if transport is None:
+        transport = get_default_transport()
     for index, _ in enumerate(range(max_retries)):
+        request = transport.get(base_url, params=OrderedDict(payload))
         try:
-            request = requests.get(base_url, params=OrderedDict(payload))
             response = request.json()
             results = response[key]
             return response
-        except KeyError:
-            # sleep for increasing times
-            time.sleep(index + 1)
+        except (KeyError, JSONDecodeError):
+            # Requests are already throttled by the transport's rate
+            # limiter, so only back off as long as the server asks to
+            retry_after = request.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                time.sleep(int(retry_after))
+            else:
+                time.sleep(min(2**index, 10))
             continue
     raise RuntimeError("Failed to fetch esummary. API rate limit exceeded.")
 
 
+def _localname(element):
+    """Tag of an element without its namespace"""
+    tag = element.tag
+    if tag[:1] == "{":
+        return tag.rsplit("}", 1)[1]
+    return tag
+
+
+def _first_children(element):
+    """Map the child elements by tag, keeping the first of each"""
+    children = {}
+    for child in element:
+        if isinstance(child.tag, str):
+            children.setdefault(_localname(child), child)
+    return children
+
+
+def _summary_text(element):
+    if element is None:
+        return pd.NA
+    text = (element.text or "").strip()
+    return text or None
+
+
+def _parse_esummary_documents(esummary_result, uids):
+    """Parse the expxml and runs of all uids as a single document.
+
+    Returns
+    -------
+    documents: list
+               One element per uid with an <expxml> and a <runs> child
+    """
+    parser = etree.XMLParser(huge_tree=True)
+    documents = [
+        "<uid><expxml>{}</expxml><runs>{}</runs></uid>".format(
+            esummary_result[uid]["expxml"].strip(),
+            esummary_result[uid]["runs"].strip(),
+        )
+        for uid in uids
+    ]
+    try:
+        root = etree.fromstring(
+            "<root>{}</root>".format("".join(documents)).encode("utf-8"), parser
+        )
+        return list(root)
+    except etree.XMLSyntaxError:
+        pass
+    # report the offending record
+    parsed = []
+    for document in documents:
+        try:
+            parsed.append(etree.fromstring(document.encode("utf-8"), parser))
+        except etree.XMLSyntaxError:
+            raise RuntimeError("Unable to parse xml: {}".format(document))
+    return parsed
+
+
+def _esummary_columns(esummary_result, uids):
+    """Extract the summary table from SRA esummary records.
+
+    Parameters
+    ----------
+    esummary_result: dict
+                     esummary result with an "expxml" and "runs" XML
+                     string for every uid
+    uids: list
+          uids in the order they should appear
+
+    Returns
+    -------
+    columns: OrderedDict
+             Column name to list of values, one row per run (or per
+             experiment if it has no runs)
+    """
+    columns = OrderedDict((column, []) for column in SUMMARY_COLUMNS)
+    run_columns = OrderedDict((column, []) for column in SUMMARY_RUN_COLUMNS)
+    for document in _parse_esummary_documents(esummary_result, uids):
+        expxml, runs = document[0], document[1]
+        exp = _first_children(expxml)
+        summary = _first_children(exp["Summary"])
+        platform = summary.get("Platform")
+        statistics = summary.get("Statistics")
+        statistics = statistics.attrib if statistics is not None else {}
+        organism = exp.get("Organism")
+        instrument = exp["Instrument"]
+        library = _first_children(exp["Library_descriptor"])
+        layout = library.get("LIBRARY_LAYOUT")
+        layout = [_localname(x) for x in layout if isinstance(x.tag, str)]
+
+        row = [
+            exp["Study"].get("acc"),
+            exp["Study"].get("name"),
+            exp["Experiment"].get("acc"),
+            exp["Experiment"].get("name"),
+            _summary_text(summary.get("Title")),
+            organism.get("taxid", pd.NA) if organism is not None else pd.NA,
+            organism.get("ScientificName", pd.NA) if organism is not None else pd.NA,
+            (
+                _summary_text(library["LIBRARY_NAME"])
+                if "LIBRARY_NAME" in library
+                else ""
+            ),
+            _summary_text(library.get("LIBRARY_STRATEGY")),
+            _summary_text(library.get("LIBRARY_SOURCE")),
+            _summary_text(library.get("LIBRARY_SELECTION")),
+            layout[0] if layout else pd.NA,
+            exp["Sample"].get("acc"),
+            exp["Sample"].get("name"),
+            _summary_text(exp.get("Biosample")),
+            _summary_text(exp.get("Bioproject")),
+            (
+                next(iter(instrument.attrib.values()))
+                if len(instrument.attrib)
+                else _summary_text(instrument)
+            ),
+            (
+                platform.get("instrument_model", pd.NA)
+                if platform is not None and len(platform.attrib)
+                else pd.NA
+            ),
+            (
+                _summary_text(platform)
+                if platform is not None and len(platform.attrib)
+                else pd.NA
+            ),
+            statistics.get("total_spots", pd.NA),
+            statistics.get("total_size", pd.NA),
+        ]
+        row = [_blank_to_none(value) for value in row]
+        run_elements = [x for x in runs if _localname(x) == "Run"]
+        if not run_elements:
+            # Sometimes the run_accession is not populated by NCBI
+            for column, value in zip(columns.values(), row):
+                column.append(value)
+            for column in run_columns.values():
+                column.append(np.nan)
+            continue
+        for run in run_elements:
+            for column, value in zip(columns.values(), row):
+                column.append(value)
+            run_columns["run_accession"].append(_blank_to_none(run.get("acc")))
+            run_columns["run_total_spots"].append(run.get("total_spots"))
+            run_columns["run_total_bases"].append(run.get("total_bases"))
+    if any(isinstance(x, str) for x in run_columns["run_accession"]):
+        columns.update(run_columns)
+    return columns
+
+
+def _set_summary_dtypes(metadata_df):
+    """Store repetitive fields as categoricals and counts as nullable ints"""
+    for column in metadata_df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            metadata_df[column] = metadata_df[column].astype("category")
+        elif column in INTEGER_COLUMNS:
+            metadata_df[column] = pd.to_numeric(
+                metadata_df[column], errors="coerce"
+            ).astype("Int64")
+    return metadata_df
+
+
+def _sra_records_to_df(sra_record, typed=False):
+    """Build the summary table from columns or a list of records"""
+    metadata_df = pd.DataFrame(sra_record).drop_duplicates()
+    if typed:
+        metadata_df = _set_summary_dtypes(metadata_df)
+    if "run_accession" in metadata_df.columns:
+        metadata_df = metadata_df.sort_values(by="run_accession")
+    metadata_df.columns = [x.lower().strip() for x in metadata_df.columns]
+    return metadata_df
+
+
+def _chunk_accessions(
+    accessions, chunk_size=RESOLVE_CHUNK_SIZE, max_term_length=RESOLVE_MAX_TERM_LENGTH
+):
+    """Split accessions into chunks that fit in a single esearch term."""
+    chunks = []
+    chunk = []
+    term_length = 0
+    for accession in accessions:
+        # accessions are joined with " OR "
+        length = len(accession) + 4
+        if chunk and (
+            len(chunk) >= chunk_size or term_length + length > max_term_length
+        ):
+            chunks.append(chunk)
+            chunk = []
+            term_length = 0
+        chunk.append(accession)
+        term_length += length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
 def get_retmax(n_records, retmax=500):
     """Get retstart and retmax till n_records are exhausted"""
     for i in range(0, n_records, retmax):
         yield i
 
 
+def _merge_esummary_results(results, result):
+    """Merge one esummary result page into the results so far"""
+    if not results:
+        return result
+    for key, value in result.items():
+        if key in list(results.keys()):
+            results[key] += value
+        else:
+            results[key] = value
+    return results
+
+
+def _blank_to_none(value):
+    if isinstance(value, str) and not value.strip():
+        return None
+    return value
+
+
+class _Columns(object):
+    def __init__(self):
+        """Column-oriented accumulator for records with varying fields.
+
+        Values are appended to one list per field. Fields first seen in
+        a later record are back-filled, and fields missing from a record
+        are filled, with None. Blank strings are stored as None.
+        """
+        self.columns = OrderedDict()
+        self.n_rows = 0
+
+    def _column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = []
+        if len(column) < self.n_rows:
+            column.extend([None] * (self.n_rows - len(column)))
+        return column
+
+    def append(self, record):
+        """Add one record (a mapping of field to value)."""
+        for name, value in record.items():
+            self._column(name).append(_blank_to_none(value))
+        self.n_rows += 1
+
+    def extend(self, columns):
+        """Add the rows of another column mapping."""
+        n_rows = max([len(values) for values in columns.values()] or [0])
+        for name, values in columns.items():
+            self._column(name).extend(values)
+        self.n_rows += n_rows
+
+    def to_dict(self):
+        """Get the accumulated columns, all of the same length."""
+        for name in self.columns:
+            self._column(name)
+        return self.columns
+
+
+def _ena_fastq_columns(run_accessions, fastq_ftps, fastq_md5s=None):
+    """Split ENA fastq_ftp values into the http and aspera URL columns,
+    with the MD5 of each file"""
+
+    def _mate(files, suffix):
+        for url, md5 in files:
+            if suffix in url:
+                return url, md5
+        return None, None
+
+    if fastq_md5s is None:
+        fastq_md5s = [None] * len(run_accessions)
+    columns = OrderedDict((column, []) for column in ["run_accession"] + ENA_COLUMNS)
+    for run_accession, fastq_ftp, fastq_md5 in zip(
+        run_accessions, fastq_ftps, fastq_md5s
+    ):
+        urls = (fastq_ftp or "").split(";")
+        md5s = (fastq_md5 or "").split(";")
+        md5s += [None] * (len(urls) - len(md5s))
+        files = [(url, md5 or None) for url, md5 in zip(urls, md5s) if url]
+        if not files:
+            continue
+        row = dict.fromkeys(ENA_COLUMNS)
+        if len(files) == 1:
+            mates = {"": files[0]}
+        elif len(files) == 2:
+            mates = {"_1": files[0], "_2": files[1]}
+        else:
+            # ignore extra (unpaired) files found for paired end runs
+            mates = {
+                "_1": _mate(files, "_1.fastq.gz"),
+                "_2": _mate(files, "_2.fastq.gz"),
+            }
+        for suffix, (url, md5) in mates.items():
+            if url is None:
+                continue
+            row["ena_fastq_http" + suffix] = "http://{}".format(url)
+            row["ena_fastq_ftp" + suffix] = url.replace(
+                "ftp.sra.ebi.ac.uk/", "era-fasp@fasp.sra.ebi.ac.uk:"
+            )
+            row["ena_fastq_md5" + suffix] = md5
+        columns["run_accession"].append(run_accession)
+        for column in ENA_COLUMNS:
+            columns[column].append(row[column])
+    return columns
+
+
+def _count_bytes(chunks, counter):
+    """Pass chunks through, adding their size to counter[0]"""
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def _element_text(element):
+    if element is None or element.text is None:
+        return None
+    return element.text.strip() or None
+
+
+def _experiment_package_runs(package):
+    """Flatten one EXPERIMENT_PACKAGE into one detailed record per RUN"""
+    experiment = package.find("EXPERIMENT")
+    experiment_accession = None
+    experiment_attributes = OrderedDict()
+    if experiment is not None:
+        experiment_accession = experiment.get("accession")
+        for attribute in experiment.iterfind(
+            "EXPERIMENT_ATTRIBUTES/EXPERIMENT_ATTRIBUTE"
+        ):
+            tag = _element_text(attribute.find("TAG"))
+            if tag is not None:
+                experiment_attributes[tag.lower()] = _element_text(
+                    attribute.find("VALUE")
+                )
+
+    sample_attributes = OrderedDict()
+    samples = package.findall("SAMPLE")
+    if len(samples) == 1:
+        for attribute in samples[0].iterfind("SAMPLE_ATTRIBUTES/SAMPLE_ATTRIBUTE"):
+            tag = _element_text(attribute.find("TAG"))
+            value = attribute.find("VALUE")
+            # TODO: Investigate why some attributes have just the key
+            # but no value
+            if tag is not None and value is not None:
+                sample_attributes[tag] = _element_text(value)
+
+    for run in package.iterfind("RUN_SET/RUN"):
+        record = OrderedDict()
+        record["experiment_accession"] = experiment_accession
+        record.update(experiment_attributes)
+        record["run_accession"] = run.get("accession")
+        record["run_alias"] = run.get("alias")
+        sra_files = run.findall("SRAFiles/SRAFile")
+        for sra_file in sra_files:
+            if len(sra_files) > 1:
+                # Multiple download URLs, prefix them by their cluster
+                cluster = sra_file.get("cluster")
+                if cluster is None:
+                    continue
+                cluster = cluster.lower().strip()
+                for key, value in sra_file.attrib.items():
+                    if key != "cluster":
+                        record["{}_{}".format(cluster, key)] = value
+            # Example: SRP184142
+            for alternative in sra_file.iterfind("Alternatives"):
+                org = alternative.get("org", "").lower()
+                for key, value in alternative.attrib.items():
+                    if key != "org":
+                        record["{}_{}".format(org, key)] = value
+        experiment_ref = run.find("EXPERIMENT_REF")
+        record["experiment_alias"] = (
+            experiment_ref.get("refname", "") if experiment_ref is not None else ""
+        )
+        record.update(sample_attributes)
+        yield record
+
+
+def _iter_efetch_runs(chunks):
+    """Incrementally parse an efetch EXPERIMENT_PACKAGE_SET.
+
+    Records are yielded as soon as their EXPERIMENT_PACKAGE is complete,
+    and parsed packages are cleared so only one is held in memory.
+
+    Parameters
+    ----------
+    chunks: iterable
+            XML document in chunks of bytes
+
+    Returns
+    -------
+    records: generator
+             One flat detailed record (OrderedDict) per RUN
+    """
+    parser = Et.XMLPullParser(events=("start", "end"))
+    root = None
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        for event, element in parser.read_events():
+            if root is None:
+                root = element
+                if root.tag != "EXPERIMENT_PACKAGE_SET":
+                    raise ValueError(
+                        "Expected EXPERIMENT_PACKAGE_SET, got {}".format(root.tag)
+                    )
+            elif event == "end" and element.tag == "EXPERIMENT_PACKAGE":
+                for record in _experiment_package_runs(element):
+                    yield record
+                root.clear()
+
+
 class SRAweb(SRAdb):
-    def __init__(self, api_key=None):
+    def __init__(
+        self,
+        api_key=None,
+        transport=None,
+        rate_limit_file=None,
+        max_workers=None,
+        retmax=None,
+        adaptive_retmax=True,
+        cache=None,
+        memoize=True,
+        typed_columns=False,
+    ):
         """
         Initialize a SRAwebdb.
 
@@ -69,7 +585,74 @@ class SRAweb(SRAdb):
 
         api_key: string
                  API key for ncbi eutils.
+        transport: HTTPTransport
+                   Pooled HTTP transport to use for all requests.
+                   A new one is created if not supplied. If it already
+                   has a rate limiter for E-utilities, that limiter is
+                   used and `api_key`/`rate_limit_file` do not change it.
+        rate_limit_file: string
+                         Path to a lock file used to share the E-utilities
+                         rate limit (3 or 10 requests/second) across
+                         processes using the same API key.
+        max_workers: int
+                     Number of result pages fetched concurrently.
+                     Defaults to the number of requests per second
+                     allowed by the rate limit.
+        retmax: int or dict
+                Page size for esummary/efetch requests. Either a single
+                value for both, or a dict with "esummary" and "efetch" keys.
+                Available as `self.retmax` for tuning.
+        adaptive_retmax: bool
+                         Adapt the page size to the number of records and
+                         to the measured size and latency of pages fetched
+                         by previous calls, up to the E-utilities maximum.
+                         Pages whose response times out are split in half
+                         and retried.
+        cache: ResponseCache
+               Persistent response cache (opt-in). esummary, efetch and
+               ENA lookups are answered from it when possible.
+        memoize: bool
+                 Record accession relationships learned from every response
+                 in `self.graph` and answer later conversions within the
+                 session from memory when possible.
+        typed_columns: bool
+                       Return the library and instrument fields of
+                       `sra_metadata` as categoricals and the spot, base and
+                       size counts as nullable Int64, which takes less memory
+                       for large studies. Off by default: these columns
+                       merge, compare and take `.str` accessors differently
+                       from the plain object columns returned otherwise.
         """
+        # All E-utilities calls go through this token bucket. A transport
+        # shared with other clients keeps the limiter it already has.
+        self.rate_limiter = None
+        if transport is not None:
+            self.rate_limiter = transport.get_rate_limiter(EUTILS_HOST)
+        if self.rate_limiter is None:
+            self.rate_limiter = eutils_rate_limiter(api_key, lock_file=rate_limit_file)
+        if max_workers is None:
+            max_workers = int(self.rate_limiter.rate)
+        self.max_workers = max_workers
+        if transport is None:
+            # chunks of a lookup are fetched concurrently, and so are their pages
+            transport = HTTPTransport(
+                pool_maxsize=max(DEFAULT_POOL_MAXSIZE, max_workers**2)
+            )
+        self.transport = transport
+        if self.transport.get_rate_limiter(EUTILS_HOST) is None:
+            self.transport.set_rate_limiter(EUTILS_HOST, self.rate_limiter)
+        self.retmax = dict(DEFAULT_RETMAX)
+        if isinstance(retmax, dict):
+            self.retmax.update(retmax)
+        elif retmax is not None:
+            self.retmax = {endpoint: int(retmax) for endpoint in self.retmax}
+        self.adaptive_retmax = adaptive_retmax
+        self.cache = cache
+        self.valid_in_type = dict(VALID_IN_TYPE)
+        self.graph = AccessionGraph() if memoize else None
+        self.typed_columns = typed_columns
+        self._retmax_lock = threading.Lock()
+        self._retmax_ceiling = {}
         self.base_url = dict()
         self.base_url["esummary"] = (
             "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
@@ -83,6 +666,14 @@ class SRAweb(SRAdb):
 
         self.ena_fastq_search_url = "https://www.ebi.ac.uk/ena/portal/api/filereport"
         self.ena_params = [("result", "read_run"), ("fields", "fastq_ftp")]
+        self.ena_search_url = "https://www.ebi.ac.uk/ena/portal/api/search"
+        self.ena_search_params = [
+            ("result", "read_run"),
+            ("includeAccessionType", "run"),
+            ("fields", ",".join(ENA_SEARCH_FIELDS)),
+            ("format", "tsv"),
+            ("limit", "0"),
+        ]
 
         self.esearch_params = {}
         self.esearch_params["sra"] = [
@@ -105,9 +696,7 @@ class SRAweb(SRAdb):
             self.esearch_params["sra"].append(("api_key", str(api_key)))
             self.esearch_params["geo"].append(("api_key", str(api_key)))
             self.efetch_params.append(("api_key", str(api_key)))
-            self.sleep_time = 1 / 10
-        else:
-            self.sleep_time = 1 / 3
+        self.sleep_time = self.rate_limiter.interval
 
     @staticmethod
     def format_xml(string):
@@ -148,6 +737,34 @@ class SRAweb(SRAdb):
             raise RuntimeError("Unable to parse xml: {}".format(xml))
         return json
 
+    def _cached(self, endpoint, params, fetch):
+        """Answer a lookup from the response cache, if one is configured.
+
+        Parameters
+        ----------
+        endpoint: string
+                  Name of the endpoint ("esummary", "efetch", "ena_filereport")
+        params: dict
+                Parameters identifying the lookup
+        fetch: callable
+               Called without arguments to fetch the response on a miss
+
+        Returns
+        -------
+        response: object
+        """
+        if self.cache is None:
+            return fetch()
+        return self.cache.get_or_fetch(endpoint, params, fetch)
+
+    def _fetch_ena_filereport(self, srp):
+        payload = self.ena_params.copy()
+        payload += [("accession", srp)]
+        request = self.transport.get(
+            self.ena_fastq_search_url, params=OrderedDict(payload)
+        )
+        return request.text.strip()
+
     def fetch_ena_fastq(self, srp):
         """Fetch FASTQ records from ENA (EXPERIMENTAL)
 
@@ -161,10 +778,11 @@ class SRAweb(SRAdb):
         srr_url: list
                  List of SRR fastq urls
         """
-        payload = self.ena_params.copy()
-        payload += [("accession", srp)]
-        request = requests.get(self.ena_fastq_search_url, params=OrderedDict(payload))
-        request_text = request.text.strip()
+        request_text = self._cached(
+            "ena_filereport",
+            {"accession": srp},
+            partial(self._fetch_ena_filereport, srp),
+        )
         urls = []
         for line in request_text.split("\n"):
             if "fastq_ftp" in line:
@@ -233,16 +851,92 @@ class SRAweb(SRAdb):
                 urls, columns=["run_accession", "ena_fastq_http", "ena_fastq_ftp"]
             ).sort_values(by="run_accession")
 
-    def create_esummary_params(self, esearchresult, db="sra"):
+    def _fetch_ena_search(self, run_accessions):
+        payload = self.ena_search_params.copy()
+        payload += [("includeAccessions", ",".join(run_accessions))]
+        for index in range(ENA_MAX_RETRIES + 1):
+            request = self.transport.post(
+                self.ena_search_url, data=OrderedDict(payload), stream=True
+            )
+            if request.status_code != 429 and request.status_code < 500:
+                break
+            if index < ENA_MAX_RETRIES:
+                request.close()
+                retry_after = request.headers.get("Retry-After")
+                if retry_after is not None and retry_after.isdigit():
+                    time.sleep(int(retry_after))
+                else:
+                    time.sleep(min(2**index, 10))
+        # a failed chunk would silently lose the ENA columns of its runs
+        request.raise_for_status()
+        # stream the TSV straight into columns
+        columns = _Columns()
+        header = None
+        for line in request.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            fields = line.rstrip("\r").split("\t")
+            if header is None:
+                header = fields
+                continue
+            columns.append(OrderedDict(zip(header, fields)))
+        return columns.to_dict()
+
+    def _fetch_ena_search_chunk(self, run_accessions):
+        return self._cached(
+            "ena_search",
+            {"run_accession": run_accessions},
+            partial(self._fetch_ena_search, run_accessions),
+        )
+
+    def fetch_ena_fastq_runs(self, run_accessions):
+        """Fetch FASTQ records from ENA for many runs at once (EXPERIMENTAL)
+
+        Runs are packed into as few POST requests to the ENA portal
+        search API as possible, and the requests run concurrently.
+
+        Parameters
+        ----------
+        run_accessions: list
+                        Run accessions
+
+        Returns
+        -------
+        ena_df: DataFrame
+                run_accession and the ENA FASTQ columns. Runs with a single
+                FASTQ file fill ena_fastq_http/ena_fastq_ftp/ena_fastq_md5,
+                paired runs fill the _1 and _2 columns.
+        """
+        if isinstance(run_accessions, str):
+            run_accessions = [run_accessions]
+        run_accessions = list(
+            OrderedDict.fromkeys(x for x in run_accessions if isinstance(x, str))
+        )
+        columns = _Columns()
+        for page in self._map_chunks(
+            self._fetch_ena_search_chunk,
+            run_accessions,
+            ENA_CHUNK_SIZE,
+            max_term_length=ENA_MAX_REQUEST_LENGTH,
+        ):
+            if page:
+                columns.extend(page)
+        columns = columns.to_dict()
+        return pd.DataFrame(
+            _ena_fastq_columns(
+                columns.get("run_accession", []),
+                columns.get("fastq_ftp", []),
+                columns.get("fastq_md5"),
+            )
+        )
+
+    def create_esummary_params(self, esearchresult, db="sra", retmax=None):
         query_key = esearchresult["querykey"]
         webenv = esearchresult["webenv"]
         retstart = esearchresult["retstart"]
 
-        # TODO this should be adaptive to build
-        # upon using the 'count' result in esearch result,
-        # Currently only supports a max of 500 records.
-        # retmax = esearchresult["retmax"]
-        retmax = 500
+        if retmax is None:
+            retmax = self.retmax["esummary"]
 
         return [
             ("query_key", query_key),
@@ -251,14 +945,197 @@ class SRAweb(SRAdb):
             ("retmax", retmax),
         ]
 
+    def _plan_pages(self, endpoint, n_records):
+        """Split n_records into (retstart, retmax) pages.
+
+        Pages are planned from the current page size, so sizes learned
+        by `_update_retmax` apply from the next call on.
+
+        Parameters
+        ----------
+        endpoint: string
+                  "esummary" or "efetch"
+        n_records: int
+                   Total number of records (`count` from esearch)
+
+        Returns
+        -------
+        pages: list
+               List of (retstart, retmax) tuples
+        """
+        retmax = max(1, min(self.retmax[endpoint], MAX_RETMAX))
+        if self.adaptive_retmax and n_records > retmax:
+            # Spread records evenly instead of ending on a tiny page
+            n_pages = -(-n_records // retmax)
+            retmax = -(-n_records // n_pages)
+        return [
+            (retstart, min(retmax, n_records - retstart))
+            for retstart in get_retmax(n_records, retmax)
+        ]
+
+    def _update_retmax(self, endpoint, n_records, elapsed, n_bytes):
+        """Adapt the page size from a page's latency and response size.
+
+        Parameters
+        ----------
+        endpoint: string
+                  "esummary" or "efetch"
+        n_records: int
+                   Number of records requested in the page
+        elapsed: float
+                 Seconds it took to fetch the page, not counting the
+                 wait for the rate limiter
+        n_bytes: int
+                 Size of the response
+        """
+        if not self.adaptive_retmax or n_records <= 0:
+            return
+        per_record_seconds = max(elapsed, 1e-3) / n_records
+        per_record_bytes = max(n_bytes, 1) / n_records
+        ideal = min(
+            TARGET_PAGE_SECONDS / per_record_seconds,
+            TARGET_PAGE_BYTES / per_record_bytes,
+        )
+        with self._retmax_lock:
+            # Move half way towards the ideal size to smooth out noise,
+            # but never back up to a size that has timed out
+            retmax = (self.retmax[endpoint] + ideal) / 2
+            ceiling = self._retmax_ceiling.get(endpoint, MAX_RETMAX)
+            self.retmax[endpoint] = int(max(MIN_RETMAX, min(ceiling, retmax)))
+
+    def _shrink_retmax(self, endpoint, retmax):
+        """Halve the page size after a page timed out."""
+        with self._retmax_lock:
+            ceiling = max(MIN_RETMAX, retmax // 2)
+            self._retmax_ceiling[endpoint] = min(
+                ceiling, self._retmax_ceiling.get(endpoint, MAX_RETMAX)
+            )
+            self.retmax[endpoint] = min(self.retmax[endpoint], ceiling)
+
+    def _rate_limit_wait(self):
+        """Seconds this thread has waited on the transport's rate limiters."""
+        rate_limit_wait = getattr(self.transport, "rate_limit_wait", None)
+        return rate_limit_wait() if rate_limit_wait is not None else 0.0
+
+    def _fetch_page_adaptive(self, endpoint, fetch_page, page):
+        """Fetch a page, splitting it in half if reading it times out.
+
+        Parameters
+        ----------
+        endpoint: string
+                  "esummary" or "efetch"
+        fetch_page: callable
+                    Function taking (retstart, retmax) and returning
+                    a tuple of (page, response size in bytes)
+        page: tuple
+              (retstart, retmax)
+
+        Returns
+        -------
+        pages: list
+               One or more pages covering the requested records
+        """
+        retstart, retmax = page
+        waited = self._rate_limit_wait()
+        start = time.monotonic()
+        try:
+            result, n_bytes = fetch_page(retstart, retmax)
+        except requests.exceptions.ReadTimeout:
+            # only a slow answer says the page is too big, connection
+            # errors are raised as they are
+            if not self.adaptive_retmax or retmax <= MIN_RETMAX:
+                raise
+            self._shrink_retmax(endpoint, retmax)
+            half = retmax // 2
+            return self._fetch_page_adaptive(
+                endpoint, fetch_page, (retstart, half)
+            ) + self._fetch_page_adaptive(
+                endpoint, fetch_page, (retstart + half, retmax - half)
+            )
+        # time queued on the rate limiter says nothing about the page size
+        elapsed = time.monotonic() - start - (self._rate_limit_wait() - waited)
+        self._update_retmax(endpoint, retmax, elapsed, n_bytes)
+        return [result]
+
+    def _map_pages(self, endpoint, fetch_page, n_records):
+        """Fetch result pages concurrently.
+
+        Every page of a WebEnv/query_key history is independently
+        addressable by its retstart, so pages are requested in parallel
+        (the transport's rate limiter keeps the overall request rate
+        within the E-utilities quota).
+
+        Parameters
+        ----------
+        endpoint: string
+                  "esummary" or "efetch"
+        fetch_page: callable
+                    Function taking (retstart, retmax) and returning
+                    a tuple of (page, response size in bytes)
+        n_records: int
+                   Total number of records
+
+        Returns
+        -------
+        pages: list
+               Pages in retstart order
+        """
+        pages = self._plan_pages(endpoint, n_records)
+        fetch = partial(self._fetch_page_adaptive, endpoint, fetch_page)
+        if len(pages) <= 1 or self.max_workers <= 1:
+            results = [fetch(page) for page in pages]
+        else:
+            max_workers = min(self.max_workers, len(pages))
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers
+            ) as executor:
+                results = list(executor.map(fetch, pages))
+        return [result for split_pages in results for result in split_pages]
+
+    def _fetch_esummary_page(self, db, esearchresult, retstart, retmax):
+        payload = self.esearch_params[db].copy()
+        payload += self.create_esummary_params(esearchresult, retmax=retmax)
+        payload = OrderedDict(payload)
+        payload["retstart"] = retstart
+        request = self.transport.get(
+            self.base_url["esummary"], params=OrderedDict(payload)
+        )
+        try:
+            response = request.json()
+        except JSONDecodeError:
+            response = _retry_response(
+                self.base_url["esummary"],
+                payload,
+                "result",
+                transport=self.transport,
+            )
+
+        if "error" in response:
+            # API rate limite exceeded
+            response = _retry_response(
+                self.base_url["esummary"],
+                payload,
+                "result",
+                transport=self.transport,
+            )
+        return response["result"], len(request.content)
+
     def get_esummary_response(self, db, term, usehistory="y"):
         assert db in ["sra", "geo"]
+        return self._cached(
+            "esummary",
+            {"db": db, "term": term},
+            partial(self._fetch_esummary_response, db, term),
+        )
 
+    def _fetch_esummary_response(self, db, term):
         payload = self.esearch_params[db].copy()
         if isinstance(term, list):
             term = " OR ".join(term)
         payload += [("term", term)]
-        request = requests.post(self.base_url["esearch"], data=OrderedDict(payload))
+        request = self.transport.post(
+            self.base_url["esearch"], data=OrderedDict(payload)
+        )
         try:
             esearch_response = request.json()
         except JSONDecodeError:
@@ -269,7 +1146,9 @@ class SRAweb(SRAdb):
             )
             retry_after = request.headers.get("Retry-After", 1)
             time.sleep(int(retry_after))
-            request = requests.post(self.base_url["esearch"], data=OrderedDict(payload))
+            request = self.transport.post(
+                self.base_url["esearch"], data=OrderedDict(payload)
+            )
             try:
                 esearch_response = request.json()
             except JSONDecodeError:
@@ -288,49 +1167,140 @@ class SRAweb(SRAdb):
         if "error" in esearch_response:
             # API rate limite exceeded
             esearch_response = _retry_response(
-                self.base_url["esearch"], payload, "esearchresult"
+                self.base_url["esearch"],
+                payload,
+                "esearchresult",
+                transport=self.transport,
             )
 
         n_records = int(esearch_response["esearchresult"]["count"])
 
+        pages = self._map_pages(
+            "esummary",
+            partial(self._fetch_esummary_page, db, esearch_response["esearchresult"]),
+            n_records,
+        )
         results = {}
-        for retstart in get_retmax(n_records):
-            payload = self.esearch_params[db].copy()
-            payload += self.create_esummary_params(esearch_response["esearchresult"])
-            payload = OrderedDict(payload)
-            payload["retstart"] = retstart
-            request = requests.get(
-                self.base_url["esummary"], params=OrderedDict(payload)
-            )
-            try:
-                response = request.json()
-            except JSONDecodeError:
-                time.sleep(1)
-                response = _retry_response(self.base_url["esummary"], payload, "result")
-
-            if "error" in response:
-                # API rate limite exceeded
-                response = _retry_response(self.base_url["esummary"], payload, "result")
-            if retstart == 0:
-                results = response["result"]
-            else:
-                result = response["result"]
-                for key, value in result.items():
-                    if key in list(results.keys()):
-                        results[key] += value
-                    else:
-                        results[key] = value
+        for result in pages:
+            results = _merge_esummary_results(results, result)
         return results
 
+    def _open_efetch_stream(self, payload):
+        """Start a streamed efetch request and peek at its first chunk.
+
+        Returns
+        -------
+        request: requests.Response
+        chunks: iterator
+                Response body in chunks, or None if the body is JSON
+        request_json: dict
+                      Decoded body if E-utilities replied with JSON
+                      (for example a rate limit error), else None
+        """
+        request = self.transport.get(
+            self.base_url["efetch"], params=OrderedDict(payload), stream=True
+        )
+        chunks = request.iter_content(chunk_size=EFETCH_CHUNK_SIZE)
+        first = b""
+        for first in chunks:
+            if first.strip():
+                break
+        if first.lstrip().startswith(b"{"):
+            try:
+                return request, None, json.loads(first + b"".join(chunks))
+            except ValueError:
+                return request, None, {}
+        return request, itertools.chain([first], chunks), None
+
+    def _fetch_efetch_page(self, esearchresult, retstart, retmax):
+        """Fetch one page of efetch results as columns.
+
+        The XML is parsed while it downloads, but the records of the page
+        are collected and returned together once it is complete.
+
+        Returns
+        -------
+        columns: OrderedDict
+                 Column name to list of values, one row per run,
+                 or None if the request failed
+        n_bytes: int
+                 Size of the response
+        """
+        payload = self.efetch_params.copy()
+        payload += self.create_esummary_params(esearchresult, retmax=retmax)
+        payload = OrderedDict(payload)
+        payload["retstart"] = retstart
+        request, chunks, request_json = self._open_efetch_stream(payload)
+
+        if request_json is not None and "error" in request_json:
+            # Handle API-rate limit exceeding
+            retry_after = request.headers.get("Retry-After")
+            if retry_after is None:
+                if request_json["error"] == "error forwarding request":
+                    sys.stderr.write("Encountered error while making request.\n")
+                    sys.exit(1)
+                retry_after = 1
+            time.sleep(int(retry_after))
+            # try again
+            request, chunks, request_json = self._open_efetch_stream(payload)
+            if (
+                request_json is not None
+                and request_json.get("error") == "error forwarding request"
+            ):
+                sys.stderr.write("Encountered error while making request.\n")
+                return None, 0
+        if chunks is None:
+            sys.stderr.write(
+                "Unable to parse xml response. Received: {}{}".format(
+                    request_json, os.linesep
+                )
+            )
+            sys.exit(1)
+        n_bytes = [0]
+        try:
+            columns = _Columns()
+            for record in _iter_efetch_runs(_count_bytes(chunks, n_bytes)):
+                columns.append(record)
+        except (Et.ParseError, ValueError) as error:
+            sys.stderr.write("Unable to parse xml: {}{}".format(error, os.linesep))
+            sys.exit(1)
+        return columns.to_dict(), n_bytes[0]
+
     def get_efetch_response(self, db, term, usehistory="y"):
+        """Get the detailed efetch records of a term.
+
+        All pages are fetched (see `_fetch_efetch_page`) and their columns
+        are concatenated, so the whole result is held in memory.
+
+        Parameters
+        ----------
+        db: string
+            "sra" or "geo"
+        term: string or list
+              Accession(s) to look up
+
+        Returns
+        -------
+        columns: OrderedDict
+                 Column name to list of values, one row per run,
+                 or None if there are no results
+        """
         assert db in ["sra", "geo"]
+        return self._cached(
+            "efetch",
+            {"db": db, "term": term},
+            partial(self._fetch_efetch_response, db, term),
+        )
 
+    def _fetch_efetch_response(self, db, term):
         payload = self.esearch_params[db].copy()
         if isinstance(term, list):
             term = " OR ".join(term)
         payload += [("term", term)]
 
-        request = requests.get(self.base_url["esearch"], params=OrderedDict(payload))
+        request = self.transport.get(
+            self.base_url["esearch"], params=OrderedDict(payload)
+        )
         esearch_response = request.json()
         if "esummaryresult" in esearch_response:
             print("No result found")
@@ -338,74 +1308,25 @@ class SRAweb(SRAdb):
         if "error" in esearch_response:
             # API rate limite exceeded
             esearch_response = _retry_response(
-                self.base_url["esearch"], payload, "esearchresult"
+                self.base_url["esearch"],
+                payload,
+                "esearchresult",
+                transport=self.transport,
             )
 
         n_records = int(esearch_response["esearchresult"]["count"])
 
-        results = {}
-        for retstart in get_retmax(n_records):
-            payload = self.efetch_params.copy()
-            payload += self.create_esummary_params(esearch_response["esearchresult"])
-            payload = OrderedDict(payload)
-            payload["retstart"] = retstart
-            request = requests.get(self.base_url["efetch"], params=OrderedDict(payload))
-            request_text = request.text.strip()
-            try:
-                request_json = request.json()
-            except:
-                request_json = {}  # eval(request_text)
-
-            if "error" in request_json:
-                # print("Encountered: {}".format(request_json))
-                # print("Headers: {}".format(request.headers))
-                # Handle API-rate limit exceeding
-                try:
-                    retry_after = request.headers["Retry-After"]
-                except KeyError:
-                    if request_json["error"] == "error forwarding request":
-                        sys.stderr.write("Encountered error while making request.\n")
-                        sys.exit(1)
-                time.sleep(int(retry_after))
-                # try again
-                request = requests.get(
-                    self.base_url["efetch"], params=OrderedDict(payload)
-                )
-                request_text = request.text.strip()
-                try:
-                    request_json = request.json()
-                    if request_json["error"] == "error forwarding request":
-                        sys.stderr.write("Encountered error while making request.\n")
-                        return
-                except:
-                    request_json = {}  # eval(request_text)
-            try:
-                xml_response = xmltodict.parse(
-                    request_text, dict_constructor=OrderedDict
-                )
-
-                exp_response = xml_response.get("EXPERIMENT_PACKAGE_SET", {})
-                response = exp_response.get("EXPERIMENT_PACKAGE", {})
-            except ExpatError:
-                sys.stderr.write(
-                    "Unable to parse xml: {}{}".format(request_text, os.linesep)
-                )
-                sys.exit(1)
-            if not response:
-                sys.stderr.write(
-                    "Unable to parse xml response. Received: {}{}".format(
-                        xml_response, os.linesep
-                    )
-                )
-                sys.exit(1)
-            if retstart == 0:
-                results = response
-            else:
-                result = response
-                for value in result:
-                    results.append(value)
-            time.sleep(self.sleep_time)
-        return results
+        pages = self._map_pages(
+            "efetch",
+            partial(self._fetch_efetch_page, esearch_response["esearchresult"]),
+            n_records,
+        )
+        columns = _Columns()
+        for page in pages:
+            if page is None:
+                return
+            columns.extend(page)
+        return columns.to_dict()
 
     def sra_metadata(
         self,
@@ -416,310 +1337,108 @@ class SRAweb(SRAdb):
         output_read_lengths=False,
         **kwargs,
     ):
+        if not detailed and self.graph is not None:
+            sra_record = self.graph.sra_records(srp)
+            if sra_record is not None:
+                return _sra_records_to_df(sra_record, self.typed_columns)
+
         esummary_result = self.get_esummary_response("sra", srp)
         try:
             uids = esummary_result["uids"]
-        except KeyError:
+        except (KeyError, TypeError):
             print("No results found for {}".format(srp))
             return None
 
-        exps_xml = OrderedDict()
-        runs_xml = OrderedDict()
-
-        exps_json = OrderedDict()
-        runs_json = OrderedDict()
-        for uid in uids:
-            exps_xml[uid] = self.format_xml(esummary_result[uid]["expxml"])
-            runs_xml[uid] = self.format_xml(esummary_result[uid]["runs"])
-
-        for uid in uids:
-            exps_json[uid] = self.xml_to_json(exps_xml[uid])
-            runs_json[uid] = self.xml_to_json(runs_xml[uid])
-
-        sra_record = []
-        for uid, run_json in runs_json.items():
-            exp_json = exps_json[uid]
-            exp_summary = exp_json["Summary"]
-            exp_title = exp_summary.get("Title", pd.NA)
-            exp_platform = exp_summary.get("Platform", {})
-            statistics = exp_summary.get("Statistics", {})
-            if isinstance(exp_platform, OrderedDict):
-                exp_platform_model = exp_platform.get("@instrument_model", pd.NA)
-                exp_platform_desc = exp_platform.get("#text", pd.NA)
-            else:
-                exp_platform_model = pd.NA
-                exp_platform_desc = pd.NA
-
-            exp_total_runs = statistics.get("@total_runs", pd.NA)
-            exp_total_spots = statistics.get("@total_spots", pd.NA)
-            exp_total_size = statistics.get("@total_size", pd.NA)
-
-            # experiment_accession
-            exp_ID = exp_json["Experiment"]["@acc"]
-            # experiment_title
-            exp_name = exp_json["Experiment"]["@name"]
-
-            exp_organism = exp_json.get("Organism", pd.NA)
-            exp_organism_name = pd.NA
-            exp_taxid = pd.NA
-            if isinstance(exp_organism, dict):
-                exp_organism_name = exp_organism.get("@ScientificName", pd.NA)
-                exp_taxid = exp_organism["@taxid"]
-
-            exp_instrument = list(exp_json["Instrument"].values())[0]
-
-            exp_sample = exp_json["Sample"]
-            # sample_accession
-            exp_sample_ID = exp_sample["@acc"]
-            # sample_title
-            exp_sample_name = exp_sample["@name"]
-
-            exp_library_descriptor = exp_json["Library_descriptor"]
-            # library_strategy
-            exp_library_strategy = exp_library_descriptor["LIBRARY_STRATEGY"]
-            if isinstance(exp_library_strategy, dict):
-                exp_library_strategy = exp_library_strategy["#text"]
-            # library_source
-            exp_library_source = exp_library_descriptor["LIBRARY_SOURCE"]
-            if isinstance(exp_library_source, dict):
-                exp_library_source = exp_library_source["#text"]
-            # library_selection
-            exp_library_selection = exp_library_descriptor["LIBRARY_SELECTION"]
-            if isinstance(exp_library_selection, dict):
-                exp_library_selection = exp_library_selection["#text"]
-            # library_name
-            exp_library_name = exp_library_descriptor.get("LIBRARY_NAME", "")
-            if isinstance(exp_library_selection, dict):
-                exp_library_name = exp_library_name["#text"]
-            # library_layout
-            exp_library_layout = list(exp_library_descriptor["LIBRARY_LAYOUT"].keys())[
-                0
-            ]
-            # biosample
-            exp_biosample = exp_json.get("Biosample", pd.NA)
-            # bioproject
-            exp_bioproject = exp_json.get("Bioproject", pd.NA)
-
-            experiment_record = OrderedDict()
-            experiment_record["study_accession"] = exp_json["Study"]["@acc"]
-            experiment_record["study_title"] = exp_json["Study"]["@name"]
-            experiment_record["experiment_accession"] = exp_ID
-            experiment_record["experiment_title"] = exp_name
-            experiment_record["experiment_desc"] = exp_title
-
-            experiment_record["organism_taxid"] = exp_taxid
-            experiment_record["organism_name"] = exp_organism_name
-
-            experiment_record["library_name"] = exp_library_name
-            experiment_record["library_strategy"] = exp_library_strategy
-            experiment_record["library_source"] = exp_library_source
-            experiment_record["library_selection"] = exp_library_selection
-            experiment_record["library_layout"] = exp_library_layout
-            experiment_record["sample_accession"] = exp_sample_ID
-            experiment_record["sample_title"] = exp_sample_name
-            experiment_record["biosample"] = exp_biosample
-            experiment_record["bioproject"] = exp_bioproject
-            experiment_record["instrument"] = exp_instrument
-            experiment_record["instrument_model"] = exp_platform_model
-            experiment_record["instrument_model_desc"] = exp_platform_desc
-            experiment_record["total_spots"] = exp_total_spots
-            experiment_record["total_size"] = exp_total_size
-            if not run_json:
-                # Sometimes the run_accession is not populated by NCBI:
-                # df2 = self.srx_to_srr(exp_ID)
-                # extra_fields = set(experiment_record.keys()).difference(df2.columns.tolist())
-                # for idx, row in df2.iterrows():
-                #    for field in extra_fields:
-                #        experiment_record[field] = row[field]
-                sra_record.append(experiment_record)
-                continue
-            runs = run_json["Run"]
-            if not isinstance(runs, list):
-                runs = [runs]
-            for run_record in runs:
-                run_accession = run_record["@acc"]
-                run_total_spots = run_record["@total_spots"]
-                run_total_bases = run_record["@total_bases"]
-
-                experiment_record["run_accession"] = run_accession
-                experiment_record["run_total_spots"] = run_total_spots
-                experiment_record["run_total_bases"] = run_total_bases
-
-                sra_record.append(experiment_record.copy())
-
+        metadata_df = _sra_records_to_df(
+            _esummary_columns(esummary_result, uids), self.typed_columns
+        )
+        if self.graph is not None:
+            self.graph.add_sra_table(srp, metadata_df)
         # TODO: the detailed call below does redundant operations
         # the code above this can be completeley done away with
-        metadata_df = pd.DataFrame(sra_record).drop_duplicates()
-        if "run_accession" in metadata_df.columns:
-            metadata_df = metadata_df.sort_values(by="run_accession")
-        metadata_df.columns = [x.lower().strip() for x in metadata_df.columns]
         if not detailed:
             return metadata_df
 
-        time.sleep(self.sleep_time)
-        efetch_result = self.get_efetch_response("sra", srp)
-        if not isinstance(efetch_result, list):
-            if efetch_result:
-                efetch_result = [efetch_result]
-            else:
-                return None
-
-        detailed_records = []
-        for record in efetch_result:
-            if "SAMPLE" in record.keys() and "SAMPLE_ATTRIBUTES" in record["SAMPLE"]:
-                sample_attributes = record["SAMPLE"]["SAMPLE_ATTRIBUTES"][
-                    "SAMPLE_ATTRIBUTE"
-                ]
-            else:
-                sample_attributes = []
-            if isinstance(sample_attributes, OrderedDict):
-                sample_attributes = [sample_attributes]
-            exp_record = record["EXPERIMENT"]
-            exp_attributes = exp_record.get("EXPERIMENT_ATTRIBUTES", {})
-            run_sets = record["RUN_SET"].get("RUN", [])
-
-            if not isinstance(run_sets, list):
-                run_sets = [run_sets]
-
-            for run_set in run_sets:
-                detailed_record = OrderedDict()
-                if not run_json:
-                    # Add experiment accession if no run info found earlier
-                    detailed_record["experiment_accession"] = exp_record["@accession"]
-                # detailed_record["experiment_title"] = exp_record["TITLE"]
-                for key, values in exp_attributes.items():
-                    key = key.lower()
-                    for value_x in values:
-                        if not isinstance(value_x, dict):
-                            continue
-                        tag = value_x["TAG"].lower()
-                        value = value_x["VALUE"] if "VALUE" in value_x else None
-                        detailed_record[tag] = value
-                lib_record = exp_record["DESIGN"]["LIBRARY_DESCRIPTOR"]
-                for key, value in lib_record.items():
-                    key = key.lower()
-                    if key == "library_layout":
-                        value = list(value.keys())[0]
-                    elif key == "library_construction_protocol":
-                        continue
-                    # detailed_record[key] = value
-
-                detailed_record["run_accession"] = run_set["@accession"]
-                detailed_record["run_alias"] = run_set["@alias"]
-                sra_files = run_set.get("SRAFiles", {})
-                sra_files = sra_files.get("SRAFile", {})
-                if isinstance(sra_files, OrderedDict):
-                    # detailed_record["sra_url"] = sra_files.get("@url", pd.NA)
-                    if "Alternatives" in sra_files.keys():
-                        alternatives = sra_files["Alternatives"]
-                        if not isinstance(alternatives, list):
-                            alternatives = [alternatives]
-                        for alternative in alternatives:
-                            org = alternative["@org"].lower()
-                            for key in alternative.keys():
-                                if key == "@org":
-                                    continue
-                                detailed_record[
-                                    "{}_{}".format(org, key.replace("@", ""))
-                                ] = alternative[key]
-
-                else:
-                    for sra_file in sra_files:
-                        # Multiple download URLs
-                        # Use the one where the download filename corresponds to the SRR
-                        cluster = sra_file.get("@cluster", None).lower().strip()
-                        if cluster is None:
-                            continue
-                        for key in sra_file.keys():
-                            if key == "@cluster":
-                                continue
-                            if key == "Alternatives":
-                                # Example: SRP184142
-                                alternatives = sra_file["Alternatives"]
-                                if not isinstance(alternatives, list):
-                                    alternatives = [alternatives]
-                                for alternative in alternatives:
-                                    org = alternative["@org"].lower()
-                                    for key in alternative.keys():
-                                        if key == "@org":
-                                            continue
-                                        detailed_record[
-                                            "{}_{}".format(org, key.replace("@", ""))
-                                        ] = alternative[key]
-                            else:
-                                detailed_record[
-                                    "{}_{}".format(cluster, key.replace("@", ""))
-                                ] = sra_file[key]
-
-                expt_ref = run_set["EXPERIMENT_REF"]
-                detailed_record["experiment_alias"] = expt_ref.get("@refname", "")
-                # detailed_record["run_total_bases"] = run_set["@total_bases"]
-                # detailed_record["run_total_spots"] = run_set["@total_spots"]
-                for sample_attribute in sample_attributes:
-                    dict_values = list(sample_attribute.values())
-                    if len(dict_values) > 1:
-                        detailed_record[dict_values[0]] = dict_values[1]
-                    else:
-                        # TODO: Investigate why these fields have just the key
-                        # but no value
-                        pass
-                detailed_records.append(detailed_record)
-        detailed_record_df = pd.DataFrame(detailed_records).drop_duplicates()
+        # detailed fields by column, parsed incrementally from the efetch XML
+        detailed_columns = self.get_efetch_response("sra", srp)
+        if detailed_columns is None:
+            return None
+        detailed_record_df = pd.DataFrame(detailed_columns)
         if (
             "run_accession" in metadata_df.keys()
             and "run_accession" in detailed_record_df.keys()
         ):
             metadata_df = metadata_df.merge(
-                detailed_record_df, on="run_accession", how="outer"
+                detailed_record_df.drop(columns="experiment_accession"),
+                on="run_accession",
+                how="outer",
             )
         elif "experiment_accession" in detailed_record_df.keys():
             metadata_df = metadata_df.merge(
                 detailed_record_df, on="experiment_accession", how="outer"
             )
+        metadata_df = metadata_df[metadata_df.columns.dropna()].drop_duplicates()
 
-        metadata_df = metadata_df[metadata_df.columns.dropna()]
-        metadata_df = metadata_df.drop_duplicates()
-        metadata_df = metadata_df.replace(r"^\s*$", pd.NA, regex=True)
-        ena_cols = [
-            "ena_fastq_http",
-            "ena_fastq_http_1",
-            "ena_fastq_http_2",
-            "ena_fastq_ftp",
-            "ena_fastq_ftp_1",
-            "ena_fastq_ftp_2",
-        ]
-        empty_df = pd.DataFrame(columns=ena_cols)
-        metadata_df = pd.concat((metadata_df, empty_df), axis=0)
-
+        metadata_df = metadata_df.drop(columns=ENA_COLUMNS, errors="ignore")
         if "run_accession" in metadata_df.columns:
-            metadata_df = metadata_df.set_index("run_accession")
-        # multithreading lookup on ENA, since a lot of time is spent waiting
-        # for its reply
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            # load our function calls into a list of futures
-            futures = [
-                executor.submit(self.fetch_ena_fastq, srp)
-                for srp in metadata_df.study_accession.unique()
+            # bulk lookup on ENA, many runs per request
+            ena_df = self.fetch_ena_fastq_runs(
+                metadata_df.run_accession.dropna().unique().tolist()
+            )
+            metadata_df = metadata_df.merge(
+                ena_df.drop_duplicates("run_accession"), on="run_accession", how="left"
+            )
+            metadata_df = metadata_df[
+                ["run_accession"]
+                + [x for x in metadata_df.columns if x != "run_accession"]
             ]
-            # now proceed synchronously
-            for future in concurrent.futures.as_completed(futures):
-                ena_results = future.result()
-                if ena_results.shape[0]:
-                    ena_results = ena_results.set_index("run_accession")
-                    metadata_df.update(ena_results)
-        metadata_df = metadata_df.reset_index()
+        else:
+            metadata_df = metadata_df.reindex(
+                columns=metadata_df.columns.tolist() + ENA_COLUMNS
+            )
         metadata_df = metadata_df.fillna(pd.NA)
         metadata_df.columns = [x.lower().strip() for x in metadata_df.columns]
         if "run_accession" in metadata_df.columns:
             return metadata_df.sort_values(by="run_accession")
         return metadata_df
 
+    def _graph_pairs(self, accessions, target_type):
+        """Look up related accessions of `target_type` in the accession graph.
+
+        Parameters
+        ----------
+        accessions: list
+                    Accessions to convert
+        target_type: string
+                     Type of the related accessions (see `accession_type`)
+
+        Returns
+        -------
+        pairs: list
+               List of (accession, related accession) tuples, or None if
+               any of the accessions has no known relation of that type
+        """
+        if self.graph is None:
+            return None
+        pairs = []
+        for accession in accessions:
+            related = self.graph.neighbors(accession, target_type)
+            if not related:
+                return None
+            pairs += [(accession, x) for x in related]
+        return list(OrderedDict.fromkeys(pairs))
+
     def fetch_gds_results(self, gse, **kwargs):
+        if self.graph is not None:
+            gse_records = self.graph.gds_records(gse)
+            if gse_records is not None:
+                return pd.DataFrame(gse_records)
+
         result = self.get_esummary_response("geo", gse)
 
         try:
             uids = result["uids"]
-        except KeyError:
+        except (KeyError, TypeError):
             print("No results found for {} | Obtained result: {}".format(gse, result))
             return None
         gse_records = []
@@ -741,6 +1460,8 @@ class SRAweb(SRAdb):
         if not len(gse_records):
             print("No results found for {}".format(gse))
             return None
+        if self.graph is not None:
+            self.graph.add_gds_records(gse, gse_records)
         return pd.DataFrame(gse_records)
 
     def gse_to_gsm(self, gse, **kwargs):
@@ -837,7 +1558,6 @@ class SRAweb(SRAdb):
             columns={"SRA": "experiment_accession", "accession": "experiment_alias"}
         )
         srx = gsm_df.experiment_accession.tolist()
-        time.sleep(self.sleep_time)
         srs_df = self.srx_to_srs(srx)
         gsm_df = srs_df.merge(gsm_df, on="experiment_accession")[
             ["experiment_alias", "sample_accession"]
@@ -848,6 +1568,11 @@ class SRAweb(SRAdb):
         """Get SRX for a GSM"""
         if isinstance(gsm, str):
             gsm = [gsm]
+        pairs = self._graph_pairs(gsm, "experiment")
+        if pairs is not None:
+            return pd.DataFrame(
+                pairs, columns=["experiment_alias", "experiment_accession"]
+            )
         gsm_df = self.fetch_gds_results(gsm, **kwargs)
         gsm_df = gsm_df[gsm_df.entrytype == "GSM"].rename(
             columns={"SRA": "experiment_accession", "accession": "experiment_alias"}
@@ -955,7 +1680,6 @@ class SRAweb(SRAdb):
         if isinstance(srs, str):
             srs = [srs]
         srx_df = self.srs_to_srx(srs)
-        time.sleep(self.sleep_time)
         gsm_df = self.srx_to_gsm(srx_df.experiment_accession.tolist(), **kwargs)
         srs_df = srx_df.merge(gsm_df, on="experiment_accession")
         srs_df = srs_df.loc[srs_df["sample_accession"].isin(srs)]
@@ -964,6 +1688,11 @@ class SRAweb(SRAdb):
     def srx_to_gsm(self, srx, **kwargs):
         if isinstance(srx, str):
             srx = [srx]
+        pairs = self._graph_pairs(srx, "gsm")
+        if pairs is not None:
+            return pd.DataFrame(
+                pairs, columns=["experiment_accession", "experiment_alias"]
+            )
         gsm_df = self.fetch_gds_results(srx, **kwargs)
         gsm_df = gsm_df[gsm_df.entrytype == "GSM"].rename(
             columns={"SRA": "experiment_accession", "accession": "experiment_alias"}
@@ -991,6 +1720,141 @@ class SRAweb(SRAdb):
         srx_df = self.sra_metadata(srx, **kwargs)
         return _order_first(srx_df, ["experiment_accession", "sample_accession"])
 
+    def resolve_many(self, accessions, chunk_size=RESOLVE_CHUNK_SIZE):
+        """Resolve a large, mixed list of accessions in batched lookups.
+
+        Inputs are grouped by type, each group is split into chunks that
+        fit in a single E-utilities term and the chunks are looked up
+        concurrently. GSE/GSM accessions are first mapped to their SRP/SRX
+        and then resolved together with the SRA accessions.
+
+        Parameters
+        ----------
+        accessions: list
+                    SRP/SRX/SRS/SRR (or ERP/DRP, ...) and GSE/GSM accessions
+        chunk_size: int
+                    Maximum number of accessions per lookup
+
+        Returns
+        -------
+        resolved_df: DataFrame
+                     One row per input accession and run with the study,
+                     experiment, sample and run accessions and, where known,
+                     the GEO series (study_alias) and sample (experiment_alias).
+                     Accessions that could not be resolved are kept with
+                     empty columns.
+        """
+        if isinstance(accessions, str):
+            accessions = [accessions]
+        accessions = list(
+            OrderedDict.fromkeys(str(accession).strip() for accession in accessions)
+        )
+        groups = OrderedDict()
+        for accession in accessions:
+            in_type = accession_type(accession)
+            if in_type is None or in_type == "submission":
+                raise ValueError(
+                    "{} not a valid input type".format(re.sub("\\d+$", "", accession))
+                )
+            groups.setdefault(in_type, []).append(accession)
+
+        # GEO accessions: map GSM -> SRX and GSE -> SRP
+        geo_inputs = groups.pop("gsm", []) + groups.pop("gse", [])
+        gds_records = []
+        for records in self._map_chunks(
+            self._fetch_gds_records, geo_inputs, chunk_size
+        ):
+            gds_records += records
+        gsm_to_srx = OrderedDict()
+        gse_to_srp = OrderedDict()
+        for record in gds_records:
+            srx_or_srp = record.get("SRA")
+            if (
+                record.get("entrytype") == "GSM"
+                and accession_type(srx_or_srp) == "experiment"
+            ):
+                gsm_to_srx[record["accession"]] = srx_or_srp
+            elif (
+                record.get("entrytype") == "GSE"
+                and accession_type(srx_or_srp) == "study"
+            ):
+                gse_to_srp[record["accession"]] = srx_or_srp
+
+        # SRA accessions, including the ones GEO inputs map to
+        sra_inputs = [x for values in groups.values() for x in values]
+        sra_inputs += [x for x in gsm_to_srx.values() if x not in sra_inputs]
+        sra_inputs += [x for x in gse_to_srp.values() if x not in sra_inputs]
+        summary_columns = RESOLVE_COLUMNS[1:5]
+        summary_dfs = [
+            df[[x for x in summary_columns if x in df.columns]]
+            for df in self._map_chunks(self.sra_metadata, sra_inputs, chunk_size)
+            if df is not None
+        ]
+        summary_df = pd.concat(
+            [pd.DataFrame(columns=summary_columns)] + summary_dfs
+        ).drop_duplicates()
+
+        resolved_dfs = []
+        for in_type, values in groups.items():
+            column = "{}_accession".format(in_type)
+            inputs = pd.DataFrame({"accession": values, column: values})
+            resolved_dfs.append(inputs.merge(summary_df, on=column, how="left"))
+        for mapping, column in [
+            (gsm_to_srx, "experiment_accession"),
+            (gse_to_srp, "study_accession"),
+        ]:
+            values = [x for x in geo_inputs if x in mapping]
+            inputs = pd.DataFrame(
+                {"accession": values, column: [mapping[x] for x in values]}
+            )
+            resolved_dfs.append(inputs.merge(summary_df, on=column, how="left"))
+        unresolved = [
+            x for x in geo_inputs if x not in gsm_to_srx and x not in gse_to_srp
+        ]
+        resolved_dfs.append(pd.DataFrame({"accession": unresolved}))
+        resolved_df = pd.concat(resolved_dfs, ignore_index=True).reindex(
+            columns=RESOLVE_COLUMNS
+        )
+
+        srx_to_gsm = {srx: gsm for gsm, srx in gsm_to_srx.items()}
+        srp_to_gse = {srp: gse for gse, srp in gse_to_srp.items()}
+        resolved_df["experiment_alias"] = resolved_df["experiment_accession"].map(
+            srx_to_gsm
+        )
+        resolved_df["study_alias"] = resolved_df["study_accession"].map(srp_to_gse)
+
+        # keep the input order
+        order = {accession: index for index, accession in enumerate(accessions)}
+        resolved_df["_order"] = resolved_df["accession"].map(order)
+        resolved_df = resolved_df.sort_values(
+            by=["_order", "run_accession"], kind="stable"
+        ).drop(columns="_order")
+        return resolved_df.drop_duplicates().reset_index(drop=True).fillna(pd.NA)
+
+    def _fetch_gds_records(self, accessions):
+        gds_df = self.fetch_gds_results(accessions)
+        if gds_df is None:
+            return []
+        return gds_df.to_dict("records")
+
+    def _map_chunks(
+        self,
+        fetch,
+        accessions,
+        chunk_size,
+        max_term_length=RESOLVE_MAX_TERM_LENGTH,
+    ):
+        """Call `fetch` concurrently on chunks of `accessions`, in order."""
+        chunks = _chunk_accessions(
+            accessions, chunk_size=chunk_size, max_term_length=max_term_length
+        )
+        if len(chunks) <= 1:
+            return [fetch(chunk) for chunk in chunks]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(chunks))
+        ) as executor:
+            return list(executor.map(fetch, chunks))
+
     def search(self, *args, **kwargs):
         raise NotImplementedError("Search not yet implemented for Web")
 
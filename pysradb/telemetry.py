@@ -0,0 +1,262 @@
+"""Throughput and latency metrics of downloads"""
+
+import json
+import os
+import threading
+import time
+
+from .scheduler import url_host
+
+
+class TransferMeter(object):
+    def __init__(self, rate_limiter=None):
+        """Measure one download attempt.
+
+        The meter takes the place of the bandwidth limiter of a download:
+        every chunk received is counted through `acquire` (or `reserve`)
+        and then handed on to `rate_limiter`, if any.
+
+        Parameters
+        ----------
+        rate_limiter: RateLimiter
+                      Bandwidth limit to apply to the chunks (optional)
+        """
+        self.rate_limiter = rate_limiter
+        self.started = time.monotonic()
+        self.first_byte = None
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def _count(self, tokens):
+        with self._lock:
+            if self.first_byte is None:
+                self.first_byte = time.monotonic()
+            self.bytes += tokens
+
+    def reserve(self, tokens=1):
+        self._count(tokens)
+        if self.rate_limiter is None:
+            return 0
+        return self.rate_limiter.reserve(tokens)
+
+    def acquire(self, tokens=1):
+        self._count(tokens)
+        if self.rate_limiter is None:
+            return 0
+        return self.rate_limiter.acquire(tokens)
+
+    @property
+    def ttfb(self):
+        """Seconds from the start of the attempt to the first byte, or None."""
+        if self.first_byte is None:
+            return None
+        return self.first_byte - self.started
+
+
+class DownloadTelemetry(object):
+    def __init__(self, observers=None, jsonl_path=None, prometheus_path=None):
+        """Collect metrics of downloads per file and per host.
+
+        Every download attempt produces an event dict with url, host,
+        file_path, attempt, retries, bytes, duration, ttfb (seconds to
+        the first byte, including the HEAD request), throughput (bytes per
+        second), status ("done" or "failed") and error. Events are passed
+        to the observers and optionally appended to a JSON lines file.
+        Totals per host are available from `host_stats` and can be written
+        as a Prometheus text file (for the node_exporter textfile
+        collector), to compare mirrors and tune concurrency.
+
+        Parameters
+        ----------
+        observers: list
+                   Callables called as observer(event) after every attempt
+        jsonl_path: string
+                    Append events to this file, one JSON object per line
+        prometheus_path: string
+                         Write the host totals to this file on `close`
+        """
+        self.observers = list(observers or [])
+        self.prometheus_path = prometheus_path
+        self._jsonl = open(jsonl_path, "a") if jsonl_path is not None else None
+        self._attempts = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def add_observer(self, observer):
+        """Register a callable called as observer(event) after every attempt."""
+        self.observers.append(observer)
+
+    def meter(self, rate_limiter=None):
+        """Start measuring a download attempt.
+
+        Returns
+        -------
+        meter: TransferMeter
+        """
+        return TransferMeter(rate_limiter)
+
+    def record(self, url, file_path, meter, error=None):
+        """Record the outcome of a download attempt.
+
+        Parameters
+        ----------
+        url: string
+             Download URL
+        file_path: string
+                   Local file path
+        meter: TransferMeter
+               Meter of the attempt
+        error: Exception
+               Error raised by the attempt, if any. Attempts that did not
+               raise but left no file at `file_path` are failed as well.
+
+        Returns
+        -------
+        event: dict
+        """
+        duration = time.monotonic() - meter.started
+        done = error is None and os.path.exists(file_path)
+        if error is None and not done:
+            error = "incomplete download"
+        host = url_host(url)
+        with self._lock:
+            attempt = self._attempts.get(file_path, 0) + 1
+            self._attempts[file_path] = attempt
+            stats = self._hosts.setdefault(
+                host,
+                {
+                    "files": 0,
+                    "failures": 0,
+                    "retries": 0,
+                    "bytes": 0,
+                    "duration": 0.0,
+                    "ttfb": 0.0,
+                    "ttfb_count": 0,
+                },
+            )
+            stats["files"] += done
+            stats["failures"] += not done
+            stats["retries"] += attempt > 1
+            stats["bytes"] += meter.bytes
+            stats["duration"] += duration
+            if meter.ttfb is not None:
+                stats["ttfb"] += meter.ttfb
+                stats["ttfb_count"] += 1
+        event = {
+            "time": time.time(),
+            "url": url,
+            "host": host,
+            "file_path": file_path,
+            "attempt": attempt,
+            "retries": attempt - 1,
+            "bytes": meter.bytes,
+            "duration": duration,
+            "ttfb": meter.ttfb,
+            "throughput": meter.bytes / duration if duration > 0 else None,
+            "status": "done" if done else "failed",
+            "error": None if error is None else str(error),
+        }
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(event) + "\n")
+                self._jsonl.flush()
+        for observer in self.observers:
+            observer(event)
+        return event
+
+    def host_stats(self):
+        """Get the totals per host.
+
+        Returns
+        -------
+        stats: dict
+               For every host: files (completed), failures (failed
+               attempts), retries, bytes, duration (summed over attempts),
+               throughput (bytes per second of transfer) and ttfb (mean)
+        """
+        with self._lock:
+            hosts = {host: dict(stats) for host, stats in self._hosts.items()}
+        for stats in hosts.values():
+            ttfb_count = stats.pop("ttfb_count")
+            stats["ttfb"] = stats["ttfb"] / ttfb_count if ttfb_count else None
+            stats["throughput"] = (
+                stats["bytes"] / stats["duration"] if stats["duration"] > 0 else None
+            )
+        return hosts
+
+    def prometheus(self):
+        """Format the host totals in the Prometheus text format.
+
+        Returns
+        -------
+        text: string
+        """
+        metrics = [
+            ("files", "pysradb_download_files_total", "counter", "Files downloaded"),
+            (
+                "failures",
+                "pysradb_download_failures_total",
+                "counter",
+                "Failed download attempts",
+            ),
+            ("retries", "pysradb_download_retries_total", "counter", "Retries"),
+            ("bytes", "pysradb_download_bytes_total", "counter", "Bytes received"),
+            (
+                "duration",
+                "pysradb_download_seconds_total",
+                "counter",
+                "Seconds spent downloading",
+            ),
+            (
+                "throughput",
+                "pysradb_download_throughput_bytes_per_second",
+                "gauge",
+                "Bytes per second of transfer",
+            ),
+            (
+                "ttfb",
+                "pysradb_download_ttfb_seconds",
+                "gauge",
+                "Mean seconds to the first byte",
+            ),
+        ]
+        hosts = self.host_stats()
+        lines = []
+        for key, name, metric_type, description in metrics:
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for host, stats in sorted(hosts.items(), key=lambda x: str(x[0])):
+                if stats[key] is not None:
+                    lines.append('{}{{host="{}"}} {}'.format(name, host, stats[key]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        """Write the host totals to a Prometheus text file.
+
+        The file is replaced atomically, so a collector never reads it
+        half written.
+
+        Parameters
+        ----------
+        path: string
+              Output file (default: `prometheus_path`)
+        """
+        path = path or self.prometheus_path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """Write the Prometheus file, if any, and close the JSON lines file."""
+        if self.prometheus_path is not None:
+            self.write_prometheus()
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
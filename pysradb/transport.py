@@ -0,0 +1,383 @@
+"""Pooled HTTP and FTP connections shared by the web facing classes"""
+
+import threading
+import time
+from collections import defaultdict
+from ftplib import FTP
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from .ratelimit import EUTILS_RATE_API_KEY
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_POOL_CONNECTIONS = 10
+# SRAweb runs up to one worker per request per second allowed with an API
+# key, and each worker of a chunked lookup fetches pages with as many again
+DEFAULT_POOL_MAXSIZE = EUTILS_RATE_API_KEY**2
+DEFAULT_MAX_RETRIES = 3
+# Throttled and server-side responses that are retried
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Idle FTP connections kept per host
+DEFAULT_FTP_POOL_MAXSIZE = 8
+# Seconds an FTP connection may stay idle before it is closed
+DEFAULT_FTP_MAX_IDLE = 60
+# Idle FTP connections older than this (seconds) are checked with NOOP
+DEFAULT_FTP_CHECK_AFTER = 5
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+_default_ftp_pool = None
+_default_ftp_pool_lock = threading.Lock()
+
+
+class HTTPTransport(object):
+    def __init__(
+        self,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff_factor=0.5,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        """Initialize HTTPTransport.
+
+        A single `requests.Session` is kept for the lifetime of the
+        transport so that TCP/TLS connections to the same host are
+        reused (keep-alive) instead of being set up for every request.
+
+        Parameters
+        ----------
+        pool_connections: int
+                          Number of per-host connection pools to cache
+        pool_maxsize: int
+                      Maximum number of connections kept alive per host.
+                      Should be at least the number of threads issuing
+                      requests through this transport.
+        max_retries: int
+                     Number of retries for connection errors,
+                     throttled (429) and server-side (5xx) responses.
+                     Responses from hosts with a rate limiter are retried
+                     by `request`, each retry taking a token.
+        backoff_factor: float
+                        Backoff factor between retries
+        timeout: int or tuple
+                 Default timeout (in seconds) for every request
+        """
+        self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiters = {}
+        # seconds each thread has spent waiting on rate limiters
+        self._waited = threading.local()
+        self.session = requests.Session()
+        # 429s are retried honoring the server's Retry-After header
+        adapter = self._adapter(RETRY_STATUSES)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _adapter(self, status_forcelist):
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=status_forcelist,
+        )
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+
+    def set_rate_limiter(self, host, rate_limiter):
+        """Throttle all requests to `host` through `rate_limiter`.
+
+        Parameters
+        ----------
+        host: string
+              Hostname, for example eutils.ncbi.nlm.nih.gov
+        rate_limiter: RateLimiter
+                      Limiter to acquire a token from before every request.
+                      Set to None to remove throttling for this host.
+        """
+        prefixes = ["http://{}/".format(host), "https://{}/".format(host)]
+        if rate_limiter is None:
+            self.rate_limiters.pop(host, None)
+            for prefix in prefixes:
+                adapter = self.session.adapters.pop(prefix, None)
+                if adapter is not None:
+                    adapter.close()
+            return
+        if host not in self.rate_limiters:
+            # urllib3 would resend throttled responses without a token,
+            # `request` retries them through the limiter instead
+            adapter = self._adapter([])
+            for prefix in prefixes:
+                self.session.mount(prefix, adapter)
+        self.rate_limiters[host] = rate_limiter
+
+    def get_rate_limiter(self, host):
+        """Get the rate limiter used for `host`, if any."""
+        return self.rate_limiters.get(host)
+
+    def rate_limit_wait(self):
+        """Get the seconds the calling thread has spent waiting on rate limiters.
+
+        Lets callers time a request without the wait for its token.
+
+        Returns
+        -------
+        waited: float
+        """
+        return getattr(self._waited, "seconds", 0.0)
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pooled session.
+
+        If a rate limiter is registered for the request's host, a token
+        is acquired from it before the request is sent, and throttled
+        (429) and server-side (5xx) responses are retried up to
+        `max_retries` times, each retry taking another token.
+
+        Parameters
+        ----------
+        method: string
+                HTTP method
+        url: string
+             URL to request
+        kwargs: dict
+                Passed on to `requests.Session.request`
+
+        Returns
+        -------
+        response: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        rate_limiter = self.rate_limiters.get(urlparse(url).hostname)
+        if rate_limiter is None:
+            return self.session.request(method, url, **kwargs)
+        for attempt in range(self.max_retries + 1):
+            self._waited.seconds = self.rate_limit_wait() + rate_limiter.acquire()
+            response = self.session.request(method, url, **kwargs)
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt == self.max_retries
+            ):
+                return response
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            if retry_after is not None and retry_after.isdigit():
+                time.sleep(int(retry_after))
+            else:
+                time.sleep(self.backoff_factor * 2**attempt)
+
+    def get(self, url, **kwargs):
+        """Send a GET request."""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Send a POST request."""
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Send a HEAD request."""
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_default_transport():
+    """Get the process-wide transport used when none is supplied.
+
+    Returns
+    -------
+    transport: HTTPTransport
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HTTPTransport()
+        return _default_transport
+
+
+class FTPConnectionPool(object):
+    def __init__(
+        self,
+        pool_maxsize=DEFAULT_FTP_POOL_MAXSIZE,
+        max_idle=DEFAULT_FTP_MAX_IDLE,
+        check_after=DEFAULT_FTP_CHECK_AFTER,
+        timeout=DEFAULT_TIMEOUT,
+        ftp_class=FTP,
+    ):
+        """Initialize a pool of logged in FTP connections.
+
+        Connections are kept per host and handed out again after use,
+        so that many small transfers do not each pay for connecting and
+        logging in. Connections that sat idle for a while are checked
+        with NOOP before reuse, and connections idle for longer than
+        `max_idle` are closed.
+
+        Parameters
+        ----------
+        pool_maxsize: int
+                      Maximum number of idle connections kept per host
+        max_idle: float
+                  Seconds after which an idle connection is closed
+        check_after: float
+                     Idle connections older than this (seconds) are
+                     checked with NOOP before being reused
+        timeout: int
+                 Default timeout (in seconds) for new connections
+        ftp_class: class
+                   FTP client class, `ftplib.FTP` by default
+        """
+        self.pool_maxsize = pool_maxsize
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        self.ftp_class = ftp_class
+        # host => list of (connection, time it was released)
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        """Close the connections that have been idle for too long."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for host, idle in self._idle.items():
+                expired.extend(
+                    ftp for ftp, since in idle if now - since > self.max_idle
+                )
+                idle[:] = [
+                    (ftp, since) for ftp, since in idle if now - since <= self.max_idle
+                ]
+        for ftp in expired:
+            self._close(ftp)
+
+    def acquire(self, host, timeout=None):
+        """Get a logged in connection to `host`.
+
+        Parameters
+        ----------
+        host: string
+              FTP host, for example ftp.sra.ebi.ac.uk
+        timeout: int
+                 Timeout (in seconds) if a new connection is opened
+
+        Returns
+        -------
+        ftp: ftplib.FTP
+             Connection, to be handed back with `release`
+        """
+        self.evict_idle()
+        while True:
+            with self._lock:
+                if not self._idle[host]:
+                    break
+                # most recently used first, it is the least likely to be stale
+                ftp, since = self._idle[host].pop()
+            if time.monotonic() - since < self.check_after:
+                return ftp
+            try:
+                ftp.voidcmd("NOOP")
+                return ftp
+            except Exception:
+                self._close(ftp)
+        ftp = self.ftp_class(host, timeout=timeout or self.timeout)
+        ftp.login()
+        return ftp
+
+    def release(self, host, ftp, discard=False):
+        """Hand a connection back to the pool.
+
+        Parameters
+        ----------
+        host: string
+              Host the connection belongs to
+        ftp: ftplib.FTP
+             Connection obtained from `acquire`
+        discard: bool
+                 Close the connection instead, for example after an error
+                 left it in an unknown state
+        """
+        if not discard:
+            with self._lock:
+                if len(self._idle[host]) < self.pool_maxsize:
+                    self._idle[host].append((ftp, time.monotonic()))
+                    return
+        self._close(ftp)
+
+    def connection(self, host, timeout=None):
+        """Context manager to borrow a connection to `host`.
+
+        The connection is discarded if the block raises.
+        """
+        return _PooledFTP(self, host, timeout)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle = [
+                ftp for connections in self._idle.values() for ftp, _ in connections
+            ]
+            self._idle.clear()
+        for ftp in idle:
+            self._close(ftp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _PooledFTP(object):
+    def __init__(self, pool, host, timeout):
+        self.pool = pool
+        self.host = host
+        self.timeout = timeout
+        self.ftp = None
+
+    def __enter__(self):
+        self.ftp = self.pool.acquire(self.host, self.timeout)
+        return self.ftp
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.host, self.ftp, discard=exc_type is not None)
+
+
+def get_default_ftp_pool():
+    """Get the process-wide FTP connection pool used when none is supplied.
+
+    Returns
+    -------
+    ftp_pool: FTPConnectionPool
+    """
+    global _default_ftp_pool
+    with _default_ftp_pool_lock:
+        if _default_ftp_pool is None:
+            _default_ftp_pool = FTPConnectionPool()
+        return _default_ftp_pool
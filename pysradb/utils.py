@@ -14,6 +14,7 @@ from requests.packages.urllib3.util.retry import Retry
 from tqdm.autonotebook import tqdm
 
 from .exceptions import IncorrectFieldException
+from .transport import get_default_transport
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
@@ -59,13 +60,15 @@ def requests_3_retries():
     return session
 
 
-def scientific_name_to_taxid(name):
+def scientific_name_to_taxid(name, transport=None):
     """Converts a scientific name to its corresponding taxonomy ID.
 
     Parameters
     ----------
     name: str
         Scientific name of interest.
+    transport: HTTPTransport
+        Pooled HTTP transport to use (optional).
 
     Returns
     -------
@@ -78,8 +81,9 @@ def scientific_name_to_taxid(name):
         If the scientific name cannot be found.
 
     """
-
-    r = requests.get(
+    if transport is None:
+        transport = get_default_transport()
+    r = transport.get(
         "https://www.ebi.ac.uk/ena/data/taxonomy/v1/taxon/scientific-name/" + name,
         timeout=5,
     )
@@ -23,3 +23,100 @@ def conf_download_geodb_file():
         return fn
     download_geodb_file(download_dir=os.path.dirname(fn))
     return fn
+
+
+@pytest.fixture(scope="session")
+def local_sradb_file(tmp_path_factory):
+    """A small SRAmetadb.sqlite with two studies, three experiments and four runs"""
+    import sqlite3
+
+    fn = str(tmp_path_factory.mktemp("sradb") / "SRAmetadb.sqlite")
+    studies = [("SRP1", "GSE1"), ("SRP2", "GSE2")]
+    samples = [
+        ("SRS{}".format(i), "GSM{}".format(i), "source: cell", 9606) for i in [1, 2, 3]
+    ]
+    experiments = [
+        ("SRX1", "GSM1", "SRP1", "SRS1"),
+        ("SRX2", "GSM2", "SRP1", "SRS2"),
+        ("SRX3", "GSM3", "SRP2", "SRS3"),
+    ]
+    runs = [
+        ("SRR1", "SRX1", 200, 2),
+        ("SRR2", "SRX1", 300, 3),
+        ("SRR3", "SRX2", 400, 4),
+        ("SRR4", "SRX3", 500, 5),
+    ]
+    db = sqlite3.connect(fn)
+    db.execute("CREATE TABLE metaInfo (name TEXT, value TEXT)")
+    db.execute("INSERT INTO metaInfo VALUES ('schema version', '1.0')")
+    db.execute("CREATE TABLE study (study_accession TEXT, study_alias TEXT)")
+    db.execute(
+        "CREATE TABLE sample (sample_accession TEXT, sample_alias TEXT, "
+        "sample_attribute TEXT, taxon_id INTEGER)"
+    )
+    db.execute(
+        "CREATE TABLE experiment (experiment_accession TEXT, experiment_alias TEXT, "
+        "title TEXT, experiment_attribute TEXT, library_name TEXT, "
+        "library_strategy TEXT, library_source TEXT, library_selection TEXT, "
+        "library_layout TEXT, adapter_spec TEXT, study_accession TEXT, "
+        "sample_accession TEXT)"
+    )
+    db.execute(
+        "CREATE TABLE run (run_accession TEXT, run_alias TEXT, "
+        "experiment_accession TEXT, bases INTEGER, spots INTEGER)"
+    )
+    db.executemany("INSERT INTO study VALUES (?, ?)", studies)
+    db.executemany("INSERT INTO sample VALUES (?, ?, ?, ?)", samples)
+    db.executemany(
+        "INSERT INTO experiment VALUES (?, ?, 'title', NULL, NULL, 'RNA-Seq', "
+        "'TRANSCRIPTOMIC', 'cDNA', 'PAIRED', NULL, ?, ?)",
+        experiments,
+    )
+    db.executemany(
+        "INSERT INTO run VALUES (?, ?, ?, ?, ?)",
+        [(srr, srr + "_alias", srx, bases, spots) for srr, srx, bases, spots in runs],
+    )
+    for table, column in [
+        ("study", "study_accession"),
+        ("sample", "sample_accession"),
+        ("experiment", "experiment_accession"),
+        ("run", "run_accession"),
+    ]:
+        db.execute("CREATE INDEX {0}_idx ON {0} ({1})".format(table, column))
+    columns = [
+        "study_accession",
+        "study_alias",
+        "experiment_accession",
+        "experiment_alias",
+        "experiment_title",
+        "experiment_attribute",
+        "library_name",
+        "library_strategy",
+        "library_source",
+        "library_selection",
+        "library_layout",
+        "adapter_spec",
+        "sample_accession",
+        "sample_alias",
+        "sample_attribute",
+        "taxon_id",
+        "run_accession",
+        "run_alias",
+        "bases",
+        "spots",
+    ]
+    db.execute("CREATE VIRTUAL TABLE sra_ft USING fts4({})".format(",".join(columns)))
+    db.execute(
+        "INSERT INTO sra_ft SELECT experiment.study_accession, study_alias, "
+        "experiment.experiment_accession, experiment_alias, title, "
+        "experiment_attribute, library_name, library_strategy, library_source, "
+        "library_selection, library_layout, adapter_spec, "
+        "experiment.sample_accession, sample_alias, sample_attribute, taxon_id, "
+        "run_accession, run_alias, bases, spots FROM run "
+        "JOIN experiment ON run.experiment_accession = experiment.experiment_accession "
+        "JOIN sample ON experiment.sample_accession = sample.sample_accession "
+        "JOIN study ON experiment.study_accession = study.study_accession"
+    )
+    db.commit()
+    db.close()
+    return fn
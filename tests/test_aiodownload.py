@@ -0,0 +1,92 @@
+"""Tests for aiodownload.py"""
+
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from pysradb.aiodownload import download_files_async
+
+pytest.importorskip("aiohttp")
+
+
+def _content(name):
+    return name.encode("utf-8") * 1000
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serve /<name> with byte range support"""
+
+    def _send_headers(self):
+        content = _content(self.path.strip("/"))
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        return content[start:]
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        self.wfile.write(self._send_headers())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+
+
+def test_download_files_async(tmp_path, server):
+    """Test if many files are downloaded, resumed and verified"""
+    names = ["SRR{}".format(i) for i in range(50)]
+    jobs = [
+        {
+            "url": "{}/{}".format(server, name),
+            "file_path": str(tmp_path / name),
+            "md5": hashlib.md5(_content(name)).hexdigest(),
+        }
+        for name in names
+    ]
+    # a partial file left by an earlier attempt
+    with open(str(tmp_path / "SRR0.part"), "wb") as f:
+        f.write(_content("SRR0")[:100])
+    finished = []
+    download_files_async(
+        jobs,
+        concurrency=8,
+        callback=lambda job, error: finished.append((job["file_path"], error)),
+        show_progress=False,
+    )
+    assert len(finished) == 50
+    assert all(error is None for _, error in finished)
+    for name in names:
+        with open(str(tmp_path / name), "rb") as f:
+            assert f.read() == _content(name)
+
+
+def test_download_files_async_md5_mismatch(tmp_path, server):
+    """Test if files failing MD5 verification are reported and removed"""
+    job = {
+        "url": "{}/SRR1".format(server),
+        "file_path": str(tmp_path / "SRR1"),
+        "md5": hashlib.md5(b"").hexdigest(),
+    }
+    with pytest.raises(RuntimeError, match="1 of 1 downloads failed"):
+        download_files_async([job], retries=0, show_progress=False)
+    assert not os.path.exists(job["file_path"])
+    assert not os.path.exists(job["file_path"] + ".part")
@@ -0,0 +1,124 @@
+"""Tests for aspera.py"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+from pysradb.aspera import AsperaTransfer
+from pysradb.aspera import parse_aspera_url
+
+# Writes every destination of the pair list, except that the first run
+# on a file leaves it partial (.aspx) and exits with an error
+FAKE_ASCP = """#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+pair_list = [a for a in args if a.startswith("--file-pair-list=")][0].split("=", 1)[1]
+target_dir = args[-1]
+with open(os.path.join(target_dir, "calls.log"), "a") as f:
+    f.write(" ".join(args) + "\\n")
+lines = open(pair_list).read().split()
+failed = False
+for source, destination in zip(lines[::2], lines[1::2]):
+    path = os.path.join(target_dir, destination)
+    if "flaky" in source and not os.path.exists(path + ".aspx"):
+        open(path + ".aspx", "w").close()
+        open(path, "w").close()
+        failed = True
+        continue
+    if "broken" in source:
+        failed = True
+        continue
+    with open(path, "w") as f:
+        f.write(source)
+    if os.path.exists(path + ".aspx"):
+        os.remove(path + ".aspx")
+    print("{{}} 100% 1KB 10Mb/s 00:00".format(destination))
+if failed:
+    print("ascp: failed to open remote file")
+    sys.exit(1)
+"""
+
+
+@pytest.fixture
+def ascp_bin(tmp_path):
+    path = tmp_path / "ascp"
+    path.write_text(FAKE_ASCP.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_parse_aspera_url():
+    """Test if user, host and path are split, with a default user"""
+    assert parse_aspera_url("era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR1.fastq.gz") == (
+        "era-fasp",
+        "fasp.sra.ebi.ac.uk",
+        "vol1/SRR1.fastq.gz",
+    )
+    assert parse_aspera_url("fasp.sra.ebi.ac.uk:/vol1/SRR1.fastq.gz") == (
+        "era-fasp",
+        "fasp.sra.ebi.ac.uk",
+        "/vol1/SRR1.fastq.gz",
+    )
+
+
+def test_aspera_transfer(tmp_path, ascp_bin):
+    """Test if files are batched per host, split the rate and are retried"""
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    urls = [
+        "era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR{}.fastq.gz".format(i) for i in range(6)
+    ] + ["era-fasp@fasp.sra.ebi.ac.uk:vol1/flaky.fastq.gz"]
+    destinations = [os.path.join("SRP1", "SRX1", url.split("/")[-1]) for url in urls]
+    transfer = AsperaTransfer(
+        ascp_bin=ascp_bin,
+        keypath="key.openssh",
+        sessions=2,
+        rate=300,
+        batch_size=100,
+        backoff=0.01,
+        show_progress=False,
+    )
+    status = transfer.run(urls, destinations, str(out_dir))
+    assert set(status.values()) == {"done"}
+    for url, destination in zip(urls, destinations):
+        with open(str(out_dir / destination)) as f:
+            assert f.read() == url.split(":", 1)[1]
+        assert not os.path.exists(str(out_dir / destination) + ".aspx")
+    calls = (out_dir / "calls.log").read_text().splitlines()
+    # two sessions, then a retry of the flaky file
+    assert len(calls) == 3
+    assert all("-l 150m" in call for call in calls)
+    assert all("--host=fasp.sra.ebi.ac.uk" in call for call in calls)
+    assert all("-i key.openssh" in call for call in calls)
+    assert all("-O 33001 -P33001" in call for call in calls)
+    # completed files are not transferred again
+    assert set(transfer.run(urls, destinations, str(out_dir)).values()) == {"done"}
+    assert len((out_dir / "calls.log").read_text().splitlines()) == 3
+
+
+def test_aspera_transfer_failure(tmp_path, ascp_bin):
+    """Test if files failing every attempt are reported"""
+    out_dir = tmp_path / "out"
+    urls = [
+        "era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR1.fastq.gz",
+        "era-fasp@fasp.sra.ebi.ac.uk:vol1/broken.fastq.gz",
+    ]
+    transfer = AsperaTransfer(
+        ascp_bin=ascp_bin, retries=1, backoff=0.01, show_progress=False
+    )
+    results = {}
+    with pytest.raises(RuntimeError, match="1 of 2 aspera transfers failed"):
+        transfer.run(
+            urls,
+            ["SRR1.fastq.gz", "broken.fastq.gz"],
+            str(out_dir),
+            callback=lambda url, error: results.setdefault(url, error),
+        )
+    assert results[urls[0]] is None
+    assert "ascp exited with" in str(results[urls[1]])
+    assert os.path.exists(str(out_dir / "SRR1.fastq.gz"))
+    assert len((out_dir / "calls.log").read_text().splitlines()) == 2
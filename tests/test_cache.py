@@ -0,0 +1,76 @@
+"""Tests for cache.py"""
+
+import json
+import zlib
+
+import pytest
+
+from pysradb.cache import ResponseCache
+from pysradb.exceptions import CacheMissException
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_normalized_keys(cache):
+    """Test if equivalent accession lists share a cache entry"""
+    cache.set("esummary", {"db": "sra", "term": ["SRP2", "SRP1"]}, {"uids": ["1"]})
+    assert cache.get("esummary", {"db": "sra", "term": ["SRP1", "SRP2", "SRP1"]}) == {
+        "uids": ["1"]
+    }
+    assert cache.get("esummary", {"db": "geo", "term": ["SRP1", "SRP2"]}) is None
+
+
+def test_ttl(tmp_path):
+    """Test if expired entries are not returned"""
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl={"efetch": -1})
+    cache.set("efetch", {"term": "SRP1"}, [1, 2])
+    cache.set("esummary", {"term": "SRP1"}, [1, 2])
+    assert cache.get("efetch", {"term": "SRP1"}) is None
+    assert cache.get("esummary", {"term": "SRP1"}) == [1, 2]
+    cache.close()
+
+
+def test_lru_eviction(tmp_path):
+    """Test if least recently used entries are evicted first"""
+    # room for two of the three entries
+    size = len(zlib.compress(json.dumps("a" * 10).encode("utf-8")))
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_size=2 * size)
+    cache.set("esummary", {"term": "SRP1"}, "a" * 10)
+    cache.set("esummary", {"term": "SRP2"}, "b" * 10)
+    cache.get("esummary", {"term": "SRP1"})
+    cache.set("esummary", {"term": "SRP3"}, "c" * 10)
+    assert cache.get("esummary", {"term": "SRP2"}) is None
+    assert cache.get("esummary", {"term": "SRP1"}) == "a" * 10
+    assert cache.get("esummary", {"term": "SRP3"}) == "c" * 10
+    cache.close()
+
+
+def test_offline(tmp_path):
+    """Test if offline mode never fetches"""
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), offline=True)
+    cache.set("ena_filereport", {"accession": "SRP1"}, "run_accession\tfastq_ftp")
+    assert (
+        cache.get_or_fetch("ena_filereport", {"accession": "SRP1"}, None)
+        == "run_accession\tfastq_ftp"
+    )
+    with pytest.raises(CacheMissException):
+        cache.get_or_fetch("ena_filereport", {"accession": "SRP2"}, None)
+    cache.close()
+
+
+def test_get_or_fetch(cache):
+    """Test if misses are fetched once and then served from the cache"""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"result": 1}
+
+    assert cache.get_or_fetch("efetch", {"term": "SRX1"}, fetch) == {"result": 1}
+    assert cache.get_or_fetch("efetch", {"term": "SRX1"}, fetch) == {"result": 1}
+    assert len(calls) == 1
@@ -0,0 +1,409 @@
+"""Tests for download.py"""
+
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+import pysradb.download
+from pysradb.cache import ResponseCache
+from pysradb.download import _get_ftp_file_sizes
+from pysradb.download import download_file
+from pysradb.download import get_file_sizes
+from pysradb.transport import FTPConnectionPool
+
+CONTENT = bytes(range(256)) * 40
+
+
+class _RangeResponse:
+    def __init__(self, content, status_code=206, fail_after=None):
+        self.content = content
+        self.status_code = status_code
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise IOError("connection reset")
+            yield self.content[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _RangeTransport:
+    """Serve CONTENT with byte range support"""
+
+    def __init__(self, fail_start=None):
+        self.ranges = []
+        self.fail_start = fail_start
+        self._lock = threading.Lock()
+
+    def head(self, url, **kwargs):
+        response = _RangeResponse(b"", status_code=200)
+        response.headers = CaseInsensitiveDict(
+            {"Content-length": str(len(CONTENT)), "Accept-Ranges": "bytes"}
+        )
+        return response
+
+    def get(self, url, headers=None, **kwargs):
+        start, end = headers["Range"].split("=")[1].split("-")
+        start = int(start)
+        end = int(end) if end else len(CONTENT) - 1
+        with self._lock:
+            self.ranges.append((start, end))
+        fail_after = None
+        if start == self.fail_start:
+            fail_after = 100
+        return _RangeResponse(CONTENT[start : end + 1], fail_after=fail_after)
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    monkeypatch.setattr(pysradb.download, "MIN_SEGMENT_SIZE", 1000)
+    monkeypatch.setattr(pysradb.download, "SEGMENT_CHECKPOINT_SIZE", 50)
+
+
+def test_segmented_download(tmp_path, small_segments):
+    """Test if a file is fetched as parallel byte ranges"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    transport = _RangeTransport()
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        md5_hash=hashlib.md5(CONTENT).hexdigest(),
+        block_size=64,
+        transport=transport,
+        segments=4,
+    )
+    assert sorted(transport.ranges) == [
+        (0, 2559),
+        (2560, 5119),
+        (5120, 7679),
+        (7680, 10239),
+    ]
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(file_path + ".part")
+    assert not os.path.exists(file_path + ".part.segments")
+
+
+def test_segmented_download_resume(tmp_path, small_segments):
+    """Test if an interrupted download only fetches the missing ranges"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    transport = _RangeTransport(fail_start=5120)
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        block_size=64,
+        transport=transport,
+        segments=4,
+    )
+    assert not os.path.exists(file_path)
+    with open(file_path + ".part.segments") as f:
+        segments = json.load(f)["segments"]
+    assert [done for _, _, done in segments] == [2560, 2560, 128, 2560]
+
+    transport = _RangeTransport()
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        block_size=64,
+        transport=transport,
+        segments=4,
+    )
+    assert transport.ranges == [(5248, 7679)]
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(file_path + ".part.segments")
+
+
+def test_segmented_download_after_single_stream(tmp_path, small_segments):
+    """Test if a partial single stream download is continued in segments"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    with open(file_path + ".part", "wb") as f:
+        f.write(CONTENT[:4240])
+    transport = _RangeTransport()
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        block_size=64,
+        transport=transport,
+        segments=2,
+    )
+    assert sorted(transport.ranges) == [(4240, 7239), (7240, 10239)]
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_segmented_download_without_ranges(tmp_path, small_segments):
+    """Test if stale segment state is dropped when ranges are unavailable"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    transport = _RangeTransport(fail_start=5120)
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        block_size=64,
+        transport=transport,
+        segments=4,
+    )
+    assert os.path.exists(file_path + ".part.segments")
+
+    head = transport.head
+
+    def head_without_ranges(url, **kwargs):
+        response = head(url, **kwargs)
+        del response.headers["Accept-Ranges"]
+        return response
+
+    transport.head = head_without_ranges
+    transport.fail_start = None
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        block_size=64,
+        transport=transport,
+        segments=2,
+    )
+    assert not os.path.exists(file_path + ".part.segments")
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+
+
+class _CountingLimiter:
+    def __init__(self):
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        with self._lock:
+            self.tokens += tokens
+        return 0
+
+
+def test_download_rate_limiter(tmp_path, small_segments):
+    """Test if every downloaded byte is charged to the bandwidth limit"""
+    rate_limiter = _CountingLimiter()
+    download_file(
+        "https://example.org/SRR000001",
+        str(tmp_path / "SRR000001.sra"),
+        block_size=64,
+        transport=_RangeTransport(),
+        segments=3,
+        rate_limiter=rate_limiter,
+    )
+    assert rate_limiter.tokens == len(CONTENT)
+
+
+class _FakeFTP:
+    """FTP server where every file is as large as its name is long"""
+
+    connections = []
+
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.alive = True
+        self.commands = []
+        _FakeFTP.connections.append(self)
+
+    def login(self):
+        pass
+
+    def voidcmd(self, cmd):
+        self.commands.append(cmd)
+        if not self.alive:
+            raise EOFError()
+
+    def size(self, path):
+        self.commands.append("SIZE " + path)
+        return len(path)
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        self.commands.append((cmd, rest))
+        content = b"x" * len(cmd.split()[1])
+        callback(content[rest or 0 :])
+
+    def quit(self):
+        self.alive = False
+
+    close = quit
+
+
+@pytest.fixture
+def ftp_pool():
+    _FakeFTP.connections = []
+    with FTPConnectionPool(ftp_class=_FakeFTP) as ftp_pool:
+        yield ftp_pool
+
+
+def test_get_file_sizes(tmp_path, monkeypatch, ftp_pool):
+    """Test if sizes are probed concurrently, reusing FTP connections"""
+    monkeypatch.setattr(pysradb.download, "FTP_SIZE_CONNECTIONS", 2)
+    df = pd.DataFrame(
+        {
+            "run_accession": ["SRR{}".format(i) for i in range(7)],
+            "download_url": [None] * 7,
+            "public_url": ["ftp.sra.ebi.ac.uk/" + "x" * i for i in range(6)]
+            + ["https://example.org/SRR6"],
+        }
+    )
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    sizes = get_file_sizes(
+        df, "public_url", transport=_RangeTransport(), cache=cache, ftp_pool=ftp_pool
+    )
+    assert sizes == [1, 2, 3, 4, 5, 6, len(CONTENT)]
+    assert 1 <= len(_FakeFTP.connections) <= 2
+    assert sum(len(ftp.commands) for ftp in _FakeFTP.connections) == 6
+
+    _FakeFTP.connections = []
+    assert get_file_sizes(df, "public_url", cache=cache, ftp_pool=ftp_pool) == sizes
+    assert _FakeFTP.connections == []
+    cache.close()
+
+
+def test_ftp_file_sizes_reconnect(ftp_pool):
+    """Test if a dropped connection is replaced once per path"""
+    size = _FakeFTP.size
+
+    def flaky_size(self, path):
+        if path == "/b" or (path == "/a" and len(_FakeFTP.connections) == 1):
+            raise EOFError()
+        return size(self, path)
+
+    _FakeFTP.size = flaky_size
+    try:
+        sizes = _get_ftp_file_sizes(
+            "ftp.sra.ebi.ac.uk", ["/a", "/b", "/cc"], ftp_pool=ftp_pool
+        )
+    finally:
+        _FakeFTP.size = size
+    assert sizes == [2, 0, 3]
+    assert len(_FakeFTP.connections) == 4
+    # the last connection went back to the pool
+    assert ftp_pool.acquire("ftp.sra.ebi.ac.uk") is _FakeFTP.connections[-1]
+
+
+def test_ftp_file_sizes_dead_host(ftp_pool):
+    """Test if an unreachable host is given up after one connect attempt"""
+    attempts = []
+
+    class _DeadFTP(_FakeFTP):
+        def __init__(self, host, timeout=None):
+            attempts.append(host)
+            raise OSError("connection refused")
+
+    ftp_pool.ftp_class = _DeadFTP
+    sizes = _get_ftp_file_sizes(
+        "ftp.sra.ebi.ac.uk", ["/a", "/b", "/c"], ftp_pool=ftp_pool
+    )
+    assert sizes == [0, 0, 0]
+    assert len(attempts) == 1
+
+
+def test_ftp_pool_reuse(ftp_pool):
+    """Test if connections are reused, health checked and evicted"""
+    ftp = ftp_pool.acquire("ftp.sra.ebi.ac.uk")
+    ftp_pool.release("ftp.sra.ebi.ac.uk", ftp)
+    assert ftp_pool.acquire("ftp.sra.ebi.ac.uk") is ftp
+    assert ftp.commands == []
+
+    # stale connections are checked with NOOP and replaced if dead
+    ftp_pool.check_after = 0
+    ftp_pool.release("ftp.sra.ebi.ac.uk", ftp)
+    ftp.alive = False
+    other = ftp_pool.acquire("ftp.sra.ebi.ac.uk")
+    assert other is not ftp
+    assert ftp.commands == ["NOOP"]
+
+    # connections that failed are not handed out again
+    ftp_pool.release("ftp.sra.ebi.ac.uk", other)
+    with pytest.raises(ValueError):
+        with ftp_pool.connection("ftp.sra.ebi.ac.uk") as ftp:
+            assert ftp is other
+            raise ValueError()
+    assert not other.alive
+    ftp = ftp_pool.acquire("ftp.sra.ebi.ac.uk")
+    assert len(_FakeFTP.connections) == 3
+
+    ftp_pool.max_idle = -1
+    ftp_pool.release("ftp.sra.ebi.ac.uk", ftp)
+    ftp_pool.evict_idle()
+    assert not ftp.alive
+
+
+def test_download_ftp_file_resume(tmp_path, ftp_pool):
+    """Test if FTP downloads resume from the partial file"""
+    file_path = str(tmp_path / "SRR000001_1.fastq.gz")
+    with open(file_path + ".part", "wb") as f:
+        f.write(b"x" * 10)
+    download_file(
+        "ftp.sra.ebi.ac.uk/vol1/fastq/SRR000/SRR000001/SRR000001_1.fastq.gz",
+        file_path,
+        ftp_pool=ftp_pool,
+    )
+    (ftp,) = _FakeFTP.connections
+    path = "/vol1/fastq/SRR000/SRR000001/SRR000001_1.fastq.gz"
+    assert ftp.commands[-1] == ("RETR " + path, 10)
+    assert os.path.getsize(file_path) == len(path)
+    # the connection went back to the pool
+    assert ftp_pool.acquire("ftp.sra.ebi.ac.uk") is ftp
+
+
+def test_inline_md5(tmp_path):
+    """Test if the MD5 covers a resumed prefix and corrupt files are dropped"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    with open(file_path + ".part", "wb") as f:
+        f.write(CONTENT[:1000])
+    transport = _RangeTransport()
+    download_file(
+        "https://example.org/SRR000001",
+        file_path,
+        md5_hash=hashlib.md5(CONTENT).hexdigest(),
+        transport=transport,
+    )
+    assert transport.ranges == [(1000, len(CONTENT) - 1)]
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+
+    file_path = str(tmp_path / "SRR000002.sra")
+    with pytest.raises(Exception, match="MD5"):
+        download_file(
+            "https://example.org/SRR000002",
+            file_path,
+            md5_hash=hashlib.md5(b"").hexdigest(),
+            transport=_RangeTransport(),
+        )
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(file_path + ".part")
+
+
+class _ShortTransport(_RangeTransport):
+    """Server that closes the connection halfway through the file"""
+
+    def get(self, url, headers=None, **kwargs):
+        response = super().get(url, headers=headers, **kwargs)
+        response.content = response.content[: len(CONTENT) // 2]
+        return response
+
+
+def test_size_mismatch_keeps_part(tmp_path):
+    """Test if a short download is kept as .part instead of being moved"""
+    file_path = str(tmp_path / "SRR000001.sra")
+    with pytest.raises(IOError, match="size mismatch"):
+        download_file(
+            "https://example.org/SRR000001", file_path, transport=_ShortTransport()
+        )
+    assert not os.path.exists(file_path)
+    assert os.path.getsize(file_path + ".part") == len(CONTENT) // 2
+    download_file(
+        "https://example.org/SRR000001", file_path, transport=_RangeTransport()
+    )
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
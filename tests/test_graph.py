@@ -0,0 +1,111 @@
+"""Tests for graph.py"""
+
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+from pysradb.graph import AccessionGraph
+from pysradb.graph import accession_type
+from pysradb.sraweb import SRAweb
+
+
+def _record(srp, srx, srs, srr):
+    record = OrderedDict()
+    record["study_accession"] = srp
+    record["experiment_accession"] = srx
+    record["sample_accession"] = srs
+    record["run_accession"] = srr
+    return record
+
+
+RECORDS = [
+    _record("SRP000001", "SRX000001", "SRS000001", "SRR000001"),
+    _record("SRP000001", "SRX000001", "SRS000001", "SRR000002"),
+    _record("SRP000001", "SRX000002", "SRS000002", "SRR000003"),
+]
+
+
+class _OfflineTransport:
+    """Transport that fails on any request"""
+
+    def set_rate_limiter(self, host, rate_limiter):
+        pass
+
+    def get_rate_limiter(self, host):
+        return None
+
+    def get(self, url, **kwargs):
+        raise AssertionError("unexpected request to {}".format(url))
+
+    post = get
+
+
+def test_accession_type():
+    """Test if accession types are recognized"""
+    assert accession_type("SRP016501") == "study"
+    assert accession_type("ERX000001") == "experiment"
+    assert accession_type("GSM1020644") == "gsm"
+    assert accession_type("XYZ1") is None
+
+
+def test_sra_records():
+    """Test if looked up and returned accessions are resolved"""
+    graph = AccessionGraph()
+    graph.add_sra_records("SRP000001", RECORDS)
+    assert len(graph.sra_records("SRP000001")) == 3
+    assert len(graph.sra_records(["SRX000001"])) == 2
+    # all runs of the experiment are returned, as esummary does
+    assert len(graph.sra_records("SRR000001")) == 2
+    # samples are only resolved when looked up directly
+    assert graph.sra_records("SRS000001") is None
+    assert graph.sra_records(["SRX000002", "SRP000002"]) is None
+    assert graph.neighbors("SRX000001", "run") == ["SRR000001", "SRR000002"]
+
+
+def test_sra_table():
+    """Test if a summary table is linked from its accession columns"""
+    graph = AccessionGraph()
+    table = pd.DataFrame(RECORDS, index=[5, 6, 7])
+    table["run_total_spots"] = [1, 2, 3]
+    graph.add_sra_table("SRP000001", table)
+    assert graph.neighbors("SRX000002", "run") == ["SRR000003"]
+    records = graph.sra_records("SRR000002")
+    assert [record["run_accession"] for record in records] == [
+        "SRR000001",
+        "SRR000002",
+    ]
+    assert [record["run_total_spots"] for record in records] == [1, 2]
+
+
+def test_gds_records():
+    """Test if GEO lookups are memoized and add GSM/GSE edges"""
+    graph = AccessionGraph()
+    records = [
+        {"accession": "GSE1", "entrytype": "GSE", "SRA": "SRP000001"},
+        {"accession": "GSM1", "entrytype": "GSM", "SRA": "SRX000001"},
+    ]
+    graph.add_gds_records(["GSE1"], records)
+    assert graph.gds_records("GSE1") == records
+    assert graph.gds_records("GSE2") is None
+    assert graph.neighbors("SRX000001") == ["GSM1"]
+    assert graph.neighbors("SRP000001", "gse") == ["GSE1"]
+
+
+def test_sraweb_conversions_from_graph():
+    """Test if chained conversions are answered without requests"""
+    db = SRAweb(transport=_OfflineTransport())
+    db.graph.add_sra_records("SRP000001", RECORDS)
+    db.graph.add_gds_records(
+        "GSE1", [{"accession": "GSM1", "entrytype": "GSM", "SRA": "SRX000001"}]
+    )
+    df = db.sra_metadata(["SRX000001", "SRX000002"])
+    assert df.run_accession.tolist() == ["SRR000001", "SRR000002", "SRR000003"]
+    df = db.sra_metadata("SRR000003")
+    assert df.study_accession.tolist() == ["SRP000001"]
+    df = db.srx_to_gsm("SRX000001")
+    assert df.experiment_alias.tolist() == ["GSM1"]
+    df = db.gsm_to_srx("GSM1")
+    assert df.experiment_accession.tolist() == ["SRX000001"]
+    with pytest.raises(AssertionError):
+        db.sra_metadata("SRS000001")
@@ -0,0 +1,99 @@
+"""Tests for manifest.py"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import pysradb.sradb
+from pysradb.exceptions import MD5MismatchException
+from pysradb.manifest import CORRUPT
+from pysradb.manifest import DONE
+from pysradb.manifest import PENDING
+from pysradb.manifest import DownloadManifest
+from pysradb.sraweb import SRAweb
+
+
+def test_manifest(tmp_path):
+    """Test if entries keep their state unless their URL changes"""
+    file_path = str(tmp_path / "SRP1" / "SRX1" / "SRR1.sra")
+    with DownloadManifest(str(tmp_path)) as manifest:
+        assert manifest.get([file_path]) == [None]
+        manifest.add([{"file_path": file_path, "url": "https://a/SRR1", "size": 10}])
+        manifest.update(file_path, DONE, bytes_done=10)
+        manifest.add([{"file_path": file_path, "url": "https://a/SRR1", "size": None}])
+        (entry,) = manifest.get([file_path])
+        assert (entry["status"], entry["size"], entry["bytes_done"]) == (DONE, 10, 10)
+        manifest.add([{"file_path": file_path, "url": "https://b/SRR1", "size": 10}])
+        (entry,) = manifest.get([file_path])
+        assert (entry["status"], entry["url"], entry["bytes_done"]) == (
+            PENDING,
+            "https://b/SRR1",
+            0,
+        )
+    assert os.path.exists(str(tmp_path / ".pysradb_manifest.sqlite"))
+
+
+class _Downloads:
+    """Stand-in for download_file and get_file_sizes"""
+
+    def __init__(self, corrupt=()):
+        self.downloaded = []
+        self.probed = []
+        self.corrupt = set(corrupt)
+
+    def get_file_sizes(self, df, url_col, cache=None):
+        self.probed.extend(df[url_col])
+        return [100] * len(df.index)
+
+    def download_file(self, url, file_path, md5_hash=None, **kwargs):
+        self.downloaded.append(url)
+        if url in self.corrupt:
+            self.corrupt.remove(url)
+            raise MD5MismatchException(url)
+        with open(file_path, "wb") as f:
+            f.write(b"x" * 100)
+
+
+def test_download_manifest(tmp_path, monkeypatch):
+    """Test if restarted downloads skip finished files and retry corrupt ones"""
+    df = pd.DataFrame(
+        {
+            "study_accession": ["SRP1", "SRP1"],
+            "experiment_accession": ["SRX1", "SRX2"],
+            "run_accession": ["SRR1", "SRR2"],
+            "public_url": ["https://example.org/SRR1", "https://example.org/SRR2"],
+        }
+    )
+    downloads = _Downloads(corrupt=["https://example.org/SRR2"])
+    monkeypatch.setattr(pysradb.sradb, "download_file", downloads.download_file)
+    monkeypatch.setattr(pysradb.sradb, "get_file_sizes", downloads.get_file_sizes)
+    db = SRAweb()
+    kwargs = dict(
+        df=df,
+        url_col="public_url",
+        out_dir=str(tmp_path),
+        skip_confirmation=True,
+        retries=0,
+    )
+    with pytest.raises(RuntimeError):
+        db.download(**kwargs)
+    with DownloadManifest(str(tmp_path)) as manifest:
+        entries = manifest.get(
+            [
+                str(tmp_path / "SRP1" / "SRX1" / "SRR1.sra"),
+                str(tmp_path / "SRP1" / "SRX2" / "SRR2.sra"),
+            ]
+        )
+    assert [entry["status"] for entry in entries] == [DONE, CORRUPT]
+
+    downloads.downloaded = []
+    downloads.probed = []
+    db.download(**kwargs)
+    # only the corrupt file is fetched again, with its size from the manifest
+    assert downloads.downloaded == ["https://example.org/SRR2"]
+    assert downloads.probed == []
+
+    downloads.downloaded = []
+    db.download(**kwargs)
+    assert downloads.downloaded == []
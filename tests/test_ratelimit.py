@@ -0,0 +1,103 @@
+"""Tests for ratelimit.py"""
+
+import threading
+import time
+
+from pysradb.ratelimit import RateLimiter
+from pysradb.ratelimit import eutils_rate_limiter
+from pysradb.transport import HTTPTransport
+
+
+def test_rate_limiter_spacing():
+    """Test if consecutive acquires are spaced at the configured rate"""
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    # first token is free, the next four are 1/20 s apart
+    assert time.monotonic() - start >= 4 / 20 - 0.01
+
+
+def test_rate_limiter_threads():
+    """Test if the bucket is shared by concurrent callers"""
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 5 / 20 - 0.01
+
+
+def test_rate_limiter_shared_file(tmp_path):
+    """Test if two limiters sharing a lock file draw from one bucket"""
+    lock_file = str(tmp_path / "eutils.lock")
+    limiter1 = RateLimiter(20, lock_file=lock_file)
+    limiter2 = RateLimiter(20, lock_file=lock_file)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter1.acquire()
+        limiter2.acquire()
+    assert time.monotonic() - start >= 5 / 20 - 0.01
+
+
+def test_eutils_rate_limiter():
+    """Test if the API key raises the E-utilities quota"""
+    assert eutils_rate_limiter().rate == 3
+    assert eutils_rate_limiter(api_key="xyz").rate == 10
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {"Retry-After": "0"}
+
+    def close(self):
+        pass
+
+
+def test_transport_rate_limit_wait():
+    """Test if the transport counts the time each thread waited for tokens"""
+    transport = HTTPTransport()
+    transport.session.request = lambda method, url, **kwargs: _Response(200)
+    transport.set_rate_limiter("example.org", RateLimiter(10))
+    for _ in range(3):
+        transport.get("https://example.org/")
+    assert transport.rate_limit_wait() >= 2 / 10 - 0.01
+    waited = []
+    thread = threading.Thread(target=lambda: waited.append(transport.rate_limit_wait()))
+    thread.start()
+    thread.join()
+    assert waited == [0.0]
+
+
+def test_transport_retries_through_limiter():
+    """Test if throttled responses are retried with a token per attempt"""
+    transport = HTTPTransport(max_retries=2)
+    statuses = [429, 503, 200]
+    transport.session.request = lambda method, url, **kwargs: _Response(statuses.pop(0))
+
+    class _CountingLimiter(RateLimiter):
+        tokens = 0
+
+        def acquire(self, tokens=1):
+            _CountingLimiter.tokens += tokens
+            return 0.0
+
+    limiter = _CountingLimiter(10)
+    transport.set_rate_limiter("example.org", limiter)
+    assert transport.get("https://example.org/").status_code == 200
+    assert _CountingLimiter.tokens == 3
+    # urllib3 does not resend responses of the limited host on its own
+    adapter = transport.session.get_adapter("https://example.org/x")
+    assert not adapter.max_retries.status_forcelist
+    assert transport.session.get_adapter(
+        "https://example.com/"
+    ).max_retries.status_forcelist
+    statuses = [503] * 3
+    assert transport.get("https://example.org/").status_code == 503
+    transport.set_rate_limiter("example.org", None)
+    assert transport.session.get_adapter(
+        "https://example.org/x"
+    ).max_retries.status_forcelist
@@ -0,0 +1,81 @@
+"""Tests for scheduler.py"""
+
+import threading
+import time
+
+import pytest
+
+from pysradb.scheduler import DownloadScheduler
+from pysradb.scheduler import url_host
+
+
+def test_url_host():
+    """Test if hosts are extracted with and without a scheme"""
+    assert (
+        url_host("ftp.sra.ebi.ac.uk/vol1/fastq/SRR000/SRR000001/SRR000001.fastq.gz")
+        == "ftp.sra.ebi.ac.uk"
+    )
+    assert (
+        url_host("https://sra-pub-run-odp.s3.amazonaws.com/sra/SRR000001/SRR000001")
+        == "sra-pub-run-odp.s3.amazonaws.com"
+    )
+    assert url_host(None) is None
+
+
+def test_largest_first():
+    """Test if the largest jobs are started first"""
+    order = []
+    scheduler = DownloadScheduler(threads=1, show_progress=False)
+    results = scheduler.run(
+        lambda item: order.append(item) or item * 2,
+        [1, 2, 3, 4],
+        hosts=["a", "b", "a", "b"],
+        sizes=[10, 40, None, 20],
+    )
+    assert order == [2, 4, 1, 3]
+    assert results == [2, 4, 6, 8]
+
+
+def test_host_connections():
+    """Test if concurrent jobs per host are capped"""
+    lock = threading.Lock()
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+
+    def job(host):
+        with lock:
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+
+    hosts = ["a"] * 6 + ["b"] * 6
+    scheduler = DownloadScheduler(
+        threads=6, host_connections={"a": 1}, show_progress=False
+    )
+    scheduler.run(job, hosts, hosts=hosts)
+    assert peak["a"] == 1
+    assert 1 < peak["b"] <= 4
+
+
+def test_retries():
+    """Test if failed jobs are retried and then reported"""
+    attempts = {}
+
+    def job(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == "flaky" and attempts[item] < 3:
+            raise IOError("connection reset")
+        if item == "broken":
+            raise IOError("not found")
+        return item
+
+    scheduler = DownloadScheduler(
+        threads=2, retries=2, backoff=0.01, show_progress=False
+    )
+    assert scheduler.run(job, ["flaky", "ok"], hosts=["a", "a"]) == ["flaky", "ok"]
+    assert attempts["flaky"] == 3
+    with pytest.raises(RuntimeError, match="1 of 2 downloads failed"):
+        scheduler.run(job, ["broken", "ok"], hosts=["a", "a"])
+    assert attempts["broken"] == 3
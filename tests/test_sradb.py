@@ -1,11 +1,18 @@
 """Tests for sradb.py"""
 
+import gc
 import os
+import threading
 from sqlite3 import OperationalError
+from sqlite3 import ProgrammingError
 
+import pandas as pd
 import pytest
 
+import pysradb.sradb
 from pysradb import SRAdb
+from pysradb.basedb import chunk_params
+from pysradb.sradb import _url_md5s
 from pysradb.filter_attrs import guess_cell_type
 from pysradb.filter_attrs import guess_strain_type
 from pysradb.filter_attrs import guess_tissue_type
@@ -21,3 +28,173 @@ def test_not_valid_file():
         assert os.path.isfile(path) == False
     except OperationalError:
         assert True
+
+
+def test_url_md5s():
+    """Test if download URLs are matched with their MD5 columns"""
+    df = pd.DataFrame(
+        {
+            "public_url": ["https://sra-downloadb.be-md.ncbi.nlm.nih.gov/SRR1"],
+            "public_md5": ["8a2d1e6c7f4e0b0c0d2f1b1e8b7e4a11"],
+            "ena_fastq_http_1": ["http://ftp.sra.ebi.ac.uk/vol1/SRR1_1.fastq.gz"],
+            "ena_fastq_ftp_1": ["era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR1_1.fastq.gz"],
+            "ena_fastq_md5_1": ["0cc175b9c0f1b6a831c399e269772661"],
+            "ena_fastq_http_2": [pd.NA],
+            "ena_fastq_md5_2": [pd.NA],
+        }
+    )
+    assert _url_md5s(df) == {
+        "https://sra-downloadb.be-md.ncbi.nlm.nih.gov/SRR1": "8a2d1e6c7f4e0b0c0d2f1b1e8b7e4a11",
+        "http://ftp.sra.ebi.ac.uk/vol1/SRR1_1.fastq.gz": "0cc175b9c0f1b6a831c399e269772661",
+        "era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR1_1.fastq.gz": "0cc175b9c0f1b6a831c399e269772661",
+    }
+
+
+def test_chunk_params():
+    """Test if chunks are capped and padded to a few statement sizes"""
+    chunks = chunk_params(["SRR{}".format(i) for i in range(11)], chunk_size=8)
+    assert [placeholders.count("?") for placeholders, _ in chunks] == [8, 4]
+    assert chunks[1][1] == ["SRR8", "SRR9", "SRR10", "SRR10"]
+
+
+def test_query_in(local_sradb_file):
+    """Test if long value lists are bound in chunks"""
+    db = SRAdb(local_sradb_file)
+    df = db.query_in(
+        "SELECT run_accession FROM run WHERE run_accession IN ({})",
+        ["SRR1", "SRR2", "SRR3", "SRR4", "SRR1", "SRR9"],
+        chunk_size=2,
+    )
+    assert sorted(df["run_accession"]) == ["SRR1", "SRR2", "SRR3", "SRR4"]
+    assert db.query("SELECT * FROM run WHERE bases > ?", [350]).shape[0] == 2
+    db.close()
+
+
+def test_sra_metadata_exact_lookup(local_sradb_file, monkeypatch):
+    """Test if accession lookups through the base tables match sra_ft MATCH"""
+    db = SRAdb(local_sradb_file)
+    exact = db.sra_metadata(["SRP1", "SRP2"], detailed=True)
+    assert list(exact["run_accession"]) == ["SRR1", "SRR2", "SRR3", "SRR4"]
+    assert list(exact["spots"]) == [2, 3, 4, 5]
+    assert db.srr_to_srx(["srr4", "SRR1"])["experiment_accession"].tolist() == [
+        "SRX1",
+        "SRX3",
+    ]
+    # the same queries through full-text MATCH, in chunks of one term
+    monkeypatch.setattr(pysradb.sradb, "MATCH_CHUNK_SIZE", 1)
+    db._column_sources = {}
+    match = db.sra_metadata(["SRP1", "SRP2"], detailed=True)
+    pd.testing.assert_frame_equal(exact, match, check_dtype=False)
+    assert db.gsm_to_srr(["GSM1", "GSM3"])["run_accession"].tolist() == [
+        "SRR1",
+        "SRR2",
+        "SRR4",
+    ]
+    db.close()
+
+
+def test_query_iter(local_sradb_file):
+    """Test if results are streamed in typed chunks"""
+    db = SRAdb(local_sradb_file)
+    sql = "SELECT run_accession, spots, spots AS spots FROM run ORDER BY run_accession"
+    chunks = list(db.query_iter(sql, chunksize=3, dtype={"spots": "int32"}))
+    assert [len(df.index) for df in chunks] == [3, 1]
+    assert all(list(df.columns) == ["run_accession", "spots"] for df in chunks)
+    assert all(df["spots"].dtype == "int32" for df in chunks)
+    df = db.query(sql, dtype={"spots": "int32"})
+    pd.testing.assert_frame_equal(df, pd.concat(chunks, ignore_index=True))
+    df = db._query(
+        "SELECT run_alias, NULLIF(bases, 200) AS bases FROM run", chunksize=1
+    )
+    assert df["bases"].dtype == "float64"
+    db.close()
+
+
+def test_query_duplicate_columns(local_sradb_file):
+    """Test if a column selected twice keeps its last value"""
+    db = SRAdb(local_sradb_file)
+    df = db.query(
+        "SELECT run.run_alias AS alias, experiment.experiment_alias AS alias, "
+        "run_accession FROM run JOIN experiment USING (experiment_accession) "
+        "ORDER BY run_accession"
+    )
+    assert list(df.columns) == ["alias", "run_accession"]
+    assert list(df["alias"]) == ["GSM1", "GSM1", "GSM2", "GSM3"]
+    db.close()
+
+
+def test_read_profile(local_sradb_file):
+    """Test if connections are tuned for reading and opened per thread"""
+    db = SRAdb(local_sradb_file, immutable=True)
+    connection = db.connection()
+    assert connection.execute("PRAGMA query_only").fetchone()[0] == 1
+    assert connection.execute("PRAGMA temp_store").fetchone()[0] == 2
+    assert connection.execute("PRAGMA cache_size").fetchone()[0] == -262144
+    with pytest.raises(OperationalError):
+        connection.execute("CREATE TABLE scratch (x)")
+    results = {}
+
+    def lookup(srr):
+        results[srr] = (db.connection(), db.srr_to_srx(srr))
+
+    threads = [threading.Thread(target=lookup, args=(srr,)) for srr in ["SRR1", "SRR4"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results["SRR4"][1]["experiment_accession"].tolist() == ["SRX3"]
+    assert len({id(connection), id(results["SRR1"][0]), id(results["SRR4"][0])}) == 3
+    db.close()
+    with pytest.raises(Exception, match="closed"):
+        results["SRR1"][0].execute("SELECT 1")
+
+
+def test_map_query(local_sradb_file):
+    """Test if queries are fanned out over a bounded pool of connections"""
+    db = SRAdb(local_sradb_file, threads=4)
+    queries = [
+        ("SELECT run_accession FROM run WHERE run_accession = ?", [srr])
+        for srr in ["SRR4", "SRR1", "SRR3", "SRR2"] * 5
+    ] + ["SELECT COUNT(*) AS n FROM run"]
+    results = db.map_query(queries, threads=3)
+    assert [df.iloc[0, 0] for df in results[:4]] == ["SRR4", "SRR1", "SRR3", "SRR2"]
+    assert results[-1]["n"].tolist() == [4]
+    assert 1 <= len(db._pool) <= 3
+    # chunked lookups run over the pool as well
+    df = db.query_in(
+        "SELECT run_accession FROM run WHERE run_accession IN ({})",
+        ["SRR1", "SRR2", "SRR3", "SRR4"],
+        chunk_size=1,
+    )
+    assert df["run_accession"].tolist() == ["SRR1", "SRR2", "SRR3", "SRR4"]
+    assert db.sra_metadata(["SRP2", "SRP1"])["run_accession"].tolist() == [
+        "SRR1",
+        "SRR2",
+        "SRR3",
+        "SRR4",
+    ]
+    db.close()
+    assert db._pool == []
+
+
+def test_thread_connections_closed(local_sradb_file):
+    """Test if connections of finished threads are closed, and closed dbs raise"""
+    db = SRAdb(local_sradb_file)
+    connections = []
+
+    def lookup():
+        connections.append(db.connection())
+        db.srr_to_srx("SRR1")
+
+    for _ in range(20):
+        thread = threading.Thread(target=lookup)
+        thread.start()
+        thread.join()
+    gc.collect()
+    assert not any(f.alive for f in db._thread_connections)
+    for connection in connections:
+        with pytest.raises(ProgrammingError):
+            connection.execute("SELECT 1")
+    db.close()
+    with pytest.raises(ProgrammingError, match="closed"):
+        db.query("SELECT * FROM run")
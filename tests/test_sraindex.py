@@ -0,0 +1,77 @@
+"""Tests for sraindex.py"""
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import pysradb.sradb
+from pysradb import SRAdb
+from pysradb.sraindex import AccessionIndex
+from pysradb.sraindex import accession_index_path
+from pysradb.sraindex import build_accession_index
+
+
+@pytest.fixture
+def indexed_sradb_file(tmp_path, local_sradb_file):
+    sqlite_file = str(tmp_path / "SRAmetadb.sqlite")
+    shutil.copy(local_sradb_file, sqlite_file)
+    build_accession_index(sqlite_file)
+    return sqlite_file
+
+
+def test_accession_index(indexed_sradb_file):
+    """Test if accessions are linked to their parents and children"""
+    index = AccessionIndex(accession_index_path(indexed_sradb_file))
+    assert index.descendants(["GSE1"], "run") == ["SRR1", "SRR2", "SRR3"]
+    assert index.descendants(["gsm1", "SRX3"], "run") == ["SRR1", "SRR2", "SRR4"]
+    assert index.descendants(["GSM2"], "sample") == ["SRS2"]
+    assert index.ancestors(["SRR4", "SRR1"], "gse") == ["GSE1", "GSE2"]
+    assert index.ancestors(["SRR9"], "study") == []
+    index.close()
+
+
+def test_sradb_uses_accession_index(indexed_sradb_file, monkeypatch):
+    """Test if GSM and mixed lookups are resolved through the index"""
+    db = SRAdb(indexed_sradb_file)
+    assert db.index is not None
+    monkeypatch.setattr(pysradb.sradb, "_create_query", None)
+    df = db.gsm_to_srr(["GSM1", "GSM3"], detailed=True)
+    assert df["run_accession"].tolist() == ["SRR1", "SRR2", "SRR4"]
+    assert df["study_accession"].tolist() == ["SRP1", "SRP1", "SRP2"]
+    df = db.sra_metadata(["SRP2", "SRX2"])
+    assert df["run_accession"].tolist() == ["SRR3", "SRR4"]
+    db.close()
+
+
+def test_stale_accession_index(indexed_sradb_file):
+    """Test if an index built from another version of the file is ignored"""
+    os.utime(indexed_sradb_file, (0, 0))
+    with pytest.warns(UserWarning, match="metadb index"):
+        db = SRAdb(indexed_sradb_file)
+    assert db.index is None
+    assert db.gsm_to_srr(["GSM3"])["run_accession"].tolist() == ["SRR4"]
+    db.close()
+
+
+def test_accession_index_partial(indexed_sradb_file):
+    """Test if terms missing from the index are still searched for"""
+    with_index = SRAdb(indexed_sradb_file)
+    without_index = SRAdb(indexed_sradb_file)
+    without_index.index.close()
+    without_index.index = None
+    for db in [with_index, without_index]:
+        df = db.gsm_to_srr(["GSM3", "SRR1_alias"], detailed=True)
+        assert df["run_accession"].tolist() == ["SRR1", "SRR4"]
+    pd.testing.assert_frame_equal(
+        with_index.gsm_to_srr(["GSM3", "SRR1_alias"], detailed=True).reset_index(
+            drop=True
+        ),
+        without_index.gsm_to_srr(["GSM3", "SRR1_alias"], detailed=True).reset_index(
+            drop=True
+        ),
+        check_dtype=False,
+    )
+    with_index.close()
+    without_index.close()
@@ -1,11 +1,20 @@
 """Tests for SRAweb"""
 
+import json
 import time
+from collections import OrderedDict
 
 import pandas as pd
 import pytest
+import requests
 
+from pysradb.ratelimit import EUTILS_HOST
 from pysradb.sraweb import SRAweb
+from pysradb.sraweb import _chunk_accessions
+from pysradb.sraweb import _esummary_columns
+from pysradb.sraweb import _iter_efetch_runs
+from pysradb.sraweb import _sra_records_to_df
+from pysradb.transport import HTTPTransport
 
 
 @pytest.fixture(scope="module")
@@ -260,3 +269,446 @@ def test_gse_to_srp3(sraweb_connection):
     # https://github.com/saketkc/pysradb/issues/190
     df = sraweb_connection.gse_to_srp(["GSE89545"])
     assert df["study_accession"].tolist()[0] == "SRP093251"
+
+
+class _PagedTransport:
+    """Offline stand-in for HTTPTransport serving paged esummary results"""
+
+    def __init__(self, n_records, max_page_size=None):
+        self.n_records = n_records
+        self.max_page_size = max_page_size
+        self.requested = []
+
+    def set_rate_limiter(self, host, rate_limiter):
+        pass
+
+    def get_rate_limiter(self, host):
+        return None
+
+    def post(self, url, **kwargs):
+        return _JSONResponse(
+            {
+                "esearchresult": {
+                    "count": str(self.n_records),
+                    "querykey": "1",
+                    "webenv": "WEBENV",
+                    "retstart": "0",
+                }
+            }
+        )
+
+    def get(self, url, params=None, **kwargs):
+        retstart = int(params["retstart"])
+        retmax = int(params["retmax"])
+        if self.max_page_size and retmax > self.max_page_size:
+            raise requests.exceptions.ReadTimeout()
+        self.requested.append((retstart, retmax))
+        # later pages answer first
+        time.sleep(0.05 * max(0, 3 - retstart // retmax))
+        uids = [str(i) for i in range(retstart, min(retstart + retmax, self.n_records))]
+        result = {"uids": uids}
+        for uid in uids:
+            result[uid] = {"uid": uid}
+        return _JSONResponse({"result": result})
+
+
+class _JSONResponse:
+    def __init__(self, data):
+        self.data = data
+        self.headers = {}
+        self.content = json.dumps(data).encode()
+
+    def json(self):
+        return self.data
+
+
+def test_esummary_pages_in_order():
+    """Test if concurrently fetched esummary pages are merged in order"""
+    transport = _PagedTransport(1234)
+    db = SRAweb(transport=transport)
+    result = db.get_esummary_response("sra", ["SRP000001"])
+    assert result["uids"] == [str(i) for i in range(1234)]
+    assert len(transport.requested) == 3
+
+
+def test_esummary_pages_split_on_timeout():
+    """Test if pages that time out are split and the page size shrinks"""
+    transport = _PagedTransport(1000, max_page_size=200)
+    db = SRAweb(transport=transport, retmax=1000)
+    result = db.get_esummary_response("sra", "SRP000001")
+    assert result["uids"] == [str(i) for i in range(1000)]
+    assert all(retmax <= 200 for _, retmax in transport.requested)
+    assert db.retmax["esummary"] <= 250
+
+
+def test_esummary_pages_not_split_on_connection_error():
+    """Test if connection errors are raised instead of splitting pages"""
+    transport = _PagedTransport(1000)
+
+    def get(url, params=None, **kwargs):
+        transport.requested.append(params["retstart"])
+        raise requests.exceptions.ConnectionError()
+
+    transport.get = get
+    db = SRAweb(transport=transport, retmax=1000)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        db.get_esummary_response("sra", "SRP000001")
+    assert len(transport.requested) == 1
+
+
+def test_transport_pool_size():
+    """Test if the connection pool fits chunks fetching pages concurrently"""
+    db = SRAweb(max_workers=12)
+    adapter = db.transport.session.get_adapter("https://eutils.ncbi.nlm.nih.gov")
+    assert adapter._pool_maxsize == 144
+
+
+def test_shared_transport_rate_limiter():
+    """Test if a transport's E-utilities rate limiter is reused"""
+    transport = HTTPTransport()
+    first = SRAweb(transport=transport)
+    second = SRAweb(api_key="key", transport=transport)
+    assert second.rate_limiter is first.rate_limiter
+    assert transport.get_rate_limiter(EUTILS_HOST) is first.rate_limiter
+
+
+def test_plan_pages():
+    """Test if records are spread evenly over pages"""
+    db = SRAweb(transport=_PagedTransport(0), retmax=500)
+    assert db._plan_pages("esummary", 520) == [(0, 260), (260, 260)]
+    assert db._plan_pages("efetch", 300) == [(0, 300)]
+    db.adaptive_retmax = False
+    assert db._plan_pages("esummary", 520) == [(0, 500), (500, 20)]
+
+
+def test_page_latency_excludes_rate_limit_wait():
+    """Test if the wait for the rate limiter is not counted as page latency"""
+    db = SRAweb(transport=_PagedTransport(0))
+    waited = [0.0]
+    db.transport.rate_limit_wait = lambda: waited[0]
+
+    def fetch_page(retstart, retmax):
+        time.sleep(0.2)
+        waited[0] += 0.2
+        return "page", 100
+
+    latencies = []
+    db._update_retmax = lambda endpoint, n_records, elapsed, n_bytes: (
+        latencies.append(elapsed)
+    )
+    assert db._fetch_page_adaptive("efetch", fetch_page, (0, 100)) == ["page"]
+    assert latencies[0] < 0.1
+
+
+def test_chunk_accessions():
+    """Test if accession chunks respect the count and term length limits"""
+    accessions = ["SRR{:06d}".format(i) for i in range(25)]
+    assert [len(x) for x in _chunk_accessions(accessions, chunk_size=10)] == [
+        10,
+        10,
+        5,
+    ]
+    # 9 characters + " OR " per accession
+    assert [len(x) for x in _chunk_accessions(accessions, max_term_length=13 * 7)] == [
+        7,
+        7,
+        7,
+        4,
+    ]
+
+
+def test_resolve_many():
+    """Test if mixed accession types are resolved into one dataframe"""
+    db = SRAweb(transport=_PagedTransport(0))
+    records = []
+    for i in range(4):
+        records.append(
+            OrderedDict(
+                [
+                    ("study_accession", "SRP000001"),
+                    ("experiment_accession", "SRX00000{}".format(i)),
+                    ("sample_accession", "SRS00000{}".format(i)),
+                    ("run_accession", "SRR00000{}".format(i)),
+                ]
+            )
+        )
+    db.graph.add_sra_records("SRP000001", records)
+    db.graph.add_gds_records(
+        ["GSM1"], [{"accession": "GSM1", "entrytype": "GSM", "SRA": "SRX000003"}]
+    )
+    df = db.resolve_many(
+        ["SRR000002", "GSM1", "SRX000001", "SRR000000", "SRR000002"], chunk_size=1
+    )
+    assert df.accession.tolist() == ["SRR000002", "GSM1", "SRX000001", "SRR000000"]
+    assert df.run_accession.tolist() == [
+        "SRR000002",
+        "SRR000003",
+        "SRR000001",
+        "SRR000000",
+    ]
+    assert df.experiment_alias.tolist()[1] == "GSM1"
+    assert df.study_accession.unique().tolist() == ["SRP000001"]
+    assert db.transport.requested == []
+    with pytest.raises(ValueError):
+        db.resolve_many(["SRR000001", "XYZ1"])
+
+
+EFETCH_XML = b"""<?xml version="1.0" encoding="UTF-8" ?>
+<EXPERIMENT_PACKAGE_SET>
+<EXPERIMENT_PACKAGE>
+  <EXPERIMENT accession="SRX000001" alias="GSM1">
+    <EXPERIMENT_ATTRIBUTES>
+      <EXPERIMENT_ATTRIBUTE><TAG>GEO Accession</TAG><VALUE>GSM1</VALUE></EXPERIMENT_ATTRIBUTE>
+    </EXPERIMENT_ATTRIBUTES>
+  </EXPERIMENT>
+  <SAMPLE accession="SRS000001">
+    <SAMPLE_ATTRIBUTES>
+      <SAMPLE_ATTRIBUTE><TAG>tissue</TAG><VALUE>liver</VALUE></SAMPLE_ATTRIBUTE>
+      <SAMPLE_ATTRIBUTE><TAG>empty</TAG></SAMPLE_ATTRIBUTE>
+    </SAMPLE_ATTRIBUTES>
+  </SAMPLE>
+  <RUN_SET>
+    <RUN accession="SRR000001" alias="run1">
+      <EXPERIMENT_REF accession="SRX000001" refname="GSM1"/>
+      <SRAFiles>
+        <SRAFile cluster="public" url="https://sra/SRR000001" size="10">
+          <Alternatives url="https://aws/SRR000001" org="AWS"/>
+        </SRAFile>
+        <SRAFile cluster="Cloud" url="s3://SRR000001" size="10"/>
+      </SRAFiles>
+    </RUN>
+    <RUN accession="SRR000002" alias="run2">
+      <EXPERIMENT_REF accession="SRX000001"/>
+      <SRAFiles>
+        <SRAFile cluster="public" url="https://sra/SRR000002">
+          <Alternatives url="https://ncbi/SRR000002" org="NCBI" free_egress="worldwide"/>
+        </SRAFile>
+      </SRAFiles>
+    </RUN>
+  </RUN_SET>
+</EXPERIMENT_PACKAGE>
+</EXPERIMENT_PACKAGE_SET>
+"""
+
+
+def test_iter_efetch_runs():
+    """Test if efetch XML is flattened into one record per run"""
+    chunks = [EFETCH_XML[i : i + 7] for i in range(0, len(EFETCH_XML), 7)]
+    records = list(_iter_efetch_runs(chunks))
+    assert [record["run_accession"] for record in records] == [
+        "SRR000001",
+        "SRR000002",
+    ]
+    assert records[0]["experiment_accession"] == "SRX000001"
+    assert records[0]["geo accession"] == "GSM1"
+    assert records[0]["public_url"] == "https://sra/SRR000001"
+    assert records[0]["cloud_url"] == "s3://SRR000001"
+    assert records[0]["aws_url"] == "https://aws/SRR000001"
+    assert records[0]["experiment_alias"] == "GSM1"
+    assert records[0]["tissue"] == "liver"
+    assert "empty" not in records[0]
+    # a single SRAFile only contributes its alternatives
+    assert "public_url" not in records[1]
+    assert records[1]["ncbi_free_egress"] == "worldwide"
+    assert records[1]["experiment_alias"] == ""
+    with pytest.raises(ValueError):
+        list(_iter_efetch_runs([b"<eSummaryResult></eSummaryResult>"]))
+
+
+class _StreamResponse:
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+class _EfetchTransport(_PagedTransport):
+    """Offline transport answering efetch with a rate limit error first"""
+
+    def __init__(self):
+        super().__init__(2)
+        self.responses = [
+            _StreamResponse(
+                b'{"error": "API rate limit exceeded"}', {"Retry-After": "0"}
+            ),
+            _StreamResponse(EFETCH_XML),
+        ]
+
+    def get(self, url, params=None, stream=False, **kwargs):
+        assert stream
+        return self.responses.pop(0)
+
+
+def test_fetch_efetch_page_streamed():
+    """Test if a streamed efetch page is retried after a JSON error"""
+    db = SRAweb(transport=_EfetchTransport())
+    columns, n_bytes = db._fetch_efetch_page(
+        {"querykey": "1", "webenv": "WEBENV", "retstart": "0"}, 0, 2
+    )
+    assert columns["run_accession"] == ["SRR000001", "SRR000002"]
+    # fields missing from a run are filled with None
+    assert columns["public_url"] == ["https://sra/SRR000001", None]
+    assert columns["ncbi_free_egress"] == [None, "worldwide"]
+    # blank values are stored as None
+    assert columns["experiment_alias"] == ["GSM1", None]
+    assert n_bytes == len(EFETCH_XML)
+
+
+def _esummary_record(i, runs=None):
+    if runs is None:
+        runs = ["SRR{}{}".format(i, j) for j in range(2)]
+    expxml = (
+        '<Summary><Title>Title {i}</Title><Platform instrument_model="Illumina '
+        'HiSeq 2000">ILLUMINA</Platform><Statistics total_runs="2" '
+        'total_spots="100" total_size="500"/></Summary>'
+        '<Experiment acc="SRX{i}" name="GSM{i}: x &amp; y"/>'
+        '<Study acc="SRP1" name="study"/>'
+        '<Organism taxid="9606" ScientificName="Homo sapiens"/>'
+        '<Sample acc="SRS{i}" name=""/><Instrument ILLUMINA="Illumina HiSeq 2000"/>'
+        "<Library_descriptor><LIBRARY_NAME/><LIBRARY_STRATEGY>RNA-Seq"
+        "</LIBRARY_STRATEGY><LIBRARY_SOURCE>TRANSCRIPTOMIC</LIBRARY_SOURCE>"
+        "<LIBRARY_SELECTION>cDNA</LIBRARY_SELECTION><LIBRARY_LAYOUT> <PAIRED/> "
+        "</LIBRARY_LAYOUT></Library_descriptor>"
+        "<Bioproject>PRJNA1</Bioproject><Biosample>SAMN{i}</Biosample>"
+    ).format(i=i)
+    run_xml = "".join(
+        '<Run acc="{}" total_spots="50" total_bases="500"/>'.format(run) for run in runs
+    )
+    return {"expxml": " " + expxml, "runs": run_xml}
+
+
+def test_esummary_columns():
+    """Test if the summary table is extracted from esummary XML"""
+    result = {"1": _esummary_record(1), "2": _esummary_record(2, runs=[])}
+    df = pd.DataFrame(_esummary_columns(result, ["1", "2"]))
+    assert df.run_accession.tolist()[:2] == ["SRR10", "SRR11"]
+    assert pd.isna(df.run_accession.tolist()[2])
+    assert df.experiment_accession.tolist() == ["SRX1", "SRX1", "SRX2"]
+    assert df.experiment_title[0] == "GSM1: x & y"
+    assert df.library_layout[0] == "PAIRED"
+    assert df.instrument[0] == "Illumina HiSeq 2000"
+    assert df.instrument_model_desc[0] == "ILLUMINA"
+    assert df.organism_taxid[0] == "9606"
+    assert df.library_name[0] is None
+    df = _sra_records_to_df(_esummary_columns(result, ["1", "2"]))
+    assert pd.api.types.is_string_dtype(df.library_strategy)
+    assert df.run_total_spots.tolist()[:2] == ["50", "50"]
+    df = _sra_records_to_df(_esummary_columns(result, ["1", "2"]), typed=True)
+    assert df.library_strategy.dtype == "category"
+    assert df.run_total_spots.dtype == "Int64"
+    assert df.run_total_spots.tolist()[:2] == [50, 50]
+    assert df.sample_title.isna().all()
+    result["3"] = {"expxml": "<Summary>", "runs": ""}
+    with pytest.raises(RuntimeError):
+        _esummary_columns(result, ["1", "3"])
+
+
+ENA_FILEREPORT = (
+    "run_accession\tfastq_ftp\tfastq_md5\r\n"
+    "SRR000001\tftp.sra.ebi.ac.uk/vol1/SRR000001_1.fastq.gz;"
+    "ftp.sra.ebi.ac.uk/vol1/SRR000001_2.fastq.gz\t"
+    "0cc175b9c0f1b6a831c399e269772661;92eb5ffee6ae2fec3ad71c777531578f\n"
+)
+
+
+class _TextResponse(_JSONResponse):
+    def __init__(self, text):
+        super().__init__(None)
+        self.text = text
+        self.status_code = 200
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.text.split("\n"))
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+    def close(self):
+        pass
+
+
+class _MetadataTransport(_PagedTransport):
+    """Offline transport answering esummary, efetch and ENA lookups"""
+
+    def __init__(self):
+        super().__init__(1)
+        self.ena_requests = []
+
+    def post(self, url, data=None, **kwargs):
+        if "ebi.ac.uk" in url:
+            self.ena_requests.append(data["includeAccessions"])
+            return _TextResponse(ENA_FILEREPORT)
+        return super().post(url, data=data, **kwargs)
+
+    def get(self, url, params=None, stream=False, **kwargs):
+        if "esearch" in url:
+            return self.post(url)
+        if "esummary" in url:
+            record = _esummary_record("000001", runs=["SRR000001", "SRR000002"])
+            record["uid"] = "1"
+            return _JSONResponse({"result": {"uids": ["1"], "1": record}})
+        if "efetch" in url:
+            return _StreamResponse(EFETCH_XML)
+        raise AssertionError("unexpected request to {}".format(url))
+
+
+def test_sra_metadata_detailed_offline():
+    """Test if the detailed table joins summary, efetch and ENA columns"""
+    db = SRAweb(transport=_MetadataTransport())
+    df = db.sra_metadata("SRP1", detailed=True)
+    assert df.columns[0] == "run_accession"
+    assert df.run_accession.tolist() == ["SRR000001", "SRR000002"]
+    assert df.experiment_accession.tolist() == ["SRX000001", "SRX000001"]
+    assert df.tissue.tolist() == ["liver", "liver"]
+    assert pd.api.types.is_string_dtype(df.run_total_bases)
+    assert df.ena_fastq_http_1.tolist()[0] == (
+        "http://ftp.sra.ebi.ac.uk/vol1/SRR000001_1.fastq.gz"
+    )
+    assert pd.isna(df.ena_fastq_http_1.tolist()[1])
+    assert "ena_fastq_ftp" in df.columns
+    # both runs are looked up on ENA in one request
+    assert db.transport.ena_requests == ["SRR000001,SRR000002"]
+
+
+def test_fetch_ena_fastq_runs():
+    """Test if ENA lookups are batched and split into mate columns"""
+    db = SRAweb(transport=_MetadataTransport())
+    runs = ["SRR{:06d}".format(i) for i in range(2500)]
+    df = db.fetch_ena_fastq_runs(runs)
+    assert len(db.transport.ena_requests) == 3
+    assert df.run_accession.tolist() == ["SRR000001"] * 3
+    assert df.ena_fastq_ftp_2.tolist()[0] == (
+        "era-fasp@fasp.sra.ebi.ac.uk:vol1/SRR000001_2.fastq.gz"
+    )
+    assert df.ena_fastq_md5_2.tolist()[0] == "92eb5ffee6ae2fec3ad71c777531578f"
+    assert df.ena_fastq_http.isna().all()
+
+
+def test_fetch_ena_search_errors():
+    """Test if failed ENA lookups are retried and then raised"""
+    db = SRAweb(transport=_MetadataTransport())
+    statuses = [503, 429, 200]
+
+    def post(url, data=None, **kwargs):
+        response = _TextResponse(ENA_FILEREPORT)
+        response.status_code = statuses.pop(0)
+        response.headers = {"Retry-After": "0"}
+        return response
+
+    db.transport.post = post
+    assert db._fetch_ena_search(["SRR000001"])["run_accession"] == ["SRR000001"]
+    statuses = [400]
+    with pytest.raises(requests.exceptions.HTTPError):
+        db._fetch_ena_search(["SRR000001"])
+
+
+def test_sra_metadata_typed_columns():
+    """Test if typed columns are returned only when asked for"""
+    db = SRAweb(transport=_MetadataTransport(), typed_columns=True)
+    df = db.sra_metadata("SRP1", detailed=True)
+    assert df.run_total_bases.dtype == "Int64"
+    assert db.sra_metadata("SRP1").run_total_bases.dtype == "Int64"
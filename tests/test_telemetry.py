@@ -0,0 +1,87 @@
+"""Tests for telemetry.py"""
+
+import json
+import os
+
+from requests.structures import CaseInsensitiveDict
+
+from pysradb.download import download_file
+from pysradb.telemetry import DownloadTelemetry
+
+CONTENT = bytes(range(256)) * 40
+
+
+class _Response:
+    def __init__(self, content, status_code=206):
+        self.content = content
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(
+            {"Content-length": str(len(CONTENT)), "Accept-Ranges": "bytes"}
+        )
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+
+class _FlakyTransport:
+    """Serve CONTENT, cutting the first response halfway through"""
+
+    def __init__(self):
+        self.gets = 0
+
+    def head(self, url, **kwargs):
+        return _Response(b"", status_code=200)
+
+    def get(self, url, headers=None, **kwargs):
+        self.gets += 1
+        start = int(headers["Range"].split("=")[1].rstrip("-"))
+        content = CONTENT[start:]
+        if self.gets == 1:
+            content = content[: len(CONTENT) // 2]
+        return _Response(content)
+
+
+def test_download_telemetry(tmp_path):
+    """Test if attempts are reported per file and summed per host"""
+    events = []
+    jsonl_path = str(tmp_path / "metrics.jsonl")
+    prometheus_path = str(tmp_path / "metrics.prom")
+    telemetry = DownloadTelemetry(
+        observers=[events.append],
+        jsonl_path=jsonl_path,
+        prometheus_path=prometheus_path,
+    )
+    transport = _FlakyTransport()
+    file_path = str(tmp_path / "SRR000001.sra")
+    url = "https://example.org/SRR000001"
+    for _ in range(2):
+        try:
+            download_file(
+                url, file_path, block_size=64, transport=transport, telemetry=telemetry
+            )
+        except IOError:
+            pass
+    telemetry.close()
+
+    assert [event["status"] for event in events] == ["failed", "done"]
+    assert [event["retries"] for event in events] == [0, 1]
+    assert [event["bytes"] for event in events] == [len(CONTENT) // 2] * 2
+    assert "size mismatch" in events[0]["error"]
+    assert events[1]["error"] is None
+    assert all(event["host"] == "example.org" for event in events)
+    assert all(event["ttfb"] <= event["duration"] for event in events)
+    with open(jsonl_path) as f:
+        assert [json.loads(line) for line in f] == events
+
+    stats = telemetry.host_stats()["example.org"]
+    assert stats["files"] == 1
+    assert stats["failures"] == 1
+    assert stats["retries"] == 1
+    assert stats["bytes"] == len(CONTENT)
+    with open(prometheus_path) as f:
+        prometheus = f.read()
+    assert 'pysradb_download_bytes_total{host="example.org"} 10240' in prometheus
+    assert 'pysradb_download_failures_total{host="example.org"} 1' in prometheus
+    assert "# TYPE pysradb_download_ttfb_seconds gauge" in prometheus
+    assert not os.path.exists(prometheus_path + ".tmp")